@@ -0,0 +1,58 @@
+"""Compare cold 'todo' invocations with invocations forwarded to 'todo daemon'.
+
+Run against a database where a user is logged in:
+
+    python benchmarks/daemon_startup.py --runs 20 show
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import click
+
+TODO = [sys.executable, "-c", "from to_do_list.client import main; main()"]
+
+
+def time_runs(args, env, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(TODO + list(args), env=env, stdout=subprocess.DEVNULL, check=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def wait_for(path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise click.ClickException("Daemon did not start")
+        time.sleep(0.05)
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option("--runs", type=click.IntRange(min=1), default=10, help="Invocations per mode")
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def main(runs, args):
+    """Time 'todo ARGS' (default: show) cold and through the daemon"""
+    args = args or ("show",)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "todo.sock")
+        cold_env = dict(os.environ, TODO_NO_DAEMON="1")
+        warm_env = dict(os.environ, TODO_SOCKET=path)
+        daemon = subprocess.Popen(TODO + ["daemon", "--socket", path], env=cold_env, stdout=subprocess.DEVNULL)
+        try:
+            wait_for(path)
+            results = {"cold": time_runs(args, cold_env, runs), "daemon": time_runs(args, warm_env, runs)}
+        finally:
+            daemon.terminate()
+            daemon.wait()
+    for mode, timings in results.items():
+        click.echo(f"{mode:>6}: median {statistics.median(timings):8.1f} ms  "
+                   f"min {min(timings):8.1f} ms  max {max(timings):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Concurrency load test: many worker processes sharing one database.
+
+Seeds users like run.py (MODE must be TEST, the tables are recreated), then
+starts --workers processes that run a weighted mix of service operations for
+random users during --duration seconds. Every operation uses a session of its
+own, like a 'todo' command does; with --connections per-call every operation
+also opens a new database connection, as separate 'todo' processes do.
+
+    python benchmarks/loadtest.py --workers 16 --duration 60 -o load.json
+    python benchmarks/loadtest.py --mix show=60,update=30,login=10 -o load.json --baseline base.json
+
+The JSON report holds, per operation, latency percentiles and a histogram,
+throughput and errors by kind (deadlock, serialization, locked, ...), plus
+the connections opened by the workers and, on PostgreSQL, the number of
+server connections sampled during the run. With --baseline the run fails
+when an operation's p95 latency grows, or the total throughput drops, by more
+than the tolerance.
+"""
+import json
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+import click
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from to_do_list.config import get_settings
+from to_do_list.database import Base, Session, get_engine
+from to_do_list.exceptions import TaskNotFoundException
+from to_do_list.models import Task
+from to_do_list.repository import TaskRepository, UserRepository, SessionRepository
+from to_do_list.service import TaskService, UserService
+from to_do_list.tokens import TokenStore
+from run import START_DAY, seed
+
+DEFAULT_MIX = "show=40,search=10,add=20,update=15,delete=10,login=5"
+READS = {"show", "search"}
+# Operations on an existing task, picked before the operation is timed
+TARGETED = {"update", "delete"}
+# Upper bounds (ms) of the histogram buckets, the same for every run so reports can be compared
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+SERVER_CONNECTIONS = text("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()")
+
+
+def random_day(days):
+    return START_DAY + timedelta(days=random.randrange(days))
+
+
+def pick_task(task_service, user, days):
+    """(day, number) of an existing task of the user, None if the picked day has none"""
+    day = random_day(days)
+    with Session(read_only=True) as session:
+        numbers = [task.id for task in task_service.get_tasks(session, user_id=user["id"], task_date=day)]
+    return (day, random.choice(numbers)) if numbers else None
+
+
+def operations(task_service, user_service, days, tasks_per_day):
+    def show(session, user, target):
+        task_service.get_tasks(session, user_id=user["id"], task_date=random_day(days))
+
+    def search(session, user, target):
+        task_service.search(session, user["id"], f"benchmark task {random.randint(1, tasks_per_day)}", limit=20)
+
+    def add(session, user, target):
+        task_service.create(session, Task(task_description="Load test task", task_date=random_day(days), done=False, important=False, user_id=user["id"]))
+        session.commit()
+
+    def update(session, user, target):
+        day, number = target
+        task_service.update(session, day, number, user["id"], done=bool(random.getrandbits(1)))
+        session.commit()
+
+    def delete(session, user, target):
+        # Delete and re-add so the day keeps its size
+        day, number = target
+        count = task_service.delete_many(session, day, user["id"], [(number, number)], {})
+        if count == 0:
+            raise TaskNotFoundException(number, day)
+        task_service.create_many(session, [
+            {"user_id": user["id"], "task_date": day, "task_description": "Refill", "done": False, "important": False}
+            for _ in range(count)
+        ])
+        session.commit()
+
+    def login(session, user, target):
+        user_service.login(session, user["name"], "bench")
+        session.commit()
+
+    return {"show": show, "search": search, "add": add, "update": update, "delete": delete, "login": login}
+
+
+def parse_mix(ctx, param, value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in READS | {"add", "update", "delete", "login"} or not weight.strip().isdigit():
+            raise click.BadParameter(f"{item!r} is not OPERATION=WEIGHT with a known operation")
+        mix[name.strip()] = int(weight)
+    if sum(mix.values()) == 0:
+        raise click.BadParameter("At least one weight must be positive")
+    return mix
+
+
+def error_kind(error):
+    code = getattr(error.orig, "sqlstate", None)
+    if code == "40P01":
+        return "deadlock"
+    if code == "40001":
+        return "serialization"
+    if "database is locked" in str(error.orig):
+        return "locked"
+    if error.connection_invalidated:
+        return "connection"
+    return type(error.orig).__name__
+
+
+def worker(index, users, mix, days, tasks_per_day, duration, per_call, barrier, results):
+    random.seed(index)
+    engine = get_engine()
+    opened = [0]
+    event.listen(engine, "connect", lambda *args: opened.__setitem__(0, opened[0] + 1))
+    task_service = TaskService(TaskRepository())
+    user_service = UserService(UserRepository(), SessionRepository(), TokenStore())
+    available = operations(task_service, user_service, days, tasks_per_day)
+    names, weights = zip(*mix.items())
+    timings = {name: [] for name in names}
+    errors = {name: Counter() for name in names}
+    barrier.wait()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        name = random.choices(names, weights)[0]
+        user = random.choice(users)
+        target = pick_task(task_service, user, days) if name in TARGETED else None
+        if name in TARGETED and target == None:
+            errors[name]["not_found"] += 1
+            continue
+        start = time.perf_counter()
+        with Session(read_only=name in READS) as session:
+            try:
+                available[name](session, user, target)
+                timings[name].append((time.perf_counter() - start) * 1000)
+            except TaskNotFoundException:
+                # A concurrent delete got there first. Misses are counted, not timed
+                errors[name]["not_found"] += 1
+            except DBAPIError as e:
+                session.rollback()
+                errors[name][error_kind(e)] += 1
+        if per_call:
+            engine.dispose()
+    results.put({"timings": timings, "errors": {name: dict(counts) for name, counts in errors.items()}, "connections": opened[0]})
+
+
+def sample_connections(engine, samples, stop, interval=0.5):
+    with engine.connect() as connection:
+        while not stop.wait(interval):
+            samples.append(connection.execute(SERVER_CONNECTIONS).scalar_one())
+            connection.rollback()
+
+
+def percentile(timings, p):
+    return round(timings[min(len(timings) - 1, int(len(timings) * p))], 3) if timings else None
+
+
+def histogram(timings):
+    counts = Counter()
+    for timing in timings:
+        counts[next((f"<={bound}" for bound in BUCKETS if timing <= bound), f">{BUCKETS[-1]}")] += 1
+    return {bucket: counts[bucket] for bucket in [f"<={bound}" for bound in BUCKETS] + [f">{BUCKETS[-1]}"]}
+
+
+def summarize(timings, errors, duration):
+    timings.sort()
+    return {
+        "count": len(timings),
+        "throughput_per_s": round(len(timings) / duration, 2),
+        "errors": dict(errors),
+        "p50_ms": percentile(timings, 0.5),
+        "p95_ms": percentile(timings, 0.95),
+        "p99_ms": percentile(timings, 0.99),
+        "max_ms": round(timings[-1], 3) if timings else None,
+        "histogram": histogram(timings)
+    }
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name, {}).get("p95_ms")
+        if before and result["p95_ms"] != None and result["p95_ms"] > before * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']} ms, baseline {before} ms")
+    before = baseline["totals"]["throughput_per_s"]
+    if report["totals"]["throughput_per_s"] < before * (1 - tolerance):
+        regressions.append(f"throughput: {report['totals']['throughput_per_s']}/s, baseline {before}/s")
+    return regressions
+
+
+@click.command()
+@click.option("--workers", type=click.IntRange(min=1), default=8, help="Number of worker processes")
+@click.option("--users", type=click.IntRange(min=1), default=20, help="Number of simulated users")
+@click.option("--days", type=click.IntRange(min=1), default=30, help="Days of tasks per user")
+@click.option("--tasks-per-day", type=click.IntRange(min=10), default=50, help="Tasks per user and day")
+@click.option("--duration", type=click.FloatRange(min=1), default=30, help="Seconds to run")
+@click.option("--mix", callback=parse_mix, default=DEFAULT_MIX, show_default=True, help="Operations and their weights")
+@click.option("--connections", type=click.Choice(["pooled", "per-call"]), default="per-call", help="Keep a connection per worker or open one per operation (per-call by default, like 'todo' commands)")
+@click.option("-o", "--output", type=click.File("w"), default="-", help="File for the JSON report (stdout by default)")
+@click.option("--baseline", type=click.File("r"), default=None, help="JSON report to compare with")
+@click.option("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline (0.25 = 25%)")
+def main(workers, users, days, tasks_per_day, duration, mix, connections, output, baseline, tolerance):
+    """Seed a test database and run concurrent service operations from many processes"""
+    settings = get_settings()
+    if settings.MODE != "TEST":
+        raise click.ClickException("The load test recreates all tables. Run it with MODE=TEST")
+    engine = get_engine()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    user_service = UserService(UserRepository(), SessionRepository(), TokenStore())
+    with Session() as session:
+        user_ids = seed(session, TaskService(TaskRepository()), user_service, users, days, tasks_per_day)
+    simulated = [{"id": user_id, "name": f"bench{i}"} for i, user_id in enumerate(user_ids)]
+    # Workers must not inherit the connections of this process
+    engine.dispose()
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(i, simulated, mix, days, tasks_per_day, duration, connections == "per-call", barrier, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    samples, stop = [], threading.Event()
+    sampler = None
+    if engine.dialect.name == "postgresql":
+        sampler = threading.Thread(target=sample_connections, args=(engine, samples, stop), daemon=True)
+    barrier.wait()
+    if sampler != None:
+        sampler.start()
+    # Results are read before joining: a worker does not exit while its result is still queued
+    reports = [results.get() for _ in processes]
+    stop.set()
+    for process in processes:
+        process.join()
+    if sampler != None:
+        sampler.join()
+    timings = {name: [] for name in mix}
+    errors = {name: Counter() for name in mix}
+    for report in reports:
+        for name in mix:
+            timings[name].extend(report["timings"][name])
+            errors[name].update(report["errors"][name])
+    total_errors = sum(errors.values(), Counter())
+    report = {
+        "config": {
+            "workers": workers, "users": users, "days": days, "tasks_per_day": tasks_per_day, "duration": duration,
+            "mix": mix, "connections": connections, "backend": engine.dialect.name
+        },
+        "totals": {
+            "operations": sum(len(t) for t in timings.values()),
+            "throughput_per_s": round(sum(len(t) for t in timings.values()) / duration, 2),
+            "errors": dict(total_errors),
+            "deadlocks": total_errors["deadlock"]
+        },
+        "connections": {
+            "opened": sum(report["connections"] for report in reports),
+            "server_max": max(samples) if samples else None,
+            "server_mean": round(sum(samples) / len(samples), 1) if samples else None
+        },
+        "results": {name: summarize(timings[name], errors[name], duration) for name in mix}
+    }
+    for name, result in report["results"].items():
+        click.echo(f"{name:>8}: {result['count']:>7} ops  {result['throughput_per_s']:>9.1f}/s  "
+                   f"p50 {result['p50_ms'] or 0:9.3f} ms  p95 {result['p95_ms'] or 0:9.3f} ms  p99 {result['p99_ms'] or 0:9.3f} ms  "
+                   f"errors {sum(result['errors'].values())}", err=True)
+    json.dump(report, output, indent=2)
+    output.write("\n")
+    if baseline != None:
+        regressions = compare(report, json.load(baseline), tolerance)
+        for regression in regressions:
+            click.echo(f"Regression: {regression}", err=True)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Microbenchmarks for repository, service and CLI hot paths.
+
+Seeds users x days x tasks per day into the database configured by the
+environment (MODE must be TEST, the tables are recreated), times every
+operation and writes the results as JSON:
+
+    python benchmarks/run.py --users 10 --days 30 --tasks-per-day 200 -o results.json
+    python benchmarks/run.py -o results.json --baseline baseline.json --tolerance 0.25
+
+With --baseline the run fails when an operation's median is slower than
+the baseline median by more than the tolerance.
+
+The CLI task cache and offline journal live in a temporary directory, so
+runs neither read nor change the user's own. The cache is always enabled:
+cli_show reads an unchanged day from it, cli_show_cold starts every run with
+an empty cache.
+"""
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+import click
+from click.testing import CliRunner
+from to_do_list.config import get_settings
+from to_do_list.database import Base, Session, get_engine
+from to_do_list.models import Task, User
+from to_do_list.repository import TaskRepository, UserRepository, SessionRepository
+from to_do_list.service import TaskService, UserService
+from to_do_list.tokens import TokenStore
+from to_do_list import cli
+
+START_DAY = date(2024, 1, 1)
+
+
+def seed(session, task_service, user_service, users, days, tasks_per_day):
+    for i in range(users):
+        user_service.create(session, User(user_name=f"bench{i}", user_password="bench"))
+    session.commit()
+    user_ids = [user.id for user in user_service.get_all(session)]
+    for user_id in user_ids:
+        for day in range(days):
+            task_service.create_many(session, [
+                {
+                    "user_id": user_id,
+                    "task_date": START_DAY + timedelta(days=day),
+                    "task_description": f"Benchmark task {n} of day {day}",
+                    "done": n % 3 == 0,
+                    "important": n % 5 == 0
+                }
+                for n in range(tasks_per_day)
+            ])
+        session.commit()
+    return user_ids
+
+
+def measure(operation, runs, setup=None):
+    timings = []
+    for _ in range(runs):
+        if setup != None:
+            setup()
+        start = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "runs": runs,
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "min_ms": round(timings[0], 3)
+    }
+
+
+def benchmarks(session, task_service, user_service, user_id, days, tasks_per_day):
+    random_day = lambda: START_DAY + timedelta(days=random.randrange(days))
+    random_number = lambda: random.randint(1, tasks_per_day)
+    runner = CliRunner()
+
+    def create():
+        task_service.create(session, Task(task_description="New task", task_date=random_day(), done=False, important=False, user_id=user_id))
+        session.commit()
+
+    def update():
+        task_service.update(session, random_day(), random_number(), user_id, done=bool(random.getrandbits(1)))
+        session.commit()
+
+    def update_many():
+        task_service.update_many(session, random_day(), user_id, [(1, 10)], {}, important=True)
+        session.commit()
+
+    def delete():
+        # Delete and re-add so the day keeps its size
+        day = random_day()
+        count = task_service.delete_many(session, day, user_id, [(random_number(), random_number())], {})
+        task_service.create_many(session, [
+            {"user_id": user_id, "task_date": day, "task_description": "Refill", "done": False, "important": False}
+            for _ in range(count)
+        ])
+        session.commit()
+
+    def command(*args):
+        return lambda: runner.invoke(cli.cli, list(args), catch_exceptions=False)
+
+    return {
+        "get_tasks": lambda: task_service.get_tasks(session, user_id=user_id, task_date=random_day()),
+        "iter_tasks_page": lambda: list(task_service.iter_tasks(session, tasks_per_day // 2, 50, user_id=user_id, task_date=random_day())),
+        "get_tasks_in_range_month": lambda: list(task_service.get_tasks_in_range(session, START_DAY, START_DAY + timedelta(days=30), user_id=user_id)),
+        "search": lambda: task_service.search(session, user_id, "benchmark task 7", limit=20),
+        "get_current_user": lambda: user_service.get_current_user(session),
+        "create": create,
+        "update": update,
+        "update_many": update_many,
+        "delete_many": delete,
+        "cli_show": command("show", "--day", START_DAY.isoformat()),
+        # (setup, operation): the setup is not timed
+        "cli_show_cold": (lambda: cli.task_cache().invalidate(user_id), command("show", "--day", START_DAY.isoformat())),
+        "cli_add": command("add", "CLI task", "--day", START_DAY.isoformat()),
+        "cli_update": command("update", START_DAY.isoformat(), "1", "--done"),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result["median_ms"] > baseline[name]["median_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['median_ms']} ms, baseline {baseline[name]['median_ms']} ms")
+    return regressions
+
+
+@click.command()
+@click.option("--users", type=click.IntRange(min=1), default=5, help="Number of seeded users")
+@click.option("--days", type=click.IntRange(min=1), default=30, help="Days of tasks per user")
+@click.option("--tasks-per-day", type=click.IntRange(min=10), default=100, help="Tasks per user and day")
+@click.option("--runs", type=click.IntRange(min=1), default=50, help="Timed runs per operation")
+@click.option("-o", "--output", type=click.File("w"), default="-", help="File for JSON results (stdout by default)")
+@click.option("--baseline", type=click.File("r"), default=None, help="JSON results to compare with")
+@click.option("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline (0.25 = 25%)")
+def main(users, days, tasks_per_day, runs, output, baseline, tolerance):
+    """Seed a test database and time repository, service and CLI operations"""
+    with tempfile.TemporaryDirectory(prefix="todo-benchmarks-") as directory:
+        os.environ.update({
+            "CACHE_DIR": os.path.join(directory, "cache"), "STATE_DIR": os.path.join(directory, "state"),
+            "CACHE_ENABLED": "true", "CACHE_STALE_SECONDS": "0"
+        })
+        get_settings.cache_clear()
+        run(users, days, tasks_per_day, runs, output, baseline, tolerance)
+
+
+def run(users, days, tasks_per_day, runs, output, baseline, tolerance):
+    settings = get_settings()
+    if settings.MODE != "TEST":
+        raise click.ClickException("Benchmarks recreate all tables. Run them with MODE=TEST")
+    engine = get_engine()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    task_service = TaskService(TaskRepository())
+    user_service = UserService(UserRepository(), SessionRepository(), TokenStore())
+    cli.task_service.service = task_service
+    cli.user_service.service = user_service
+    with Session() as session:
+        start = time.perf_counter()
+        user_ids = seed(session, task_service, user_service, users, days, tasks_per_day)
+        seed_seconds = time.perf_counter() - start
+        user_service.login(session, "bench0", "bench")
+        session.commit()
+        results = {}
+        for name, operation in benchmarks(session, task_service, user_service, user_ids[0], days, tasks_per_day).items():
+            setup, operation = operation if isinstance(operation, tuple) else (None, operation)
+            results[name] = measure(operation, runs, setup)
+            click.echo(f"{name:>26}: median {results[name]['median_ms']:9.3f} ms  p95 {results[name]['p95_ms']:9.3f} ms", err=True)
+    report = {
+        "config": {"users": users, "days": days, "tasks_per_day": tasks_per_day, "runs": runs, "backend": engine.dialect.name},
+        "seed_seconds": round(seed_seconds, 3),
+        "results": results
+    }
+    json.dump(report, output, indent=2)
+    output.write("\n")
+    if baseline != None:
+        regressions = compare(results, json.load(baseline)["results"], tolerance)
+        for regression in regressions:
+            click.echo(f"Regression: {regression}", err=True)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import csv
+import json
+from itertools import islice
+import click
+from .custom_types import DAY, MAX_DESCRIPTION_LENGTH
+
+TRUE_VALUES = ("1", "true", "t", "yes", "y")
+FALSE_VALUES = ("", "0", "false", "f", "no", "n")
+EXPORT_COLUMNS = ("task_date", "number", "task_description", "done", "important")
+SHOW_COLUMNS = ("task_date", "id", "task_description", "done", "important")
+
+
+def detect_format(stream):
+    name = getattr(stream, "name", "")
+    if isinstance(name, str) and name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return "csv"
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, raw row) pairs without loading the whole input"""
+    if fmt == "jsonl":
+        for line, text in enumerate(stream, start=1):
+            if text.strip():
+                yield line, text.rstrip("\n")
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = "" if value is None else str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"{value!r} is not a boolean value.")
+
+
+def parse_task(row, user_id):
+    """Validate a raw row with the same rules as 'todo add' and turn it into task values"""
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except json.JSONDecodeError:
+            raise ValueError("Malformed JSON.")
+    if not isinstance(row, dict):
+        raise ValueError("Row should be an object.")
+    description = row.get("task_description", row.get("description"))
+    if not description:
+        raise ValueError("Task description is missing.")
+    if not isinstance(description, str):
+        raise ValueError("Task description should be a text.")
+    if len(description) > MAX_DESCRIPTION_LENGTH:
+        raise ValueError(f"Too long task. It should contain no more than {MAX_DESCRIPTION_LENGTH} symbols.")
+    try:
+        task_date = DAY.convert(str(row.get("task_date", row.get("day")) or "today"), None, None)
+    except click.BadParameter as e:
+        raise ValueError(e.message)
+    return {
+        "user_id": user_id,
+        "task_date": task_date,
+        "task_description": description,
+        "done": parse_bool(row.get("done")),
+        "important": parse_bool(row.get("important"))
+    }
+
+
+def read_tasks(stream, fmt, user_id):
+    """Yield (line number, raw row, task values, error) for every input row"""
+    for line, row in read_rows(stream, fmt):
+        try:
+            yield line, row, parse_task(row, user_id), None
+        except ValueError as e:
+            yield line, row, None, str(e)
+
+
+def write_reject(stream, line, row, error):
+    stream.write(json.dumps({"line": line, "error": error, "row": row}, ensure_ascii=False) + "\n")
+
+
+def write_rows(stream, rows, fmt, columns):
+    """Write rows straight from result tuples, one at a time. Formats: csv, tsv, jsonl, json (an array)"""
+    count = 0
+    if fmt == "jsonl":
+        for row in rows:
+            stream.write(json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False) + "\n")
+            count += 1
+    elif fmt == "json":
+        stream.write("[")
+        for row in rows:
+            stream.write(("\n" if count == 0 else ",\n") + json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False))
+            count += 1
+        stream.write("\n]\n" if count else "]\n")
+    else:
+        writer = csv.writer(stream, delimiter="\t" if fmt == "tsv" else ",", lineterminator="\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
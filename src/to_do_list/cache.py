@@ -0,0 +1,76 @@
+import json
+import os
+import sqlite3
+import time
+from datetime import date
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS day_tasks (
+    user_id INTEGER NOT NULL,
+    task_date TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    checked_at REAL NOT NULL,
+    tasks TEXT NOT NULL,
+    PRIMARY KEY (user_id, task_date)
+)
+"""
+FIELDS = ("task_description", "task_date", "done", "important", "user_id", "id")
+
+
+class TaskCache:
+    """On-disk cache of per-(user, day) task lists, validated against the user's tasks version"""
+
+    def __init__(self, path, max_entries=256, stale_seconds=0):
+        self.path = path
+        self.max_entries = max_entries
+        self.stale_seconds = stale_seconds
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection == None:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._connection.execute(SCHEMA)
+        return self._connection
+
+    def get(self, user_id, day):
+        """Return (version, is_fresh, tasks) or None when the day is not cached"""
+        row = self.connection.execute(
+            "SELECT version, checked_at, tasks FROM day_tasks WHERE user_id = ? AND task_date = ?",
+            (user_id, day.isoformat())
+        ).fetchone()
+        if row == None:
+            return None
+        version, checked_at, tasks = row
+        return version, time.time() - checked_at < self.stale_seconds, self.decode(tasks)
+
+    def put(self, user_id, day, version, tasks):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO day_tasks VALUES (?, ?, ?, ?, ?)",
+            (user_id, day.isoformat(), version, time.time(), self.encode(tasks))
+        )
+        self.connection.execute(
+            "DELETE FROM day_tasks WHERE rowid NOT IN (SELECT rowid FROM day_tasks ORDER BY checked_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+    def touch(self, user_id, day):
+        self.connection.execute(
+            "UPDATE day_tasks SET checked_at = ? WHERE user_id = ? AND task_date = ?",
+            (time.time(), user_id, day.isoformat())
+        )
+
+    def invalidate(self, user_id):
+        self.connection.execute("DELETE FROM day_tasks WHERE user_id = ?", (user_id,))
+
+    def encode(self, tasks):
+        return json.dumps([[getattr(task, field) for field in FIELDS] for task in tasks], default=str)
+
+    def decode(self, text):
+        tasks = []
+        for values in json.loads(text):
+            task = dict(zip(FIELDS, values))
+            task["task_date"] = date.fromisoformat(task["task_date"])
+            tasks.append(task)
+        return tasks
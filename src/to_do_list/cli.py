@@ -1,60 +1,605 @@
 import click
-from sqlalchemy.exc import ProgrammingError, OperationalError, IntegrityError
-from .custom_types import DAY
-from .models import Task, User
-from .service import TaskService, UserService
-from .repository import TaskRepository, UserRepository, SessionRepository
-from .exceptions import SessionHasExpiredException, UserNotLoggedInException, TaskNotFoundException
-from .database import db_init, Session
+import os
+import shlex
+import time
+from contextlib import contextmanager
+from heapq import merge
+from itertools import chain
+from functools import lru_cache
+from datetime import date, timedelta
+from .custom_types import DAY, IDS, MAX_DESCRIPTION_LENGTH, RECURRENCE_RULES, RecurringId, week_of, month_of
+from . import bulk
+from .exceptions import SessionHasExpiredException, UserNotLoggedInException, TaskNotFoundException, RecurringTaskNotFoundException
 
 
+# Database modules are imported on first use, so 'todo --help' and usage
+# errors do not pay for SQLAlchemy, pydantic and the engine.
+class LazyService:
+    def __init__(self, factory):
+        self.factory = factory
+        self.service = None
 
-user_service = UserService(UserRepository(), SessionRepository())
-task_service = TaskService(TaskRepository())
+    def __getattr__(self, name):
+        if self.service == None:
+            self.service = self.factory()
+        return getattr(self.service, name)
+
+
+def create_user_service():
+    from datetime import timedelta
+    from .config import get_settings
+    from .service import UserService
+    from .repository import UserRepository, SessionRepository
+    from .tokens import TokenStore
+    settings = get_settings()
+    token_store = TokenStore(os.path.join(settings.STATE_DIR, "session"))
+    session_ttl = timedelta(minutes=settings.SESSION_TTL_MINUTES)
+    return UserService(UserRepository(), SessionRepository(), token_store, settings.signing_key, session_ttl)
+
+def create_task_service():
+    from .service import TaskService
+    from .repository import TaskRepository
+    return TaskService(TaskRepository())
+
+
+user_service = LazyService(create_user_service)
+task_service = LazyService(create_task_service)
+
+@contextmanager
+def database_errors():
+    from pydantic import ValidationError
+    from sqlalchemy.exc import ProgrammingError, OperationalError
+    try:
+        yield
+    except ValidationError:
+        fail("Database settings are missing. Define them in .dev.env or environment variables")
+    except ProgrammingError:
+        fail("Please initialize database first. Use command 'todo init'")
+    except OperationalError as e:
+        if missing_tables(e):
+            fail("Please initialize database first. Use command 'todo init'")
+        else:
+            fail("Lost connection with database")
+
+def missing_tables(error):
+    # SQLite reports missing tables as operational errors
+    return "no such table" in str(error.orig)
+
+@lru_cache
+def offline_journal():
+    from .config import get_settings
+    from .journal import Journal
+    return Journal(os.path.join(get_settings().STATE_DIR, "journal.jsonl"))
+
+@contextmanager
+def offline_fallback(write):
+    """Journal 'write' if the database cannot be reached, instead of losing it. See journal.py"""
+    from sqlalchemy.exc import OperationalError
+    from .database import unreachable
+    try:
+        yield
+    except OperationalError as e:
+        # An atomic batch is rolled back as a whole, so its writes are not journaled one by one
+        if write == None or not unreachable(e) or (current_batch != None and current_batch.atomic):
+            raise
+        offline_journal().append(write)
+        click.echo("Database is unreachable. The change is saved locally and will be written by 'todo sync' or the next command")
+
+def sync_journal(session):
+    """Replay the writes journaled while the database was unreachable. Returns their number"""
+    journal = offline_journal()
+    if not journal.pending():
+        return 0
+    # The replay checks which entries were applied already: that must not read a lagging replica
+    session.use_primary()
+    rejected = []
+    with journal.replay() as entries:
+        count = task_service.replay(session, entries, rejected)
+        session.commit()
+        if rejected:
+            journal.set_aside(rejected)
+            click.echo(f"{len(rejected)} locally saved changes could not be written and were moved to {journal.rejected_path}", err=True)
+    for user_id in {entry.get("user_id") for entry in entries}:
+        invalidate_cache(user_id)
+    return count
+
+class Batch:
+    """Commands run by 'todo shell' and 'todo batch' share its connection and the current user"""
+    # Seconds the current user is trusted before the session token is verified again
+    user_ttl = 60
+
+    def __init__(self, connection, atomic):
+        self.connection = connection
+        self.atomic = atomic
+        self.failed = False
+        self.user_id = None
+        self.user_checked = 0.0
+        self.session_verified = float("-inf")
+
+current_batch = None
+
+def fail(message):
+    """Report that a command failed. It ends an atomic batch"""
+    click.echo(message)
+    if current_batch != None:
+        current_batch.failed = True
+
+def open_session(read_only=False):
+    """read_only sessions may read from a replica (see database.RoutingSession)"""
+    from .database import Session
+    if current_batch != None:
+        # In an atomic batch a command's commit only releases its savepoint; the batch commits at the end
+        join_transaction_mode = "create_savepoint" if current_batch.atomic else "conditional_savepoint"
+        return Session(bind=current_batch.connection, join_transaction_mode=join_transaction_mode)
+    return Session(read_only=read_only)
+
+def current_user(session):
+    if current_batch == None:
+        return user_service.get_current_user(session)
+    if current_batch.user_id == None or time.monotonic() - current_batch.user_checked > current_batch.user_ttl:
+        current_batch.user_id = user_service.get_current_user(session)
+        current_batch.user_checked = time.monotonic()
+    return current_batch.user_id
+
+def verify_session(session):
+    """Before a write, make sure the session was not revoked on the server. A copied token
+    then stops working for writes at logout, reads still accept it until it expires.
+    Batches check once per user_ttl"""
+    if current_batch != None and time.monotonic() - current_batch.session_verified < current_batch.user_ttl:
+        return
+    user_service.verify_session(session)
+    if current_batch != None:
+        current_batch.session_verified = time.monotonic()
+
+def forget_current_user():
+    if current_batch != None:
+        current_batch.user_id = None
+
+@lru_cache
+def task_cache():
+    from .config import get_settings
+    settings = get_settings()
+    if not settings.CACHE_ENABLED:
+        return None
+    import hashlib
+    from .cache import TaskCache
+    # Users and versions of different databases have the same numbers, so each database has a cache of its own
+    database = hashlib.sha256(settings.database_url.encode()).hexdigest()[:16]
+    path = os.path.join(settings.CACHE_DIR, f"tasks-{database}.sqlite")
+    return TaskCache(path, settings.CACHE_MAX_ENTRIES, settings.CACHE_STALE_SECONDS)
+
+def get_day_tasks(session, day, user_id, after=None, limit=None, **filters):
+    """Tasks of a day followed by the occurrences of recurring tasks (only the tasks for a page,
+    with 'after' or 'limit'). Served from the local cache while the user's tasks version is
+    unchanged: changes of recurring tasks bump it too"""
+    if after != None or limit != None:
+        return task_service.iter_tasks(session, after, limit, task_date=day, user_id=user_id, **filters)
+    cache = task_cache()
+    if cache == None:
+        return chain(
+            task_service.iter_tasks(session, None, None, task_date=day, user_id=user_id, **filters),
+            task_service.get_occurrences(session, date_from=day, date_to=day, user_id=user_id, **filters)
+        )
+    entry = cache.get(user_id, day)
+    if entry != None and entry[1]:
+        tasks = [cached_task(task) for task in entry[2]]
+    else:
+        version = task_service.get_version(session, user_id)
+        if entry != None and entry[0] == version:
+            cache.touch(user_id, day)
+            tasks = [cached_task(task) for task in entry[2]]
+        else:
+            tasks = [
+                *task_service.get_tasks(session, task_date=day, user_id=user_id),
+                *task_service.get_occurrences(session, date_from=day, date_to=day, user_id=user_id)
+            ]
+            cache.put(user_id, day, version, tasks)
+    return [task for task in tasks if all(getattr(task, k) == v for k, v in filters.items())]
+
+def cached_task(values):
+    from .models import TaskRow
+    task = TaskRow(**values)
+    # Occurrences of recurring tasks have ids like 'r3'
+    return task._replace(id=RecurringId(task.id)) if isinstance(task.id, str) else task
+
+def echo_lines(lines, chunk_size=200):
+    """Echo lines in chunks instead of one write per line. Returns the number of tasks and the last one"""
+    buffer = []
+    count = 0
+    last = None
+    for line in lines:
+        buffer.append(str(line))
+        if not isinstance(line, str):
+            count += 1
+            last = line
+        if len(buffer) == chunk_size:
+            click.echo("\n".join(buffer))
+            buffer.clear()
+    if buffer:
+        click.echo("\n".join(buffer))
+    return count, last
+
+def write_tasks(tasks, output, day_headers=False):
+    """Write tasks in a 'show --output' format. Returns the number of tasks and the last one"""
+    if output == "table":
+        return echo_lines(with_day_headers(tasks) if day_headers else tasks)
+    last = None
+    def rows():
+        nonlocal last
+        for task in tasks:
+            last = task
+            yield task.task_date, task.id, task.task_description, task.done, task.important
+    stream = click.get_text_stream("stdout")
+    count = bulk.write_rows(stream, rows(), output, bulk.SHOW_COLUMNS)
+    stream.flush()
+    return count, last
+
+def with_day_headers(tasks):
+    current_day = None
+    for task in tasks:
+        if task.task_date != current_day:
+            if current_day != None:
+                yield ""
+            yield f"{task.task_date:%A}"
+            current_day = task.task_date
+        yield task
+
+def invalidate_cache(user_id):
+    cache = task_cache()
+    if cache != None:
+        cache.invalidate(user_id)
 
 @click.group()
-def cli():
-    """To-do list CLI app"""
+@click.option("--profile", is_flag=True, help="Report time per phase and SQL statements on stderr")
+@click.option("--profile-log", type=click.Path(dir_okay=False), default=None, help="Append the profile as a JSON line to this file")
+@click.pass_context
+def cli(ctx, profile, profile_log):
+    """To-do list CLI app
+
+    TODO_PROFILE=1 has the effect of --profile, TODO_PROFILE=FILE of --profile-log FILE.
+    """
+    env_profile = os.environ.get("TODO_PROFILE", "0")
+    if env_profile != "0" and not (profile or profile_log):
+        profile, profile_log = env_profile == "1", (env_profile if env_profile != "1" else None)
+    if profile or profile_log:
+        from time import perf_counter
+        started = perf_counter()
+        from .profiling import Profiler
+        profiler = Profiler(ctx.invoked_subcommand, ctx.args, started)
+        ctx.call_on_close(lambda: profiler.report(profile_log or "-"))
 
 @cli.command()
 def init():
     """Initialize database"""
-    try:
+    from .database import db_init
+    with database_errors():
         db_init()
-    except OperationalError:
-        click.echo("Lost connection with database")
+
+
+@cli.command()
+def migrate():
+    """Apply pending database migrations"""
+    from .database import db_migrate
+    with database_errors():
+        db_migrate()
+
+
+@cli.command()
+@click.option("--before", type=DAY, required=True, help="Archive the tasks of all users dated before this day")
+def archive(before):
+    """Move old tasks out of the task table. 'show', 'search' and 'export' leave them out, 'stats' still counts them"""
+    with database_errors():
+        with open_session() as session:
+            archived = task_service.archive(session, before)
+            session.commit()
+            click.echo(f"Archived {archived} tasks dated before {before}")
+
+
+@cli.command()
+def sync():
+    """Write the changes saved locally while the database was unreachable"""
+    with database_errors():
+        with open_session() as session:
+            count = sync_journal(session)
+            click.echo(f"{count} changes synced" if count else "Nothing to sync")
+
+
+@cli.command()
+@click.option("--socket", "path", default=None, help="Unix socket to listen on")
+def daemon(path):
+    """Keep database connections warm and serve 'todo' commands over a Unix socket"""
+    from .daemon import Daemon
+    from .client import socket_path
+    path = path or socket_path()
+    with Daemon(path) as server, database_errors():
+        server.warm_up()
+        click.echo(f"Listening on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+# Commands that manage their own connections or would nest batches
+NOT_IN_BATCH = ("shell", "batch", "daemon", "init", "migrate", "watch")
+
+def run_batch(lines, atomic):
+    """Run 'todo' command lines over one connection. Returns the number of failed commands"""
+    from .database import get_engine
+    global current_batch
+    # Counted as a failure if the database cannot be reached
+    failures = 1
+    with database_errors(), get_engine().connect() as connection:
+        failures = 0
+        transaction = connection.begin() if atomic else None
+        current_batch = Batch(connection, atomic)
+        journal = offline_journal()
+        journal.defer_sync = True
+        try:
+            for number, line in enumerate(lines, 1):
+                current_batch.failed = False
+                try:
+                    args = shlex.split(line, comments=True)
+                except ValueError as e:
+                    args = None
+                    fail(f"Line {number}: {e}")
+                if args and args[0] == "todo":
+                    args = args[1:]
+                if args and args[0] in NOT_IN_BATCH:
+                    fail(f"Line {number}: '{args[0]}' cannot be run in a batch")
+                elif args:
+                    code = run_batch_command(args)
+                    current_batch.failed = current_batch.failed or code != 0
+                if current_batch.failed:
+                    failures += 1
+                    if atomic:
+                        break
+        finally:
+            user_id = current_batch.user_id
+            current_batch = None
+            journal.defer_sync = False
+            journal.sync()
+        if transaction != None:
+            if failures:
+                transaction.rollback()
+                # Tasks read inside the rolled back transaction may have been cached
+                if user_id != None:
+                    invalidate_cache(user_id)
+                click.echo("A command failed, no changes were saved", err=True)
+            else:
+                transaction.commit()
+    return failures
+
+def run_batch_command(args):
+    try:
+        cli.main(args, prog_name="todo")
+    except SystemExit as e:
+        if e.code == None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    return 0
+
+def shell_lines():
+    try:
+        # Line editing and history where available
+        import readline
+    except ImportError:
+        pass
+    while True:
+        try:
+            line = input("todo> ")
+        except EOFError:
+            click.echo()
+            return
+        if line.strip() in ("exit", "quit"):
+            return
+        yield line
+
+
+@cli.command()
+@click.option("--atomic", is_flag=True, help="Save the changes only on exit and only if no command failed")
+def shell(atomic):
+    """Run commands interactively over one database connection. Type 'exit' or Ctrl-D to quit"""
+    run_batch(shell_lines(), atomic)
+
+
+@cli.command()
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+@click.option("--atomic", is_flag=True, help="Run all commands in one transaction, rolled back if a command fails")
+@click.pass_context
+def batch(ctx, source, atomic):
+    """Run 'todo' commands from a file or stdin, one per line, over one database connection
+
+    Lines are split like shell arguments; '#' starts a comment and a leading 'todo' is optional.
+    Exits with status 1 if a command failed.
+    """
+    if run_batch(source, atomic):
+        ctx.exit(1)
 
 
 @cli.command("show")
-@click.option("-d", "--day", type = DAY, default="today", help="A day to show. Possible values: today (by default), yesterday, tommorrow, particular day in format YYYY-MM-dd")
+@click.option("-d", "--day", type = DAY, default=None, help="A day to show. Possible values: today (by default), yesterday, tommorrow, particular day in format YYYY-MM-dd")
+@click.option("--from", "date_from", type=DAY, default=None, help="First day of a range to show")
+@click.option("--to", "date_to", type=DAY, default=None, help="Last day of a range to show (today by default)")
+@click.option("--week", type=DAY, is_flag=False, flag_value="today", default=None, help="Show the week (Monday to Sunday) containing a day (today by default)")
+@click.option("--month", type=DAY, is_flag=False, flag_value="today", default=None, help="Show the month containing a day (today by default)")
 @click.option("--done/--not-done", default=None, help="Show only done/not done tasks")
 @click.option("--important/--not-important", default=None, help="Show only important/not important items")
-def show(day, done, important):
-    """Show a list of tasks for a particular day (for today by default)"""
-    try:
-        with Session() as session:
+@click.option("-n", "--limit", type=click.IntRange(min=1), default=None, help="Show at most this many tasks of the day")
+@click.option("--after", type=click.IntRange(min=0), default=None, help="Show tasks of the day after this id (next page)")
+@click.option("--output", type=click.Choice(["table", "json", "csv", "tsv"]), default="table", help="Output format (table by default)")
+def show(day, date_from, date_to, week, month, done, important, limit, after, output):
+    """Show a list of tasks for a particular day (for today by default) or a range of days"""
+    if sum(option != None for option in (day, date_from or date_to, week, month)) > 1:
+        click.echo("Use only one of --day, --from/--to, --week, --month")
+        return
+    if ((limit != None or after != None) and (date_from or date_to or week or month)):
+        click.echo("--limit and --after can be used for a single day only")
+        return
+    with database_errors():
+        with open_session(read_only=True) as session:
+            try:
+                user_id = current_user(session)
+                sync_journal(session)
+                kwargs = {"user_id": user_id}
+                if (done != None):
+                    kwargs["done"] = done
+                if (important != None):
+                    kwargs["important"] = important
+                if (date_from == None and date_to == None and week == None and month == None):
+                    day = day or date.today()
+                    tasks = get_day_tasks(session, day, after=after, limit=limit, **kwargs)
+                    count, last = write_tasks(tasks, output)
+                    if count == 0 and output == "table":
+                        click.echo(f"No tasks found for {day}")
+                    elif count == limit:
+                        click.echo(f"More tasks may follow. Use --after {last.id}", err=True)
+                    return
+                if (week != None):
+                    date_from, date_to = week_of(week)
+                elif (month != None):
+                    date_from, date_to = month_of(month)
+                else:
+                    date_to = date_to or date.today()
+                    date_from = date_from or date_to
+                result = merge(
+                    task_service.get_tasks_in_range(session, date_from, date_to, **kwargs),
+                    task_service.get_occurrences(session, date_from=date_from, date_to=date_to, **kwargs),
+                    key=lambda task: task.task_date
+                )
+                count, last = write_tasks(result, output, day_headers=True)
+                if count == 0 and output == "table":
+                    click.echo(f"No tasks found for {date_from} - {date_to}")
+            except SessionHasExpiredException as e:
+                user_service.logout(session)
+                session.commit()
+                fail(e.message)
+            except (UserNotLoggedInException) as e:
+                fail(e.message)
+
+@contextmanager
+def change_feed(session, user_id, interval):
+    from .watch import NotificationFeed, VersionFeed
+    # The primary: a read-only session may read from a replica, which gets no notifications
+    bind = session.bind
+    if bind.dialect.name != "postgresql":
+        def read_version():
+            version = task_service.get_version(session, user_id)
+            session.commit()
+            return version
+        yield VersionFeed(read_version, interval)
+        return
+    # Notifications arrive on a connection of its own, outside of transactions
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        feed = NotificationFeed(connection, user_id)
+        try:
+            yield feed
+        finally:
+            feed.close()
+
+def task_json(task):
+    return dict(zip(bulk.SHOW_COLUMNS, (task.task_date.isoformat(), task.id, task.task_description, task.done, task.important)))
+
+@cli.command("watch")
+@click.option("-d", "--day", type = DAY, default=None, help="A day to watch (today by default)")
+@click.option("--from", "date_from", type=DAY, default=None, help="First day of a range to watch")
+@click.option("--to", "date_to", type=DAY, default=None, help="Last day of a range to watch (today by default)")
+@click.option("--output", type=click.Choice(["table", "json"]), default="table", help="Redraw the tasks (by default) or write changes as JSON lines")
+@click.option("--interval", type=click.FloatRange(min=0.1), default=2.0, help="Seconds between checks for changes, if the database cannot notify (SQLite)")
+def watch_tasks(day, date_from, date_to, output, interval):
+    """Show the tasks of a day or range again whenever they change. Stop with Ctrl-C"""
+    import json
+    from .watch import diff_tasks
+    if day != None and (date_from or date_to):
+        click.echo("Use only one of --day, --from/--to")
+        return
+    if day != None or not (date_from or date_to):
+        date_from = date_to = day or date.today()
+    else:
+        date_to = date_to or date.today()
+        date_from = date_from or date_to
+    with database_errors():
+        with open_session(read_only=True) as session:
+            try:
+                user_id = current_user(session)
+                def read_tasks():
+                    tasks = list(merge(
+                        task_service.get_tasks_in_range(session, date_from, date_to, user_id=user_id),
+                        task_service.get_occurrences(session, date_from=date_from, date_to=date_to, user_id=user_id),
+                        key=lambda task: task.task_date
+                    ))
+                    # No transaction stays open while waiting
+                    session.commit()
+                    return tasks
+                def draw(tasks):
+                    click.clear()
+                    count, _ = write_tasks(tasks, "table", day_headers=date_from != date_to)
+                    if count == 0:
+                        click.echo(f"No tasks found for {date_from} - {date_to}")
+                with change_feed(session, user_id, interval) as feed:
+                    tasks = read_tasks()
+                    if output == "json":
+                        click.echo(json.dumps({"tasks": [task_json(task) for task in tasks]}))
+                    else:
+                        draw(tasks)
+                    for days in feed:
+                        if days != None and not any(date_from <= day <= date_to for day in days):
+                            continue
+                        new_tasks = read_tasks()
+                        added, changed, removed = diff_tasks(tasks, new_tasks)
+                        tasks = new_tasks
+                        if not (added or changed or removed):
+                            continue
+                        if output == "json":
+                            click.echo(json.dumps({
+                                "added": [task_json(task) for task in added],
+                                "changed": [task_json(task) for task in changed],
+                                "removed": [task_json(task) for task in removed]
+                            }))
+                        else:
+                            draw(tasks)
+            except KeyboardInterrupt:
+                pass
+            except SessionHasExpiredException as e:
+                user_service.logout(session)
+                session.commit()
+                fail(e.message)
+            except (UserNotLoggedInException) as e:
+                fail(e.message)
+
+@cli.command("search")
+@click.argument("query")
+@click.option("--from", "date_from", type=DAY, default=None, help="Search tasks from this day on")
+@click.option("--to", "date_to", type=DAY, default=None, help="Search tasks up to this day")
+@click.option("--done/--not-done", default=None, help="Search only done/not done tasks")
+@click.option("--important/--not-important", default=None, help="Search only important/not important tasks")
+@click.option("--substring", is_flag=True, help="Match any part of descriptions instead of whole words")
+@click.option("-n", "--limit", type=click.IntRange(min=1), default=20, help="Tasks per page (20 by default)")
+@click.option("-p", "--page", type=click.IntRange(min=1), default=1, help="Page to show")
+def search(query, date_from, date_to, done, important, substring, limit, page):
+    """Search tasks by description, best matches first"""
+    with database_errors():
+        with open_session(read_only=True) as session:
             try:
-                user_id = user_service.get_current_user(session)
-                kwargs = {"task_date": day, "user_id": user_id}
+                user_id = current_user(session)
+                kwargs = {}
                 if (done != None):
                     kwargs["done"] = done
                 if (important != None):
                     kwargs["important"] = important
-                result = task_service.get_tasks(session, **kwargs)
+                result = task_service.search(session, user_id, query, date_from, date_to, limit, (page - 1) * limit, substring, **kwargs)
                 for task in result:
                     click.echo(task, nl=True)
                 if len(result) == 0:
-                    click.echo(f"No tasks found for {day}")
+                    click.echo(f"No tasks found for {query!r}")
+                elif len(result) == limit:
+                    click.echo(f"More tasks may match. Use --page {page + 1}", err=True)
             except SessionHasExpiredException as e:
                 user_service.logout(session)
                 session.commit()
-                click.echo(e.message)
+                fail(e.message)
             except (UserNotLoggedInException) as e:
-                click.echo(e.message)
-    except ProgrammingError:
-        click.echo("Please initialize database first. Use command 'todo init'")
-    except OperationalError:
-        click.echo("Lost connection with database")
+                fail(e.message)
 
 @cli.command("add")
 @click.argument("description")
@@ -63,46 +608,183 @@ def show(day, done, important):
 @click.option("-i", "--important", is_flag=True, help="Marks task as important")
 def add(description, day, done, important):
     """Create a task"""
-    try: 
-        with Session() as session:
+    with database_errors():
+        with open_session() as session:
             try:
-                if (len(description) > 150):
-                    click.echo("Too long task. It should contain no more than 150 symbols.")
+                if (len(description) > MAX_DESCRIPTION_LENGTH):
+                    fail(f"Too long task. It should contain no more than {MAX_DESCRIPTION_LENGTH} symbols.")
                     return
-                user_id = user_service.get_current_user(session)
-                task = Task(task_description=description, task_date=day, done=done, important=important, user_id=user_id)
-                task_service.create(session, task)
-                session.commit()    
+                user_id = current_user(session)
+                write = {"op": "create", "user_id": user_id, "task_date": day, "task_description": description, "done": done, "important": important}
+                with offline_fallback(write):
+                    verify_session(session)
+                    sync_journal(session)
+                    from .models import Task
+                    task = Task(task_description=description, task_date=day, done=done, important=important, user_id=user_id)
+                    task_service.create(session, task)
+                    session.commit()
+                    invalidate_cache(user_id)
             except SessionHasExpiredException as e:
                 user_service.logout(session)
                 session.commit()
-                click.echo(e.message)
+                fail(e.message)
             except (UserNotLoggedInException) as e: 
-                click.echo(e.message)
-    except ProgrammingError:
-        click.echo("Please initialize database first. Use command 'todo init'")
-    except OperationalError:
-        click.echo("Lost connection with database")
+                fail(e.message)
+
+
+@cli.command("import")
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+@click.option("-f", "--format", "fmt", type=click.Choice(["csv", "jsonl"]), default=None, help="Input format. Detected by file extension, csv by default")
+@click.option("--batch-size", type=click.IntRange(min=1), default=5000, help="Number of tasks written per transaction")
+@click.option("--rejects", type=click.File("w", encoding="utf-8"), default=None, help="File to write rejected rows to (JSON lines)")
+def import_tasks(source, fmt, batch_size, rejects):
+    """Import tasks from a CSV/JSONL file or stdin"""
+    with database_errors():
+        with open_session() as session:
+            try:
+                user_id = current_user(session)
+                verify_session(session)
+                imported = rejected = 0
+                for batch in bulk.batched(bulk.read_tasks(source, fmt or bulk.detect_format(source), user_id), batch_size):
+                    tasks = []
+                    for line, row, task, error in batch:
+                        if error != None:
+                            rejected += 1
+                            if rejects != None:
+                                bulk.write_reject(rejects, line, row, error)
+                        else:
+                            tasks.append(task)
+                    task_service.create_many(session, tasks)
+                    session.commit()
+                    invalidate_cache(user_id)
+                    imported += len(tasks)
+                    click.echo(f"Imported {imported} tasks, rejected {rejected}", err=True)
+                click.echo(f"{imported} tasks imported, {rejected} rejected")
+            except SessionHasExpiredException as e:
+                user_service.logout(session)
+                session.commit()
+                fail(e.message)
+            except (UserNotLoggedInException) as e:
+                fail(e.message)
+
+
+STATS_PERIODS = {"day": "{:%Y-%m-%d}", "week": "{:%G-W%V}", "month": "{:%Y-%m}"}
+
+def stats_line(period, total, done, important):
+    return f"{period:<10}  {total:>6}  {done:>6}  {total - done:>8}  {important:>9}  {done / total:>6.0%}"
+
+@cli.command("stats")
+@click.option("--from", "date_from", type=DAY, default=None, help="First day to count (30 days before --to by default)")
+@click.option("--to", "date_to", type=DAY, default=None, help="Last day to count (today by default)")
+@click.option("--by", type=click.Choice(list(STATS_PERIODS)), default="day", help="Count tasks per day (by default), week or month")
+@click.option("--rebuild", is_flag=True, help="Recompute the summary from all your tasks first")
+def stats(date_from, date_to, by, rebuild):
+    """Show numbers of done and important tasks per day, week or month"""
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=29)
+    with database_errors():
+        with open_session(read_only=not rebuild) as session:
+            try:
+                user_id = current_user(session)
+                if rebuild:
+                    days = task_service.rebuild_summary(session, user_id)
+                    session.commit()
+                    click.echo(f"Summary rebuilt for {days} days", err=True)
+                result = task_service.get_stats(session, user_id, date_from, date_to, by)
+                if len(result) == 0:
+                    click.echo(f"No tasks found for {date_from} - {date_to}")
+                    return
+                lines = [f"{'Period':<10}  {'Tasks':>6}  {'Done':>6}  {'Not done':>8}  {'Important':>9}  {'Done %':>6}"]
+                for start, total, done, important, _ in result:
+                    lines.append(stats_line(STATS_PERIODS[by].format(start), total, done, important))
+                lines.append(stats_line("Total", *[sum(row[i] for row in result) for i in (1, 2, 3)]))
+                click.echo("\n".join(lines))
+            except SessionHasExpiredException as e:
+                user_service.logout(session)
+                session.commit()
+                fail(e.message)
+            except (UserNotLoggedInException) as e:
+                fail(e.message)
+
+
+@cli.command("export")
+@click.option("--from", "date_from", type=DAY, default=None, help="First day to export. Possible values: today, yesterday, tommorrow, particular day in format YYYY-MM-dd")
+@click.option("--to", "date_to", type=DAY, default=None, help="Last day to export. Possible values: today, yesterday, tommorrow, particular day in format YYYY-MM-dd")
+@click.option("-f", "--format", "fmt", type=click.Choice(["csv", "jsonl"]), default="csv", help="Output format (csv by default)")
+@click.option("-o", "--output", type=click.File("w", encoding="utf-8"), default="-", help="File to write to (stdout by default)")
+def export_tasks(date_from, date_to, fmt, output):
+    """Export tasks for a date range to CSV/JSONL"""
+    with database_errors():
+        with open_session(read_only=True) as session:
+            try:
+                user_id = current_user(session)
+                rows = task_service.export_rows(session, date_from, date_to, user_id)
+                count = bulk.write_rows(output, (row[1:] for row in rows), fmt, bulk.EXPORT_COLUMNS)
+                click.echo(f"{count} tasks exported", err=True)
+            except SessionHasExpiredException as e:
+                user_service.logout(session)
+                session.commit()
+                fail(e.message)
+            except (UserNotLoggedInException) as e:
+                fail(e.message)
+
+
+SELECTIONS = {"all": {}, "done": {"done": True}, "not-done": {"done": False}}
+
+def selection_options(command):
+    command = click.option("--all-not-done", "selection", flag_value="not-done", help="Select all not done tasks of the day")(command)
+    command = click.option("--all-done", "selection", flag_value="done", help="Select all done tasks of the day")(command)
+    command = click.option("--all", "selection", flag_value="all", help="Select all tasks of the day")(command)
+    return command
 
+def resolve_selection(ids, selection):
+    """Split ids into ranges of task numbers (None for all tasks) and occurrences of recurring tasks"""
+    items = [item for id_ranges in ids for item in id_ranges]
+    ranges = [item for item in items if not isinstance(item, RecurringId)]
+    occurrences = [item for item in items if isinstance(item, RecurringId)]
+    return ranges or None, occurrences, SELECTIONS.get(selection, {})
+
+def selected_occurrences(session, date, user_id, occurrences, selection):
+    # Occurrences are never done, so --all and --all-not-done select all of them
+    if selection in ("all", "not-done"):
+        occurrences = occurrences + [task.id for task in task_service.get_occurrences(session, user_id, date, date)]
+    return occurrences
+
+def offline_write(op, date, user_id, ranges, occurrences, filters, **values):
+    # Occurrences of recurring tasks are expanded from the database, so such changes cannot be journaled
+    if occurrences:
+        return None
+    return {"op": op, "user_id": user_id, "date": date, "ranges": ranges, "filters": filters, **values}
+
+def format_ranges(ranges):
+    return ",".join(
+        item if isinstance(item, RecurringId) else str(item[0]) if item[0] == item[1] else f"{item[0]}-{item[1]}"
+        for item in ranges
+    )
 
 @cli.command("update")
-@click.argument("date_and_id", type=click.Tuple([DAY, int]))
-@click.option("-d", "--day", type = DAY, default=None, help="New day for task. Possible values: today (by default), yesterday, tommorrow, particular day in format YYYY-MM-dd")
-@click.option("--done/--not-done", default=None, help="Mark task as done/not done")
-@click.option("--important/--not-important", default=None, help="Mark task as important/not important")
-@click.option("--desc",  help="New description for task")
-def update(date_and_id, day, done, important, desc):
-    """Update a task by date and id"""
-    try:
-        with Session() as session:
+@click.argument("date", type=DAY)
+@click.argument("ids", type=IDS, nargs=-1)
+@selection_options
+@click.option("-d", "--day", type = DAY, default=None, help="New day for tasks. Possible values: today (by default), yesterday, tommorrow, particular day in format YYYY-MM-dd")
+@click.option("--done/--not-done", default=None, help="Mark tasks as done/not done")
+@click.option("--important/--not-important", default=None, help="Mark tasks as important/not important")
+@click.option("--desc",  help="New description for tasks")
+def update(date, ids, selection, day, done, important, desc):
+    """Update tasks of a date by ids (like 3, 1,4, 5-10 or r2 for a recurring task) or by a selection"""
+    with database_errors():
+        with open_session() as session:
             if (day == None and done == None and important == None and desc == None):
                 click.echo("Define at least one parameter to change")
                 return
-            if (desc != None and len(desc) > 150):
-                click.echo("Too long description. It should contain no more than 150 symbols.")
+            if (desc != None and len(desc) > MAX_DESCRIPTION_LENGTH):
+                click.echo(f"Too long description. It should contain no more than {MAX_DESCRIPTION_LENGTH} symbols.")
+                return
+            if (not ids and selection == None):
+                click.echo("Define task ids or one of --all, --all-done, --all-not-done")
                 return
             try:
-                user_id = user_service.get_current_user(session)
+                user_id = current_user(session)
                 kwargs = {}
                 if (day != None):
                     kwargs["task_date"] = day
@@ -112,47 +794,156 @@ def update(date_and_id, day, done, important, desc):
                     kwargs["important"] = important
                 if (desc != None):
                     kwargs["task_description"] = desc
-                task_service.update(session, date_and_id[0], date_and_id[1], user_id, **kwargs)
-                session.commit()
+                ranges, occurrences, filters = resolve_selection(ids, selection)
+                write = offline_write("update", date, user_id, ranges, occurrences, filters, values=kwargs)
+                with offline_fallback(write):
+                    verify_session(session)
+                    sync_journal(session)
+                    occurrences = selected_occurrences(session, date, user_id, occurrences, selection)
+                    count = 0
+                    if ranges != None or selection != None:
+                        count += task_service.update_many(session, date, user_id, ranges, filters, **kwargs)
+                    if occurrences:
+                        count += task_service.materialize(session, date, user_id, occurrences, **kwargs)
+                    if count == 0:
+                        raise TaskNotFoundException(format_ranges((ranges or []) + occurrences), date)
+                    session.commit()
+                    invalidate_cache(user_id)
+                    click.echo(f"{count} tasks updated")
             except SessionHasExpiredException as e:
-                user_service.logout()
+                user_service.logout(session)
                 session.commit()
-                click.echo(e.message)
+                fail(e.message)
             except (UserNotLoggedInException, TaskNotFoundException) as e:
-                click.echo(e.message)
-    except ProgrammingError:
-        click.echo("Please initialize database first. Use command 'todo init'")
-    except OperationalError:
-        click.echo("Lost connection with database")
+                fail(e.message)
 
 @cli.command("delete")
-@click.argument("date_and_id", type=click.Tuple([DAY, int]))
-def delete(date_and_id):
-    """Delete a task by date and id"""
-    try:
-        with Session() as session:
+@click.argument("date", type=DAY)
+@click.argument("ids", type=IDS, nargs=-1)
+@selection_options
+def delete(date, ids, selection):
+    """Delete tasks of a date by ids (like 3, 1,4, 5-10 or r2 for a recurring task) or by a selection"""
+    if (not ids and selection == None):
+        click.echo("Define task ids or one of --all, --all-done, --all-not-done")
+        return
+    with database_errors():
+        with open_session() as session:
             try:
-                user_id = user_service.get_current_user(session)
-                task_service.delete(session, date_and_id[0], date_and_id[1], user_id)
-                session.commit()
+                user_id = current_user(session)
+                ranges, occurrences, filters = resolve_selection(ids, selection)
+                write = offline_write("delete", date, user_id, ranges, occurrences, filters)
+                with offline_fallback(write):
+                    verify_session(session)
+                    sync_journal(session)
+                    occurrences = selected_occurrences(session, date, user_id, occurrences, selection)
+                    count = 0
+                    if ranges != None or selection != None:
+                        count += task_service.delete_many(session, date, user_id, ranges, filters)
+                    if occurrences:
+                        count += task_service.skip_occurrences(session, date, user_id, occurrences)
+                    if count == 0:
+                        raise TaskNotFoundException(format_ranges((ranges or []) + occurrences), date)
+                    session.commit()
+                    invalidate_cache(user_id)
+                    click.echo(f"{count} tasks deleted")
             except SessionHasExpiredException as e:
-                user_service.logout()
+                user_service.logout(session)
                 session.commit()
-                click.echo(e.message)
+                fail(e.message)
             except (UserNotLoggedInException, TaskNotFoundException) as e:
-                click.echo(e.message)
-    except ProgrammingError:
-        click.echo("Please initialize database first. Use command 'todo init'")
-    except OperationalError:
-        click.echo("Lost connection with database")
+                fail(e.message)
+
+@cli.group("recur")
+def recur():
+    """Manage recurring tasks. Their occurrences are listed by 'show' with ids like r3"""
+
+
+@recur.command("add")
+@click.argument("description")
+@click.option("--every", "rule", type=click.Choice(RECURRENCE_RULES), required=True, help="How often the task repeats")
+@click.option("--from", "start_date", type=DAY, default="today", help="First day of the task (today by default). Weekly and monthly tasks repeat on its weekday and day of month")
+@click.option("--until", "end_date", type=DAY, default=None, help="Last day of the task")
+@click.option("-i", "--important", is_flag=True, help="Marks task as important")
+def recur_add(description, rule, start_date, end_date, important):
+    """Create a recurring task"""
+    if (len(description) > MAX_DESCRIPTION_LENGTH):
+        fail(f"Too long task. It should contain no more than {MAX_DESCRIPTION_LENGTH} symbols.")
+        return
+    with database_errors():
+        with open_session() as session:
+            try:
+                user_id = current_user(session)
+                verify_session(session)
+                from .models import RecurringTask
+                recurring = RecurringTask(
+                    task_description=description, important=important, rule=rule,
+                    start_date=start_date, end_date=end_date, user_id=user_id
+                )
+                task_service.create_recurring(session, recurring)
+                session.commit()
+                click.echo(f"Recurring task r{recurring.id} created")
+            except SessionHasExpiredException as e:
+                user_service.logout(session)
+                session.commit()
+                fail(e.message)
+            except (UserNotLoggedInException) as e:
+                fail(e.message)
+
+
+@recur.command("list")
+def recur_list():
+    """Show recurring tasks"""
+    with database_errors():
+        with open_session(read_only=True) as session:
+            try:
+                user_id = current_user(session)
+                result = task_service.get_recurring(session, user_id)
+                for recurring in result:
+                    until = f" until {recurring.end_date}" if recurring.end_date != None else ""
+                    important = "\u22C6" if recurring.important else " "
+                    click.echo(f"r{recurring.id}  {recurring.rule} from {recurring.start_date}{until}  {recurring.task_description}  {important}")
+                if len(result) == 0:
+                    click.echo("No recurring tasks found")
+            except SessionHasExpiredException as e:
+                user_service.logout(session)
+                session.commit()
+                fail(e.message)
+            except (UserNotLoggedInException) as e:
+                fail(e.message)
+
+
+@recur.command("delete")
+@click.argument("ids", type=IDS)
+def recur_delete(ids):
+    """Delete a recurring task by id (like r3). Tasks made of its occurrences stay"""
+    if len(ids) != 1 or not isinstance(ids[0], RecurringId):
+        click.echo("Define the id of a recurring task, like r3")
+        return
+    with database_errors():
+        with open_session() as session:
+            try:
+                user_id = current_user(session)
+                verify_session(session)
+                task_service.delete_recurring(session, user_id, ids[0].recurring_id)
+                session.commit()
+                invalidate_cache(user_id)
+                click.echo(f"Recurring task {ids[0]} deleted")
+            except SessionHasExpiredException as e:
+                user_service.logout(session)
+                session.commit()
+                fail(e.message)
+            except (UserNotLoggedInException, RecurringTaskNotFoundException) as e:
+                fail(e.message)
 
 @cli.command("create-user")
 @click.option("--username", prompt="Username")
 @click.password_option("--password", prompt="Password")
 def create_user(username, password):
     """Create new user"""
-    try:
-        with Session() as session:
+    from sqlalchemy.exc import IntegrityError
+    from .models import User
+    with database_errors():
+        with open_session() as session:
             try:
                 user = User(user_name=username, user_password=password)
                 user_service.create(session, user)
@@ -160,11 +951,7 @@ def create_user(username, password):
                 click.echo("User successfully created!")
             except IntegrityError:
                 session.rollback()
-                click.echo(f"User '{username} already exists'")
-    except ProgrammingError:
-        click.echo("Please initialize database first. Use command 'todo init'")
-    except OperationalError:
-        click.echo("Lost connection with database")
+                fail(f"User '{username} already exists'")
 
 
 @cli.command("login")
@@ -172,34 +959,28 @@ def create_user(username, password):
 @click.option("--password", prompt="Password", hide_input=True)
 def login(username, password):
     """Log in"""
-    try:
-        with Session() as session:
+    with database_errors():
+        with open_session() as session:
+            forget_current_user()
             if user_service.login(session, username.strip(), password.strip()):
                 click.echo(f"Welcome, {username}!")
-            else: click.echo(f"Wrong username or password")
+            else: fail(f"Wrong username or password")
             session.commit()
-    except (ProgrammingError):
-        click.echo("Please initialize database first. Use command 'todo init'")
-    except(OperationalError):
-        click.echo("Lost connection with database")
 
 
 @cli.command("logout")
 def logout():
     """Log out"""
-    try:
-        with Session() as session:     
+    with database_errors():
+        with open_session() as session:
             try: 
                 user_service.get_current_user(session)
                 if click.confirm(f"Are you sure?"):
                     user_service.logout(session)
+                    forget_current_user()
                     click.echo(f"You successfully logged out.")
                     session.commit()
                 else:
                     click.echo("Aborted!")
             except UserNotLoggedInException:
-                click.echo("You need to log in first")
-    except (ProgrammingError):
-        click.echo("Please initialize database first. Use command 'todo init'")
-    except(OperationalError):
-        click.echo("Lost connection with database")
+                fail("You need to log in first")
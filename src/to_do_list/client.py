@@ -0,0 +1,133 @@
+import time
+STARTED = time.perf_counter()
+
+import hashlib
+import json
+import os
+import socket
+import struct
+import sys
+
+STDOUT = b"o"
+STDERR = b"e"
+EXIT = b"x"
+# Sent instead of running a command for a client with other settings
+REFUSED = b"r"
+HEADER = struct.Struct("!cI")
+
+# Commands that never prompt or read stdin, so they can run inside the daemon
+FORWARDED_COMMANDS = {"show", "search", "add", "update", "delete", "export", "stats", "recur", "sync"}
+# Environment variables the settings are read from (see config.Settings), and
+# those their defaults depend on. Listed here so that the client needs no pydantic
+SETTINGS_ENV = (
+    "DB_BACKEND", "DB_PATH", "DB_HOST", "DB_PORT", "USER", "PASS", "DB_NAME", "DB_PREPARE_THRESHOLD",
+    "DB_CONNECT_TIMEOUT", "DB_REPLICA_URLS", "DB_REPLICA_CONNECT_TIMEOUT", "DB_REPLICA_STICKY_SECONDS",
+    "MODE", "CACHE_ENABLED", "CACHE_DIR", "CACHE_MAX_ENTRIES", "CACHE_STALE_SECONDS", "STATE_DIR",
+    "SECRET_KEY", "SESSION_TTL_MINUTES", "HOME", "XDG_CACHE_HOME", "XDG_STATE_HOME", "XDG_DATA_HOME"
+)
+ENV_FILE = ".dev.env"
+
+
+def socket_path():
+    if "TODO_SOCKET" in os.environ:
+        return os.environ["TODO_SOCKET"]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "todo.sock")
+    return os.path.join("/tmp", f"todo-{os.getuid()}.sock")
+
+
+def settings_fingerprint():
+    """Digest of what the settings are read from: the environment and .dev.env in the working directory"""
+    digest = hashlib.sha256()
+    # Settings ignore the case of variable names
+    environ = {name.upper(): value for name, value in os.environ.items()}
+    for name in SETTINGS_ENV:
+        digest.update(f"{name}={environ.get(name)}\0".encode())
+    try:
+        with open(ENV_FILE, "rb") as f:
+            digest.update(f.read())
+    except OSError:
+        pass
+    return digest.hexdigest()
+
+
+def send_frame(sock, channel, payload):
+    sock.sendall(HEADER.pack(channel, len(payload)) + payload)
+
+
+def _read_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection with daemon closed")
+        data += chunk
+    return data
+
+
+def read_frame(sock):
+    channel, size = HEADER.unpack(_read_exactly(sock, HEADER.size))
+    return channel, _read_exactly(sock, size)
+
+
+def discard(stream):
+    """Send what is left to write on a stream whose reader went away to /dev/null, so that
+    Python does not report the broken pipe again when it flushes the stream at exit"""
+    try:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), stream.fileno())
+    except (OSError, ValueError):
+        pass
+
+
+def forward(args, path=None):
+    """Run a command in the daemon. Returns its exit code or None when the daemon is not running
+    or runs with other settings"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path or socket_path())
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    try:
+        cwd = os.getcwd()
+    except OSError:
+        # The working directory was removed: the daemon could not run the command in it
+        sock.close()
+        return None
+    # Bound before the request: a daemon in the same process (as in tests) redirects sys.stdout while it runs the command
+    stdout, stderr = sys.stdout, sys.stderr
+    with sock:
+        request = {"args": args, "cwd": cwd, "settings": settings_fingerprint()}
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        try:
+            while True:
+                channel, payload = read_frame(sock)
+                if channel == EXIT:
+                    return int(payload)
+                if channel == REFUSED:
+                    return None
+                stream = stdout if channel == STDOUT else stderr
+                try:
+                    stream.buffer.write(payload)
+                    stream.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The output is read no more, as by 'todo show | head -1'. Closing the
+                    # connection stops the command in the daemon
+                    discard(stream)
+                    return 0
+        except ConnectionError as e:
+            stderr.write(f"{e}\n")
+            return 1
+
+
+def main():
+    """Entry point of 'todo': forwards to a running daemon, otherwise runs the command in-process"""
+    args = sys.argv[1:]
+    # Profiles measure the command in this process
+    if args and args[0] in FORWARDED_COMMANDS and not os.environ.get("TODO_NO_DAEMON") and not os.environ.get("TODO_PROFILE"):
+        code = forward(args)
+        if code != None:
+            sys.exit(code)
+    from to_do_list.cli import cli
+    cli()
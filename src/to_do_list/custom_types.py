@@ -1,5 +1,6 @@
 import click 
 import re
+from calendar import monthrange
 from datetime import date, timedelta
 
 class DayParamType(click.ParamType):
@@ -16,4 +17,59 @@ class DayParamType(click.ParamType):
         except ValueError as e:
             self.fail(f"{value!r} is not a correct date.", param, ctx)
 
-DAY = DayParamType()
\ No newline at end of file
+DAY = DayParamType()
+
+class RecurringId(str):
+    """Id of an occurrence of a recurring task, like 'r3' for the recurring task 3"""
+    @property
+    def recurring_id(self):
+        return int(self[1:])
+
+class IdsParamType(click.ParamType):
+    """Task numbers like '3', '1,4,7' or '5-10', converted to a list of (first, last) ranges.
+    Occurrences of recurring tasks ('r3') are kept as RecurringId items"""
+    name="ids"
+    def convert(self, value, param, ctx):
+        if isinstance(value, list):
+            return value
+        ranges = []
+        for part in str(value).split(","):
+            if re.fullmatch(r"\s*r\d+\s*", part):
+                ranges.append(RecurringId(part.strip()))
+                continue
+            match = re.fullmatch(r"\s*(\d+)\s*(?:-\s*(\d+)\s*)?", part)
+            if match == None:
+                self.fail(f"{value!r} is not a correct list of task ids.", param, ctx)
+            first = int(match.group(1))
+            last = int(match.group(2) or first)
+            if first > last:
+                self.fail(f"{part.strip()!r} is not a correct range of task ids.", param, ctx)
+            ranges.append((first, last))
+        return ranges
+
+IDS = IdsParamType()
+
+MAX_DESCRIPTION_LENGTH = 150
+
+
+def week_of(day):
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=6)
+
+def month_of(day):
+    return day.replace(day=1), day.replace(day=monthrange(day.year, day.month)[1])
+
+RECURRENCE_RULES = ("daily", "weekdays", "weekly", "monthly")
+
+def occurs_on(rule, start_date, end_date, day):
+    """Whether a task repeated by 'rule' from 'start_date' until 'end_date' (if any) falls on 'day'.
+    Monthly tasks skip months without their day of month"""
+    if day < start_date or (end_date != None and day > end_date):
+        return False
+    if rule == "weekdays":
+        return day.weekday() < 5
+    if rule == "weekly":
+        return day.weekday() == start_date.weekday()
+    if rule == "monthly":
+        return day.day == start_date.day
+    return True
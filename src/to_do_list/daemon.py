@@ -0,0 +1,107 @@
+import io
+import json
+import os
+import socketserver
+import sys
+import time
+from contextlib import redirect_stdout, redirect_stderr
+from .client import STDOUT, STDERR, EXIT, REFUSED, send_frame, settings_fingerprint
+
+
+class FrameWriter(io.RawIOBase):
+    def __init__(self, sock, channel):
+        self.sock = sock
+        self.channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if not data:
+            return 0
+        send_frame(self.sock, self.channel, bytes(data))
+        return len(data)
+
+
+def run_command(args, stdout, stderr):
+    from .cli import cli
+    stdin = sys.stdin
+    sys.stdin = io.StringIO()
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            cli.main(args, prog_name="todo")
+    except SystemExit as e:
+        if e.code == None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    finally:
+        sys.stdin = stdin
+        stdout.flush()
+        stderr.flush()
+    return 0
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if request.get("settings") != self.server.settings:
+            # The command would use the daemon's database instead of the client's
+            send_frame(self.connection, REFUSED, b"")
+            return
+        try:
+            os.chdir(request["cwd"])
+        except OSError:
+            # The client's working directory was removed or cannot be entered: the client runs the command
+            send_frame(self.connection, REFUSED, b"")
+            return
+        stdout = io.TextIOWrapper(FrameWriter(self.connection, STDOUT), encoding="utf-8", write_through=True)
+        stderr = io.TextIOWrapper(FrameWriter(self.connection, STDERR), encoding="utf-8", write_through=True)
+        try:
+            code = run_command(request["args"], stdout, stderr)
+            send_frame(self.connection, EXIT, str(code).encode())
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading the output, e.g. 'todo show | head -1'
+            pass
+
+
+class Daemon(socketserver.UnixStreamServer):
+    """Serves commands one at a time, reusing the engine, its connection pool and services"""
+
+    sweep_interval = 600
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        umask = os.umask(0o077)
+        try:
+            super().__init__(path, CommandHandler)
+        finally:
+            os.umask(umask)
+        self.path = path
+        # Settings are read once, from the environment and working directory the daemon started in
+        self.settings = settings_fingerprint()
+        self.last_sweep = time.monotonic()
+
+    def warm_up(self):
+        from . import cli
+        from .database import get_engine
+        with get_engine().connect():
+            pass
+
+    def service_actions(self):
+        if time.monotonic() - self.last_sweep < self.sweep_interval:
+            return
+        self.last_sweep = time.monotonic()
+        from .cli import user_service, open_session, database_errors
+        from .database import db_create_partitions
+        with database_errors(), open_session() as session:
+            user_service.sweep_sessions(session)
+            session.commit()
+        with database_errors():
+            # A long-running daemon keeps partitions ready for the coming months
+            db_create_partitions()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -1,16 +1,197 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
-from sqlalchemy.exc import OperationalError
-from to_do_list.config import settings
-from to_do_list.exceptions import DatabaseIsNotAvailableException
+import os
+import random
+import time
+from functools import lru_cache
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session as OrmSession
+from sqlalchemy.sql.dml import UpdateBase
+from to_do_list.config import get_settings
 
 
 
-engine = create_engine(url=settings.database_url)
-Session = sessionmaker(engine)
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "cache_size": -16000
+}
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # sqlite3 would begin transactions only before writes and commit around
+    # SAVEPOINTs; SQLAlchemy begins them instead, see begin_sqlite_transaction
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+def begin_sqlite_transaction(connection):
+    # A deferred transaction that reads before it writes fails at once with "database is
+    # locked" if another one wrote meanwhile, without waiting out busy_timeout. Transactions
+    # therefore take the write lock when they begin, except those of read-only sessions
+    connection.exec_driver_sql(f"BEGIN {connection.get_execution_options().get('sqlite_begin', 'IMMEDIATE')}")
+
+@lru_cache
+def get_engine():
+    settings = get_settings()
+    if settings.DB_BACKEND == "sqlite":
+        if settings.DB_PATH != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(settings.DB_PATH)), exist_ok=True)
+        engine = create_engine(url=settings.database_url)
+        event.listen(engine, "connect", set_sqlite_pragmas)
+        event.listen(engine, "begin", begin_sqlite_transaction)
+        return engine
+    prepare_threshold = settings.DB_PREPARE_THRESHOLD if settings.DB_PREPARE_THRESHOLD >= 0 else None
+    connect_args = {"prepare_threshold": prepare_threshold, "connect_timeout": settings.DB_CONNECT_TIMEOUT}
+    return create_engine(url=settings.database_url, connect_args=connect_args)
+
+def unreachable(error):
+    """Whether 'error' means that the database server could not be reached, rather than
+    that a statement failed. A local SQLite database is never unreachable"""
+    if not isinstance(error, DBAPIError) or get_settings().DB_BACKEND == "sqlite":
+        return False
+    # Errors raised while connecting have no statement
+    return error.connection_invalidated or error.statement == None
+
+def locked(error):
+    return isinstance(error, OperationalError) and "database is locked" in str(error.orig)
+
+class ReplicaSet:
+    """Engines of the read replicas, used in turn. A replica that cannot be
+    reached is skipped for 'retry_after' seconds"""
+    retry_after = 30
+
+    def __init__(self, engines, state_path=None, sticky_seconds=0):
+        self.engines = engines
+        # Processes start at different replicas
+        self.next = random.randrange(len(engines)) if engines else 0
+        self.down_until = [0.0] * len(engines)
+        self.state_path = state_path
+        self.sticky_seconds = sticky_seconds
+
+    def pick(self):
+        """Return the engine of a reachable replica, None to read from the primary"""
+        if not self.engines or self.wrote_recently():
+            return None
+        for _ in range(len(self.engines)):
+            i = self.next
+            self.next = (self.next + 1) % len(self.engines)
+            if self.down_until[i] > time.monotonic():
+                continue
+            try:
+                # The checked connection stays in the pool for the session
+                with self.engines[i].connect():
+                    return self.engines[i]
+            except OperationalError:
+                self.down_until[i] = time.monotonic() + self.retry_after
+        return None
+
+    def note_write(self):
+        if self.engines and self.state_path != None:
+            os.makedirs(os.path.dirname(self.state_path), mode=0o700, exist_ok=True)
+            with open(self.state_path, "w"):
+                pass
+
+    def wrote_recently(self):
+        # Replicas may lag behind: reads of the same user right after a change go to the primary
+        try:
+            return time.time() - os.path.getmtime(self.state_path) < self.sticky_seconds
+        except (OSError, TypeError):
+            return False
+
+@lru_cache
+def get_replicas():
+    settings = get_settings()
+    if settings.DB_BACKEND == "sqlite":
+        return ReplicaSet([])
+    prepare_threshold = settings.DB_PREPARE_THRESHOLD if settings.DB_PREPARE_THRESHOLD >= 0 else None
+    connect_args = {"prepare_threshold": prepare_threshold, "connect_timeout": settings.DB_REPLICA_CONNECT_TIMEOUT}
+    engines = [create_engine(url=url, connect_args=connect_args) for url in settings.replica_urls]
+    return ReplicaSet(engines, os.path.join(settings.STATE_DIR, "last_write"), settings.DB_REPLICA_STICKY_SECONDS)
+
+class RoutingSession(OrmSession):
+    """Sends reads of read-only sessions to a replica (see ReplicaSet) and
+    everything else to the primary. Once a session writes, it reads from the
+    primary too"""
+    def __init__(self, read_only=False, **kw):
+        super().__init__(**kw)
+        self.read_only = read_only
+        self.replica = None
+        if read_only and self.bind != None and self.bind.dialect.name == "sqlite":
+            # See begin_sqlite_transaction
+            self.bind = self.bind.execution_options(sqlite_begin="DEFERRED")
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+        elif self.read_only and not self.info.get("wrote"):
+            if self.replica == None:
+                self.replica = get_replicas().pick() or False
+            if self.replica:
+                return self.replica
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+    def use_primary(self):
+        """Read from the primary from now on, e.g. before reads that decide on writes"""
+        self.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "after_commit")
+def note_write(session):
+    if session.info.get("wrote"):
+        get_replicas().note_write()
+
+class LazySessionmaker(sessionmaker):
+    """Binds to the engine on first use, so importing this module reads no settings"""
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") == None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+Session = LazySessionmaker(class_=RoutingSession)
 
 class Base(DeclarativeBase):
     pass
 
+def __getattr__(name):
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def alembic_config():
+    from alembic.config import Config
+    config = Config()
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "migrations"))
+    return config
+
 def db_init():
-    Base.metadata.create_all(engine)
+    from alembic import command
+    from . import models
+    if existing_tables():
+        # Tables of an earlier version are migrated, create_all would leave them as they are
+        db_migrate()
+        return
+    Base.metadata.create_all(get_engine())
+    db_create_partitions()
+    command.stamp(alembic_config(), "head")
+
+def db_migrate():
+    from alembic import command
+    tables = existing_tables()
+    if "alembic_version" not in tables and {"app_user", "task"} <= tables:
+        # Created by 'todo init' before migrations were added: that schema is revision 0001
+        command.stamp(alembic_config(), "0001")
+    command.upgrade(alembic_config(), "head")
+    db_create_partitions()
+
+def existing_tables():
+    from sqlalchemy import inspect
+    return set(inspect(get_engine()).get_table_names())
+
+def db_create_partitions():
+    """Create the task partitions of the coming months (PostgreSQL only)"""
+    from .partitions import create_partitions
+    with get_engine().begin() as connection:
+        return create_partitions(connection)
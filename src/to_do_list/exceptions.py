@@ -25,5 +25,10 @@ class DatabaseIsNotAvailableException(Exception):
 
 class TaskNotFoundException(Exception):
     def __init__(self, id, date):
-        self.message = f"Task №{id} for {date} not found"
-        super().__init__(self.message)
\ No newline at end of file
+        self.message = f"Task №{id} for {date} not found" if id else f"No tasks found for {date}"
+        super().__init__(self.message)
+
+class RecurringTaskNotFoundException(Exception):
+    def __init__(self, id):
+        self.message = f"Recurring task r{id} not found"
+        super().__init__(self.message)
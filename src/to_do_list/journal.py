@@ -0,0 +1,103 @@
+"""Local journal of task writes made while the database was unreachable.
+
+'add', 'update' and 'delete' append their write to the journal when the
+database cannot be reached (or does not answer within DB_CONNECT_TIMEOUT), so
+it is not lost. 'todo sync' or the next command reaching the database replays
+the journal in one transaction (see TaskService.replay) and clears it.
+
+Entries are JSON lines appended under an exclusive lock. Every entry carries a
+random idempotency key, which the replay stores in the database together with
+the writes: an entry is applied once even if the journal could not be cleared
+after the commit. An entry the database rejects (rather than one it cannot be
+reached for) is moved to a separate file, so it does not block later writes.
+"""
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+
+DATE_FIELDS = ("task_date", "date")
+
+
+def encode(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot journal {type(value).__name__}")
+
+
+def decode(entry):
+    for container in (entry, entry.get("values", {})):
+        for field in DATE_FIELDS:
+            if isinstance(container.get(field), str):
+                container[field] = date.fromisoformat(container[field])
+    return entry
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.rejected_path = os.path.splitext(path)[0] + ".rejected.jsonl"
+        # Set by batches: entries are written at once but made durable by one fsync in sync()
+        self.defer_sync = False
+        self.unsynced = False
+
+    def pending(self):
+        try:
+            return os.path.getsize(self.path) > 0
+        except OSError:
+            return False
+
+    def append(self, entry):
+        """Journal a write ({"op": "create" | "update" | "delete", ...}). Returns its idempotency key"""
+        entry = {"key": uuid.uuid4().hex, "at": datetime.now().isoformat(timespec="seconds"), **entry}
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        with open(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600), "w", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(json.dumps(entry, default=encode) + "\n")
+            f.flush()
+            if self.defer_sync:
+                self.unsynced = True
+            else:
+                os.fsync(f.fileno())
+        return entry["key"]
+
+    def set_aside(self, entries):
+        """Keep entries that cannot be replayed in the rejected file, for the user to look at"""
+        with open(os.open(self.rejected_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600), "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, default=encode) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def sync(self):
+        if self.unsynced:
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.unsynced = False
+
+    @contextmanager
+    def replay(self):
+        """Yield the journaled entries, holding the lock. The journal is cleared if the block succeeds"""
+        try:
+            f = open(self.path, "r+", encoding="utf-8")
+        except FileNotFoundError:
+            yield []
+            return
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            entries = []
+            for line in f:
+                try:
+                    entries.append(decode(json.loads(line)))
+                except ValueError:
+                    # The last line is cut short if a write was interrupted
+                    pass
+            yield entries
+            f.truncate(0)
+            f.flush()
+            os.fsync(f.fileno())
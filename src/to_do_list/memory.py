@@ -0,0 +1,369 @@
+"""Repositories keeping everything in process memory.
+
+They implement the interface of the SQLAlchemy repositories in repository.py
+and accept the same 'session' argument, which they ignore, so the services can
+be run without a database, e.g. in tests and load simulations:
+
+    store = MemoryStore()
+    task_service = TaskService(MemoryTaskRepository(store))
+    user_service = UserService(MemoryUserRepository(store), MemorySessionRepository(store))
+"""
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count, islice
+from sqlalchemy.exc import IntegrityError
+from .models import TaskRow, UserSession
+from .exceptions import TaskNotFoundException
+
+class TaskRecord:
+    __slots__ = ("id", "user_id", "task_date", "number", "task_description", "done", "important", "timestamp")
+
+    def __init__(self, id, user_id, task_date, number, task_description, done, important, timestamp):
+        self.id = id
+        self.user_id = user_id
+        self.task_date = task_date
+        self.number = number
+        self.task_description = task_description
+        self.done = done
+        self.important = important
+        self.timestamp = timestamp
+
+    def to_task(self):
+        return TaskRow(self.task_description, self.task_date, self.done, self.important, self.user_id, self.number)
+
+    def matches(self, filters):
+        return all(getattr(self, k) == v for k, v in filters.items())
+
+
+def by_number(record):
+    return record.number
+
+
+class MemoryStore:
+    """Data shared by the repositories of one in-memory database"""
+    def __init__(self):
+        self.users = {}
+        self.sessions = {}
+        # (user_id, task_date) -> records of the day, ordered by number (that is by creation time)
+        self.days = {}
+        # Records moved out of 'days' by archive()
+        self.archived = []
+        self.versions = {}
+        self.recurring = {}
+        # (recurring task id, day) of occurrences that are not expanded
+        self.skips = set()
+        # (user_id, task_date) -> last number given to a task of the day
+        self.last_numbers = {}
+        # Keys of replayed journal entries
+        self.applied_writes = set()
+        self.task_ids = count(1)
+        self.user_ids = count(1)
+        self.session_ids = count(1)
+        self.recurring_ids = count(1)
+
+
+class MemoryTaskRepository:
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+
+    def get_tasks(self, session, **kwargs):
+        return list(self.iter_tasks(session, **kwargs))
+
+    def iter_tasks(self, session, after=None, limit=None, **kwargs):
+        records = self._records(kwargs.pop("user_id", None), kwargs.pop("task_date", None), after)
+        tasks = (record.to_task() for record in records if record.matches(kwargs))
+        yield from islice(tasks, limit)
+
+    def get_tasks_in_range(self, session, date_from, date_to, **kwargs):
+        user_id = kwargs.pop("user_id", None)
+        keys = [key for key in self.store.days if date_from <= key[1] <= date_to and user_id in (None, key[0])]
+        for key in sorted(keys, key=lambda key: (key[1], key[0])):
+            for record in self.store.days[key]:
+                if record.matches(kwargs):
+                    yield record.to_task()
+
+    def search(self, session, user_id, text, date_from=None, date_to=None, limit=20, offset=0, substring=False, **kwargs):
+        # Like the fallback of TaskRepository without full-text search: every word has to occur
+        words = [text.lower()] if substring else text.lower().split()
+        keys = [
+            key for key in self.store.days
+            if key[0] == user_id and (date_from == None or key[1] >= date_from) and (date_to == None or key[1] <= date_to)
+        ]
+        found = (
+            record.to_task()
+            for key in sorted(keys, key=lambda key: key[1], reverse=True)
+            for record in self.store.days[key]
+            if record.matches(kwargs) and all(word in record.task_description.lower() for word in words)
+        )
+        return list(islice(found, offset, offset + limit))
+
+    def export_rows(self, session, date_from=None, date_to=None, user_id=None, batch_size=1000):
+        for key in sorted(self.store.days):
+            if (user_id == None or key[0] == user_id) and (date_from == None or key[1] >= date_from) and (date_to == None or key[1] <= date_to):
+                for r in self.store.days[key]:
+                    yield (r.user_id, r.task_date, r.number, r.task_description, r.done, r.important)
+
+    def create(self, session, task):
+        task.number = self.reserve_numbers(session, task.user_id, task.task_date)
+        task.timestamp = task.timestamp or datetime.now()
+        record = self._add(task.user_id, task.task_date, task.number, task.task_description, task.done, task.important, task.timestamp)
+        task.id = record.id
+        self.bump_version(session, task.user_id)
+
+    def create_many(self, session, tasks):
+        now = datetime.now()
+        for task in tasks:
+            task["number"] = self.reserve_numbers(session, task["user_id"], task["task_date"])
+            task["timestamp"] = now
+            self._add(task["user_id"], task["task_date"], task["number"], task["task_description"], task["done"], task["important"], now)
+        for user_id in {task["user_id"] for task in tasks}:
+            self.bump_version(session, user_id)
+
+    def update(self, session, date, fake_id, user_id, **kwargs):
+        record = self.get_by_number(session, date, fake_id, user_id)
+        new_date = kwargs.pop("task_date", date)
+        for k, v in kwargs.items():
+            setattr(record, k, v)
+        if new_date != date:
+            self._move([record], user_id, date, new_date)
+        self.bump_version(session, user_id)
+
+    def delete(self, session, date, fake_id, user_id):
+        record = self.get_by_number(session, date, fake_id, user_id)
+        self._remove(user_id, date, [record])
+        self.bump_version(session, user_id)
+
+    def update_many(self, session, date, user_id, ranges=None, filters=None, **kwargs):
+        records = self._selection(date, user_id, ranges, filters)
+        new_date = kwargs.pop("task_date", date)
+        for record in records:
+            for k, v in kwargs.items():
+                setattr(record, k, v)
+        if records and new_date != date:
+            # Moved tasks keep their order and get numbers after the last task of the new day
+            self._move(records, user_id, date, new_date)
+        if records:
+            self.bump_version(session, user_id)
+        return len(records)
+
+    def delete_many(self, session, date, user_id, ranges=None, filters=None):
+        records = self._selection(date, user_id, ranges, filters)
+        if records:
+            self._remove(user_id, date, records)
+            self.bump_version(session, user_id)
+        return len(records)
+
+    def get_summary(self, session, user_id, date_from, date_to):
+        # Computed from the tasks on every call, so there is nothing to maintain
+        days = {}
+        for record in self.store.archived:
+            if record.user_id == user_id and date_from <= record.task_date <= date_to:
+                days.setdefault((user_id, record.task_date), []).append(record)
+        for key, records in self.store.days.items():
+            if key[0] == user_id and date_from <= key[1] <= date_to:
+                days.setdefault(key, []).extend(records)
+        for key in sorted(days):
+            records = days[key]
+            yield (
+                key[1],
+                len(records),
+                sum(record.done for record in records),
+                sum(record.important for record in records),
+                sum(record.important and record.done for record in records)
+            )
+
+    def rebuild_summary(self, session, user_id=None):
+        days = {(record.user_id, record.task_date) for record in self.store.archived}
+        return len({key for key in days.union(self.store.days) if user_id in (None, key[0])})
+
+    def archive(self, session, before):
+        archived = 0
+        for key in [key for key in self.store.days if key[1] < before]:
+            records = self.store.days.pop(key)
+            self.store.archived.extend(records)
+            archived += len(records)
+            self.bump_version(session, key[0])
+        return archived
+
+    def create_recurring(self, session, recurring):
+        recurring.id = next(self.store.recurring_ids)
+        self.store.recurring[recurring.id] = recurring
+        self.bump_version(session, recurring.user_id)
+
+    def get_recurring(self, session, user_id, date_from=None, date_to=None, important=None):
+        return [
+            recurring for recurring in self.store.recurring.values()
+            if recurring.user_id == user_id
+            and (date_to == None or recurring.start_date <= date_to)
+            and (date_from == None or recurring.end_date == None or recurring.end_date >= date_from)
+            and important in (None, recurring.important)
+        ]
+
+    def get_recurring_by_id(self, session, user_id, recurring_id):
+        recurring = self.store.recurring.get(recurring_id)
+        return recurring if recurring != None and recurring.user_id == user_id else None
+
+    def delete_recurring(self, session, user_id, recurring_id):
+        if self.get_recurring_by_id(session, user_id, recurring_id) == None:
+            return 0
+        del self.store.recurring[recurring_id]
+        self.store.skips = {skip for skip in self.store.skips if skip[0] != recurring_id}
+        self.bump_version(session, user_id)
+        return 1
+
+    def get_skips(self, session, user_id, date_from, date_to):
+        return {
+            (recurring_id, day) for recurring_id, day in self.store.skips
+            if date_from <= day <= date_to and self.get_recurring_by_id(session, user_id, recurring_id) != None
+        }
+
+    def skip(self, session, user_id, recurring_id, date):
+        self.store.skips.add((recurring_id, date))
+        self.bump_version(session, user_id)
+
+    @contextmanager
+    def savepoint(self, session):
+        # Writes are checked before they change the store, so there is nothing to roll back
+        yield
+
+    def is_transient(self, error):
+        return False
+
+    def get_applied_writes(self, session, keys):
+        return self.store.applied_writes.intersection(keys)
+
+    def add_applied_writes(self, session, keys):
+        self.store.applied_writes.update(keys)
+
+    def get_by_number(self, session, date, number, user_id):
+        records = self.store.days.get((user_id, date), [])
+        i = bisect_left(records, number, key=by_number)
+        if i == len(records) or records[i].number != number:
+            raise TaskNotFoundException(number, date)
+        return records[i]
+
+    def get_version(self, session, user_id):
+        return self.store.versions.get(user_id, 0)
+
+    def bump_version(self, session, user_id):
+        if user_id in self.store.versions:
+            self.store.versions[user_id] += 1
+
+    def reserve_numbers(self, session, user_id, date, count=1):
+        records = self.store.days.get((user_id, date))
+        last = max(self.store.last_numbers.get((user_id, date), 0), records[-1].number if records else 0)
+        self.store.last_numbers[(user_id, date)] = last + count
+        return last + 1
+
+    def delete_all(self, session):
+        self.store.days.clear()
+        self.store.archived.clear()
+        self.store.applied_writes.clear()
+        self.store.last_numbers.clear()
+        self.store.recurring.clear()
+        self.store.skips.clear()
+
+    def _records(self, user_id, task_date, after):
+        if user_id != None and task_date != None:
+            keys = [(user_id, task_date)]
+        else:
+            keys = sorted(key for key in self.store.days if user_id in (None, key[0]) and task_date in (None, key[1]))
+        for key in keys:
+            records = self.store.days.get(key, [])
+            start = 0 if after == None else bisect_right(records, after, key=by_number)
+            yield from islice(records, start, None)
+
+    def _selection(self, date, user_id, ranges, filters):
+        records = self.store.days.get((user_id, date), [])
+        return [
+            record for record in records
+            if (ranges == None or any(first <= record.number <= last for first, last in ranges))
+            and record.matches(filters or {})
+        ]
+
+    def _add(self, user_id, task_date, number, task_description, done, important, timestamp):
+        record = TaskRecord(next(self.store.task_ids), user_id, task_date, number, task_description, done, important, timestamp)
+        self.store.days.setdefault((user_id, task_date), []).append(record)
+        return record
+
+    def _move(self, records, user_id, date, new_date):
+        self._remove(user_id, date, records)
+        number = self.reserve_numbers(None, user_id, new_date, len(records))
+        now = datetime.now()
+        day = self.store.days.setdefault((user_id, new_date), [])
+        for record in records:
+            record.task_date = new_date
+            record.number = number
+            record.timestamp = now
+            day.append(record)
+            number += 1
+
+    def _remove(self, user_id, date, records):
+        removed = {id(record) for record in records}
+        remaining = [record for record in self.store.days[(user_id, date)] if id(record) not in removed]
+        if remaining:
+            self.store.days[(user_id, date)] = remaining
+        else:
+            del self.store.days[(user_id, date)]
+
+
+class MemoryUserRepository:
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+
+    def get_all(self, session):
+        return list(self.store.users.values())
+
+    def create(self, session, user):
+        if any(other.user_name == user.user_name for other in self.store.users.values()):
+            raise IntegrityError("INSERT INTO app_user", {"user_name": user.user_name}, ValueError("duplicate user_name"))
+        user.id = next(self.store.user_ids)
+        user.tasks_version = 0
+        self.store.users[user.id] = user
+        self.store.versions[user.id] = 0
+
+    def get_by_username_and_password(self, session, username, password):
+        for user in self.store.users.values():
+            if user.user_name == username and user.user_password == password:
+                return user
+        return None
+
+    def update(self, session, **kwargs):
+        user = next((user for user in self.store.users.values() if all(getattr(user, k) == v for k, v in kwargs.items())), None)
+        for k, v in kwargs.items():
+            setattr(user, k, v)
+
+    def delete_all(self, session):
+        self.store.users.clear()
+        self.store.versions.clear()
+
+
+class MemorySessionRepository:
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+
+    def create(self, session, user_id, token, expires_at):
+        user_session = UserSession(id=next(self.store.session_ids), user_id=user_id, token=token, last_updated=datetime.now(), expires_at=expires_at)
+        self.store.sessions[token] = user_session
+
+    def get_by_token(self, session, token):
+        return self.store.sessions.get(token)
+
+    def delete(self, session, token):
+        self.store.sessions.pop(token, None)
+
+    def delete_expired(self, session):
+        now = datetime.now()
+        expired = [token for token, user_session in self.store.sessions.items() if user_session.expires_at <= now]
+        for token in expired:
+            del self.store.sessions[token]
+        return len(expired)
+
+    def delete_all(self, session):
+        self.store.sessions.clear()
+
+    def update(self, session, id):
+        for user_session in self.store.sessions.values():
+            if user_session.id == id:
+                user_session.last_updated = datetime.now()
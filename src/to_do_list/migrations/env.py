@@ -0,0 +1,13 @@
+from alembic import context
+from to_do_list.database import Base, get_engine
+from to_do_list import models
+
+
+def run_migrations():
+    with get_engine().connect() as connection:
+        context.configure(connection=connection, target_metadata=Base.metadata, render_as_batch=True)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+run_migrations()
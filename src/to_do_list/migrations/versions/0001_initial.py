@@ -0,0 +1,45 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-03-01 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "app_user",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_name", sa.String(20), nullable=False, unique=True),
+        sa.Column("user_password", sa.String(20), nullable=False),
+    )
+    op.create_table(
+        "task",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("app_user.id"), nullable=False),
+        sa.Column("task_date", sa.Date(), nullable=False),
+        sa.Column("task_description", sa.String(150), nullable=False),
+        sa.Column("done", sa.Boolean(), nullable=False),
+        sa.Column("important", sa.Boolean(), nullable=False),
+        sa.Column("timestamp", sa.TIMESTAMP(), nullable=False),
+    )
+    op.create_table(
+        "user_session",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("app_user.id"), nullable=False),
+        sa.Column("last_updated", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("user_session")
+    op.drop_table("task")
+    op.drop_table("app_user")
@@ -0,0 +1,36 @@
+"""persisted per-day task numbers
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-03-08 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("task", sa.Column("number", sa.Integer(), nullable=True))
+    # Number existing tasks the way 'show' used to rank them.
+    op.execute("""
+        UPDATE task SET number = numbered.rn
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY user_id, task_date ORDER BY timestamp, id) AS rn
+            FROM task
+        ) AS numbered
+        WHERE task.id = numbered.id
+    """)
+    with op.batch_alter_table("task") as batch_op:
+        batch_op.alter_column("number", existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index("ix_task_user_date_number", ["user_id", "task_date", "number"], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table("task") as batch_op:
+        batch_op.drop_index("ix_task_user_date_number")
+        batch_op.drop_column("number")
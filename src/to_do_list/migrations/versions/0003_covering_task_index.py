@@ -0,0 +1,26 @@
+"""cover show queries with the task number index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-03-15 12:00:00
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index("ix_task_user_date_number", table_name="task")
+    op.create_index(
+        "ix_task_user_date_number", "task", ["user_id", "task_date", "number"], unique=True,
+        postgresql_include=["task_description", "done", "important"]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_task_user_date_number", table_name="task")
+    op.create_index("ix_task_user_date_number", "task", ["user_id", "task_date", "number"], unique=True)
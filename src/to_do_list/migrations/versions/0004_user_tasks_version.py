@@ -0,0 +1,23 @@
+"""per-user tasks version for client caches
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-03-22 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("app_user", sa.Column("tasks_version", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade():
+    with op.batch_alter_table("app_user") as batch_op:
+        batch_op.drop_column("tasks_version")
@@ -0,0 +1,32 @@
+"""token based user sessions
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-03-29 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Old sessions are not tied to any client token, so everyone logs in again
+    op.execute("DELETE FROM user_session")
+    with op.batch_alter_table("user_session") as batch_op:
+        batch_op.add_column(sa.Column("token", sa.String(64), nullable=False))
+        batch_op.add_column(sa.Column("expires_at", sa.DateTime(), nullable=False))
+        batch_op.create_unique_constraint("user_session_token_key", ["token"])
+        batch_op.create_index("ix_user_session_expires_at", ["expires_at"])
+
+
+def downgrade():
+    with op.batch_alter_table("user_session") as batch_op:
+        batch_op.drop_index("ix_user_session_expires_at")
+        batch_op.drop_constraint("user_session_token_key", type_="unique")
+        batch_op.drop_column("expires_at")
+        batch_op.drop_column("token")
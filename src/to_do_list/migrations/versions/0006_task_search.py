@@ -0,0 +1,36 @@
+"""full-text search index on task descriptions
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-04-05 12:00:00
+"""
+from alembic import op
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_context().dialect.name != "postgresql":
+        return
+    op.execute("CREATE INDEX ix_task_search ON task USING gin (to_tsvector('simple', task_description))")
+    # Substring search ('todo search --substring') uses a trigram index when
+    # pg_trgm has been installed by a superuser: CREATE EXTENSION pg_trgm
+    op.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX ix_task_description_trgm ON task USING gin (task_description gin_trgm_ops);
+            END IF;
+        END $$
+    """)
+
+
+def downgrade():
+    if op.get_context().dialect.name != "postgresql":
+        return
+    op.execute("DROP INDEX IF EXISTS ix_task_description_trgm")
+    op.execute("DROP INDEX ix_task_search")
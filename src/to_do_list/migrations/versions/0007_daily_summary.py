@@ -0,0 +1,39 @@
+"""daily task summaries for 'todo stats'
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-04-12 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "daily_summary",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("app_user.id"), primary_key=True),
+        sa.Column("task_date", sa.Date(), primary_key=True),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("done", sa.Integer(), nullable=False),
+        sa.Column("important", sa.Integer(), nullable=False),
+        sa.Column("important_done", sa.Integer(), nullable=False)
+    )
+    op.execute("""
+        INSERT INTO daily_summary (user_id, task_date, total, done, important, important_done)
+        SELECT user_id, task_date, count(*),
+            count(CASE WHEN done THEN 1 END),
+            count(CASE WHEN important THEN 1 END),
+            count(CASE WHEN important AND done THEN 1 END)
+        FROM task
+        GROUP BY user_id, task_date
+    """)
+
+
+def downgrade():
+    op.drop_table("daily_summary")
@@ -0,0 +1,39 @@
+"""recurring tasks expanded at query time
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-04-19 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "recurring_task",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("app_user.id"), nullable=False),
+        sa.Column("task_description", sa.String(150), nullable=False),
+        sa.Column("important", sa.Boolean(), nullable=False),
+        sa.Column("rule", sa.String(10), nullable=False),
+        sa.Column("start_date", sa.Date(), nullable=False),
+        sa.Column("end_date", sa.Date(), nullable=True)
+    )
+    op.create_index("ix_recurring_task_user_id", "recurring_task", ["user_id"])
+    op.create_table(
+        "recurring_skip",
+        sa.Column("recurring_id", sa.Integer(), sa.ForeignKey("recurring_task.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("task_date", sa.Date(), primary_key=True)
+    )
+
+
+def downgrade():
+    op.drop_table("recurring_skip")
+    op.drop_index("ix_recurring_task_user_id", "recurring_task")
+    op.drop_table("recurring_task")
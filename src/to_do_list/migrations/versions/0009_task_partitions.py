@@ -0,0 +1,92 @@
+"""partition tasks by month and add the task archive
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2024-04-26 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from to_do_list.partitions import COLUMNS, create_partitions
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def create_task_table(partitioned):
+    primary_key = "id, task_date" if partitioned else "id"
+    op.execute(f"""
+        CREATE TABLE task (
+            id INTEGER NOT NULL DEFAULT nextval('task_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES app_user (id),
+            task_date DATE NOT NULL,
+            task_description VARCHAR(150) NOT NULL,
+            done BOOLEAN NOT NULL,
+            important BOOLEAN NOT NULL,
+            number INTEGER NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY ({primary_key})
+        ) {"PARTITION BY RANGE (task_date)" if partitioned else ""}
+    """)
+    # The sequence would be dropped together with the old table otherwise
+    op.execute("ALTER SEQUENCE task_id_seq OWNED BY task.id")
+
+
+def create_task_indexes():
+    op.execute("""
+        CREATE UNIQUE INDEX ix_task_user_date_number ON task (user_id, task_date, number)
+        INCLUDE (task_description, done, important)
+    """)
+    op.execute("CREATE INDEX ix_task_search ON task USING gin (to_tsvector('simple', task_description))")
+    op.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX ix_task_description_trgm ON task USING gin (task_description gin_trgm_ops);
+            END IF;
+        END $$
+    """)
+
+
+def replace_task_table(partitioned):
+    # Indexes and the primary key are renamed with the old table, as their names are taken by the new one
+    op.execute("ALTER TABLE task RENAME TO task_old")
+    op.execute("ALTER TABLE task_old RENAME CONSTRAINT task_pkey TO task_old_pkey")
+    op.execute("ALTER INDEX ix_task_user_date_number RENAME TO ix_task_old_user_date_number")
+    op.execute("DROP INDEX ix_task_search")
+    op.execute("DROP INDEX IF EXISTS ix_task_description_trgm")
+    create_task_table(partitioned)
+    if partitioned:
+        op.execute("CREATE TABLE task_default PARTITION OF task DEFAULT")
+        first_day = op.get_bind().execute(sa.text("SELECT min(task_date) FROM task_old")).scalar()
+        create_partitions(op.get_bind(), since=first_day)
+    op.execute(f"INSERT INTO task ({COLUMNS}) SELECT {COLUMNS} FROM task_old")
+    op.execute("DROP TABLE task_old")
+    create_task_indexes()
+
+
+def upgrade():
+    op.create_table(
+        "task_archive",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("app_user.id"), nullable=False),
+        sa.Column("task_date", sa.Date(), nullable=False),
+        sa.Column("task_description", sa.String(150), nullable=False),
+        sa.Column("done", sa.Boolean(), nullable=False),
+        sa.Column("important", sa.Boolean(), nullable=False),
+        sa.Column("number", sa.Integer(), nullable=False),
+        sa.Column("timestamp", sa.TIMESTAMP(), nullable=False)
+    )
+    op.create_index("ix_task_archive_user_date", "task_archive", ["user_id", "task_date"])
+    if op.get_context().dialect.name == "postgresql":
+        replace_task_table(partitioned=True)
+
+
+def downgrade():
+    if op.get_context().dialect.name == "postgresql":
+        replace_task_table(partitioned=False)
+    op.execute(f"INSERT INTO task ({COLUMNS}) SELECT {COLUMNS} FROM task_archive")
+    op.drop_index("ix_task_archive_user_date", "task_archive")
+    op.drop_table("task_archive")
@@ -0,0 +1,28 @@
+"""idempotency keys of replayed offline writes
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2024-05-03 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "applied_write",
+        sa.Column("key", sa.String(32), primary_key=True),
+        sa.Column("applied_at", sa.DateTime(), nullable=False)
+    )
+    op.create_index("ix_applied_write_applied_at", "applied_write", ["applied_at"])
+
+
+def downgrade():
+    op.drop_index("ix_applied_write_applied_at", "applied_write")
+    op.drop_table("applied_write")
@@ -0,0 +1,35 @@
+"""last task number of every day
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2024-05-10 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "day_number",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("app_user.id"), primary_key=True),
+        sa.Column("task_date", sa.Date(), primary_key=True),
+        sa.Column("last_number", sa.Integer(), nullable=False)
+    )
+    op.execute("""
+        INSERT INTO day_number (user_id, task_date, last_number)
+        SELECT user_id, task_date, max(number) FROM (
+            SELECT user_id, task_date, number FROM task
+            UNION ALL
+            SELECT user_id, task_date, number FROM task_archive
+        ) AS numbered GROUP BY user_id, task_date
+    """)
+
+
+def downgrade():
+    op.drop_table("day_number")
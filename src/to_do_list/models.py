@@ -1,6 +1,8 @@
-from sqlalchemy import ForeignKey, String, TIMESTAMP, UniqueConstraint
+from sqlalchemy import DDL, ForeignKey, String, TIMESTAMP, UniqueConstraint, Index, PrimaryKeyConstraint, event, func, text
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Mapped, mapped_column
 from datetime import date, datetime
+from typing import NamedTuple, Optional
 from .database import Base 
 
 class User(Base):
@@ -8,22 +10,31 @@ class User(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     user_name: Mapped[str] = mapped_column(String(20), unique=True)
     user_password: Mapped[str] = mapped_column(String(20))
+    # Bumped on every change of the user's tasks, so clients can validate their caches
+    tasks_version: Mapped[int] = mapped_column(default=0, server_default="0")
     
 
 class Task(Base):
     __tablename__ = "task"
+    __table_args__ = (
+        Index(
+            "ix_task_user_date_number", "user_id", "task_date", "number", unique=True,
+            postgresql_include=["task_description", "done", "important"]
+        ),
+        # Monthly partitions on PostgreSQL, see partitions.py
+        {"postgresql_partition_by": "RANGE (task_date)", "info": {"partition_key": "task_date"}}
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("app_user.id"))
     task_date: Mapped[date]
     task_description: Mapped[str] = mapped_column(String(150))
     done: Mapped[bool]
     important: Mapped[bool]
-    timestamp: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now())
+    number: Mapped[int]
+    timestamp: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now)
 
     def __str__(self):
-        done = "\u2611" if self.done else "\u2610"
-        important = "\u22C6" if self.important else " "
-        return f"{self.task_date}  {self.id}  {done}  {self.task_description}  {important}"
+        return format_task(self)
     
     def __eq__(self, obj) -> bool:
         return self.user_id == obj.user_id and \
@@ -33,8 +44,106 @@ class Task(Base):
         self.important == obj.important and \
         self.timestamp == obj.timestamp
 
+class TaskRow(NamedTuple):
+    """A task as read for display. Its id is the task number within the day"""
+    task_description: str
+    task_date: date
+    done: bool
+    important: bool
+    user_id: int
+    id: int
+
+    def __str__(self):
+        return format_task(self)
+
+def format_task(task):
+    done = "\u2611" if task.done else "\u2610"
+    important = "\u22C6" if task.important else " "
+    return f"{task.task_date}  {task.id}  {done}  {task.task_description}  {important}"
+
+# Full-text search over descriptions ('todo search'), PostgreSQL only
+SEARCH_CONFIG = text("'simple'")
+Index(
+    "ix_task_search", func.to_tsvector(SEARCH_CONFIG, Task.task_description),
+    postgresql_using="gin"
+).ddl_if(dialect="postgresql")
+
+# Rows of days without a monthly partition
+event.listen(
+    Task.__table__, "after_create",
+    DDL("CREATE TABLE task_default PARTITION OF task DEFAULT").execute_if(dialect="postgresql")
+)
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def compile_primary_key(constraint, compiler, **kw):
+    # The primary key of a partitioned table has to contain the partition key. The ORM
+    # keeps identifying tasks by id alone, which stays unique through its sequence
+    partition_key = constraint.table.info.get("partition_key")
+    if partition_key == None:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    columns = [column.name for column in constraint.columns] + [partition_key]
+    return f"PRIMARY KEY ({', '.join(columns)})"
+
+class TaskArchive(Base):
+    """Tasks moved out of 'task' by 'todo archive'. Only 'todo stats' still counts them"""
+    __tablename__ = "task_archive"
+    __table_args__ = (
+        Index("ix_task_archive_user_date", "user_id", "task_date"),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey("app_user.id"))
+    task_date: Mapped[date]
+    task_description: Mapped[str] = mapped_column(String(150))
+    done: Mapped[bool]
+    important: Mapped[bool]
+    number: Mapped[int]
+    timestamp: Mapped[datetime] = mapped_column(TIMESTAMP)
+
+class RecurringTask(Base):
+    """A task repeated by a rule (see custom_types.RECURRENCE_RULES). Its occurrences
+    are not stored until they are changed"""
+    __tablename__ = "recurring_task"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("app_user.id"), index=True)
+    task_description: Mapped[str] = mapped_column(String(150))
+    important: Mapped[bool]
+    rule: Mapped[str] = mapped_column(String(10))
+    start_date: Mapped[date]
+    end_date: Mapped[Optional[date]]
+
+class RecurringSkip(Base):
+    """An occurrence not expanded any more: it became a task or was deleted"""
+    __tablename__ = "recurring_skip"
+    recurring_id: Mapped[int] = mapped_column(ForeignKey("recurring_task.id", ondelete="CASCADE"), primary_key=True)
+    task_date: Mapped[date] = mapped_column(primary_key=True)
+
+class DailySummary(Base):
+    """Task counts of a user's day ('todo stats'), recomputed for every day whose tasks change"""
+    __tablename__ = "daily_summary"
+    user_id: Mapped[int] = mapped_column(ForeignKey("app_user.id"), primary_key=True)
+    task_date: Mapped[date] = mapped_column(primary_key=True)
+    total: Mapped[int]
+    done: Mapped[int]
+    important: Mapped[int]
+    important_done: Mapped[int]
+
+class DayNumber(Base):
+    """Last number given to a task of a user's day, so that numbers of deleted tasks are not given again"""
+    __tablename__ = "day_number"
+    user_id: Mapped[int] = mapped_column(ForeignKey("app_user.id"), primary_key=True)
+    task_date: Mapped[date] = mapped_column(primary_key=True)
+    last_number: Mapped[int]
+
+class AppliedWrite(Base):
+    """Idempotency key of a replayed journal entry, see journal.py"""
+    __tablename__ = "applied_write"
+    key: Mapped[str] = mapped_column(String(32), primary_key=True)
+    applied_at: Mapped[datetime] = mapped_column(index=True)
+
 class UserSession(Base):
     __tablename__ = "user_session"
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("app_user.id"))
-    last_updated: Mapped[datetime]
\ No newline at end of file
+    token: Mapped[str] = mapped_column(String(64), unique=True)
+    last_updated: Mapped[datetime]
+    expires_at: Mapped[datetime] = mapped_column(index=True)
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""Monthly partitions of the task table (PostgreSQL only).
+
+On PostgreSQL 'task' is partitioned by range of task_date, one partition per
+month named task_YYYY_MM. Rows of months without a partition go to
+task_default. 'todo init', 'todo migrate' and the daemon create partitions for
+the coming months; a partition created for a month that already has rows takes
+them over from task_default.
+
+'todo archive' detaches the partitions of past months and moves their rows to
+task_archive, so the hot table and its indexes only hold recent history.
+"""
+import re
+from datetime import date
+from sqlalchemy import text
+
+MONTHS_AHEAD = 3
+DEFAULT_PARTITION = "task_default"
+COLUMNS = "id, user_id, task_date, task_description, done, important, number, timestamp"
+PARTITION_NAME = re.compile(r"task_(\d{4})_(\d{2})$")
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"task_{month:%Y_%m}"
+
+
+def is_partitioned(connection):
+    if connection.dialect.name != "postgresql":
+        return False
+    query = text("SELECT EXISTS (SELECT FROM pg_partitioned_table WHERE partrelid = to_regclass('task'))")
+    return connection.execute(query).scalar_one()
+
+
+def get_partitions(connection):
+    """Return {first day of month: partition name} of the monthly partitions"""
+    names = connection.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'task'::regclass
+    """)).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def create_partitions(connection, since=None, through=None):
+    """Create the missing monthly partitions from the month of 'since' to the month of 'through'
+    (this month to MONTHS_AHEAD months ahead by default). Return their names"""
+    if not is_partitioned(connection):
+        return []
+    today = date.today()
+    month = add_months(since or today, 0)
+    last = add_months(through or add_months(today, MONTHS_AHEAD), 0)
+    existing = get_partitions(connection)
+    created = []
+    while month <= last:
+        if month not in existing:
+            created.append(create_partition(connection, month))
+        month = add_months(month, 1)
+    return created
+
+
+def create_partition(connection, month):
+    name = partition_name(month)
+    end = add_months(month, 1)
+    # Attaching a partition fails while task_default holds rows of its month, so they are moved first
+    connection.execute(text(f"CREATE TABLE {name} (LIKE task INCLUDING DEFAULTS)"))
+    connection.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE task_date >= :start AND task_date < :end RETURNING {COLUMNS}
+        )
+        INSERT INTO {name} ({COLUMNS}) SELECT {COLUMNS} FROM moved
+    """), {"start": month, "end": end})
+    connection.execute(text(f"ALTER TABLE task ATTACH PARTITION {name} FOR VALUES FROM ('{month}') TO ('{end}')"))
+    return name
+
+
+def archive_partitions(connection, before):
+    """Move the rows of the monthly partitions ending on or before 'before' to task_archive
+    and drop the partitions. Return the number of archived tasks"""
+    archived = 0
+    for month, name in sorted(get_partitions(connection).items()):
+        if add_months(month, 1) > before:
+            break
+        connection.execute(text(f"ALTER TABLE task DETACH PARTITION {name}"))
+        archived += connection.execute(text(f"INSERT INTO task_archive ({COLUMNS}) SELECT {COLUMNS} FROM {name}")).rowcount
+        connection.execute(text(f"DROP TABLE {name}"))
+    return archived
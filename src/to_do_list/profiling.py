@@ -0,0 +1,125 @@
+"""Per-command timing and SQL statistics for 'todo --profile'.
+
+Imported only when profiling is enabled. The event listeners are registered
+for one command and removed afterwards.
+"""
+import json
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+MAX_SHOWN_STATEMENTS = 50
+
+
+def process_started():
+    # Set by the 'todo' entry point as early as possible
+    return getattr(sys.modules.get("to_do_list.client"), "STARTED", None)
+
+
+class Profiler:
+    def __init__(self, command, args, started=None):
+        self.command = command
+        self.args = args
+        self.started = started or time.perf_counter()
+        started = process_started()
+        self.startup = self.started - started if started != None else None
+        # Commands import these lazily; import them here so that their time is not counted as query work
+        from . import database, models, repository, service
+        self.imports = time.perf_counter() - self.started
+        self.connect = 0.0
+        self.connections = 0
+        self.commit = 0.0
+        self.statements = []
+        self._listeners = [
+            (Engine, "do_connect", self.do_connect),
+            (Engine, "before_cursor_execute", self.before_cursor_execute),
+            (Engine, "after_cursor_execute", self.after_cursor_execute),
+            (Session, "before_commit", self.before_commit),
+            (Session, "after_commit", self.after_commit),
+            (Session, "after_rollback", self.after_commit)
+        ]
+        for target, name, listener in self._listeners:
+            event.listen(target, name, listener)
+
+    def do_connect(self, dialect, connection_record, cargs, cparams):
+        start = time.perf_counter()
+        connection = dialect.loaded_dbapi.connect(*cargs, **cparams)
+        self.connect += time.perf_counter() - start
+        self.connections += 1
+        return connection
+
+    def before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        connection.info["profile_started"] = time.perf_counter()
+
+    def after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info.pop("profile_started")
+        # Drivers report rows of SELECT statements only if they fetched them all (psycopg does, sqlite3 does not)
+        rows = cursor.rowcount if cursor.rowcount >= 0 else None
+        self.statements.append((statement, elapsed, rows))
+
+    def before_commit(self, session):
+        session.info["profile_commit_started"] = time.perf_counter()
+
+    def after_commit(self, session):
+        started = session.info.pop("profile_commit_started", None)
+        if started != None:
+            self.commit += time.perf_counter() - started
+
+    def stop(self):
+        for target, name, listener in self._listeners:
+            event.remove(target, name, listener)
+        total = time.perf_counter() - self.started
+        sql = sum(elapsed for _, elapsed, _ in self.statements)
+        rows = [rows for _, _, rows in self.statements if rows != None]
+        phases = {
+            "startup": self.startup,
+            "imports": self.imports,
+            "connect": self.connect,
+            "sql": sql,
+            "commit": self.commit,
+            # Python work: ORM hydration, formatting and output
+            "other": max(total - self.imports - self.connect - sql - self.commit, 0.0),
+            "total": total
+        }
+        return {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "command": self.command,
+            "args": self.args,
+            "phases_ms": {name: ms(seconds) for name, seconds in phases.items()},
+            "connections": self.connections,
+            "statement_count": len(self.statements),
+            "rows": sum(rows) if rows else None,
+            "statements": [{"sql": statement, "ms": ms(elapsed), "rows": rows} for statement, elapsed, rows in self.statements]
+        }
+
+    def report(self, destination):
+        """Write the profile to stderr ('-') or append it as a JSON line to the file 'destination'"""
+        profile = self.stop()
+        if destination == "-":
+            sys.stderr.write(format_profile(profile))
+        else:
+            with open(destination, "a") as log:
+                log.write(json.dumps(profile) + "\n")
+
+
+def ms(seconds):
+    return round(seconds * 1000, 3) if seconds != None else None
+
+
+def format_profile(profile):
+    phases = profile["phases_ms"]
+    lines = [f"Profile of '{profile['command']}':"]
+    for name, value in phases.items():
+        if value != None:
+            lines.append(f"  {name:<8}{value:10.3f} ms")
+    lines.append(f"  {profile['connections']} new connections, {profile['statement_count']} statements, {profile['rows'] or 0} rows")
+    for statement in profile["statements"][:MAX_SHOWN_STATEMENTS]:
+        sql = " ".join(statement["sql"].split())
+        rows = "" if statement["rows"] == None else f"{statement['rows']} rows"
+        lines.append(f"  {statement['ms']:10.3f} ms {rows:>10}  {sql[:100]}")
+    if profile["statement_count"] > MAX_SHOWN_STATEMENTS:
+        lines.append(f"  ... {profile['statement_count'] - MAX_SHOWN_STATEMENTS} more statements")
+    return "\n".join(lines) + "\n"
@@ -1,54 +1,416 @@
-from sqlalchemy import select, func
-from sqlalchemy.orm import aliased
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import select, func, insert, update, delete, and_, or_, case, bindparam, union_all
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import NoResultFound
-from datetime import datetime
-from .models import Task, User, UserSession
+from datetime import datetime, timedelta
+from .models import Task, TaskArchive, TaskRow, User, UserSession, DailySummary, RecurringTask, RecurringSkip, AppliedWrite, DayNumber, SEARCH_CONFIG
 from .exceptions import TaskNotFoundException
+from .partitions import archive_partitions, is_partitioned
+from .database import unreachable, locked
+from . import watch
+
+# Statements run by most commands are built once. Their compiled form is then
+# found in SQLAlchemy's cache without building and hashing a new statement per
+# call, and psycopg prepares them on the server (see DB_PREPARE_THRESHOLD).
+# Rows of SELECT_TASKS have the fields of TaskRow, in the same order.
+SELECT_TASKS = select(
+    Task.task_description,
+    Task.task_date,
+    Task.done,
+    Task.important,
+    Task.user_id,
+    Task.number.label("id")
+).select_from(Task)
+DAY_TASKS = SELECT_TASKS.where(
+    Task.user_id == bindparam("uid"), Task.task_date == bindparam("day"), Task.number > bindparam("after")
+).order_by(Task.number)
+TASK_BY_NUMBER = select(Task).where(
+    Task.user_id == bindparam("uid"), Task.task_date == bindparam("day"), Task.number == bindparam("no")
+)
+TASKS_VERSION = select(User.tasks_version).where(User.id == bindparam("uid"))
+BUMP_VERSION = update(User).where(User.id == bindparam("uid")).values(tasks_version=User.tasks_version + 1)
+# Delivered to listeners of the channel on commit, see watch.py
+NOTIFY = select(func.pg_notify(bindparam("channel"), bindparam("payload")))
+USER_BY_CREDENTIALS = select(User).where(User.user_name == bindparam("name"), User.user_password == bindparam("password"))
+SESSION_BY_TOKEN = select(UserSession).where(UserSession.token == bindparam("token"))
+DELETE_SESSION = delete(UserSession).where(UserSession.token == bindparam("token"))
+DELETE_EXPIRED_SESSIONS = delete(UserSession).where(UserSession.expires_at <= bindparam("now"))
+SUMMARY_COLUMNS = ("user_id", "task_date", "total", "done", "important", "important_done")
+# Archived tasks are still counted by 'todo stats'
+COUNTED_TASKS = union_all(
+    select(Task.user_id, Task.task_date, Task.done, Task.important),
+    select(TaskArchive.user_id, TaskArchive.task_date, TaskArchive.done, TaskArchive.important)
+).subquery("counted_task")
+DAY_COUNTS = select(
+    COUNTED_TASKS.c.user_id,
+    COUNTED_TASKS.c.task_date,
+    func.count(),
+    func.count(case((COUNTED_TASKS.c.done, 1))),
+    func.count(case((COUNTED_TASKS.c.important, 1))),
+    func.count(case((and_(COUNTED_TASKS.c.important, COUNTED_TASKS.c.done), 1)))
+).group_by(COUNTED_TASKS.c.user_id, COUNTED_TASKS.c.task_date)
+# Journals are replayed soon after the database is back, their keys are not needed for longer
+APPLIED_WRITES_KEPT = timedelta(days=30)
+ARCHIVE_COLUMNS = ("id", "user_id", "task_date", "task_description", "done", "important", "number", "timestamp")
+
+
+def reserve_numbers_statement(dialect_insert):
+    # The first reservation of a day starts after its existing tasks. The row of the day stays
+    # locked until commit, so concurrent writers get different numbers
+    first_reservation = select(func.coalesce(func.max(Task.number), 0) + bindparam("count")).where(
+        Task.user_id == bindparam("uid"), Task.task_date == bindparam("day")
+    ).scalar_subquery()
+    return dialect_insert(DayNumber).values(
+        user_id=bindparam("uid"), task_date=bindparam("day"), last_number=first_reservation
+    ).on_conflict_do_update(
+        index_elements=[DayNumber.user_id, DayNumber.task_date],
+        set_={"last_number": DayNumber.last_number + bindparam("count")}
+    ).returning(DayNumber.last_number)
+
+RESERVE_NUMBERS = {"postgresql": reserve_numbers_statement(postgresql.insert), "sqlite": reserve_numbers_statement(sqlite.insert)}
 
 
 class TaskRepository:
     def get_tasks(self, session, **kwargs):
-        t = aliased(Task)
+        return list(self.iter_tasks(session, **kwargs))
+
+
+    def iter_tasks(self, session, after=None, limit=None, **kwargs):
+        """Yield tasks in their stable order, starting after the task number 'after' (keyset pagination)"""
+        if "user_id" in kwargs and "task_date" in kwargs:
+            # A day of a user, as shown by 'todo show'
+            params = {"uid": kwargs.pop("user_id"), "day": kwargs.pop("task_date"), "after": after or 0}
+            query = DAY_TASKS.filter_by(**kwargs) if kwargs else DAY_TASKS
+            if limit != None:
+                query = query.limit(limit)
+            for row in session.execute(query.execution_options(yield_per=1000), params):
+                yield TaskRow._make(row)
+            return
+        query = SELECT_TASKS.filter_by(**kwargs).order_by(Task.user_id, Task.task_date, Task.number)
+        if after != None:
+            query = query.filter(Task.number > after)
+        if limit != None:
+            query = query.limit(limit)
+        for row in session.execute(query.execution_options(yield_per=1000)):
+            yield TaskRow._make(row)
+
+
+    def get_tasks_in_range(self, session, date_from, date_to, **kwargs):
+        query = SELECT_TASKS.filter_by(**kwargs).filter(
+            Task.task_date.between(date_from, date_to)
+        ).order_by(Task.task_date, Task.number)
+        for row in session.execute(query.execution_options(yield_per=1000)):
+            yield TaskRow._make(row)
+
+
+    def search(self, session, user_id, text, date_from=None, date_to=None, limit=20, offset=0, substring=False, **kwargs):
+        query = SELECT_TASKS.filter_by(user_id=user_id, **kwargs)
+        if substring:
+            query = query.filter(Task.task_description.icontains(text, autoescape=True))
+            order = (Task.task_date.desc(), Task.number)
+        elif session.get_bind().dialect.name != "postgresql":
+            # No full-text search here: every word has to occur in the description
+            query = query.filter(*[Task.task_description.icontains(word, autoescape=True) for word in text.split()])
+            order = (Task.task_date.desc(), Task.number)
+        else:
+            vector = func.to_tsvector(SEARCH_CONFIG, Task.task_description)
+            ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+            query = query.filter(vector.op("@@")(ts_query))
+            order = (func.ts_rank(vector, ts_query).desc(), Task.task_date.desc(), Task.number)
+        if date_from != None:
+            query = query.filter(Task.task_date >= date_from)
+        if date_to != None:
+            query = query.filter(Task.task_date <= date_to)
+        query = query.order_by(*order).limit(limit).offset(offset)
+        return [TaskRow._make(row) for row in session.execute(query)]
+
+
+    def export_rows(self, session, date_from=None, date_to=None, user_id=None, batch_size=1000):
         query = select(
-            t.task_description,
-            t.task_date,
-            t.done,
-            t.important,
-            t.user_id,
-            func.rank().over(order_by=t.timestamp).label("id")
-        ).select_from(t).filter_by(**kwargs)
-        result = []
-        for row in session.execute(query).all():
-            result.append(Task(**row._asdict()))
-        return result
-        
+            Task.user_id,
+            Task.task_date,
+            Task.number,
+            Task.task_description,
+            Task.done,
+            Task.important
+        ).order_by(Task.user_id, Task.task_date, Task.number)
+        if user_id != None:
+            query = query.filter(Task.user_id == user_id)
+        if date_from != None:
+            query = query.filter(Task.task_date >= date_from)
+        if date_to != None:
+            query = query.filter(Task.task_date <= date_to)
+        yield from session.execute(query.execution_options(yield_per=batch_size))
+
 
     def create(self, session, task):
+        self.bump_version(session, task.user_id, (task.task_date,))
+        task.number = self.reserve_numbers(session, task.user_id, task.task_date)
         session.add(task)
+        self.refresh_summary(session, task.user_id, {task.task_date})
+
+
+    def create_many(self, session, tasks):
+        counts = Counter((task["user_id"], task["task_date"]) for task in tasks)
+        days = {}
+        for user_id, day in counts:
+            days.setdefault(user_id, set()).add(day)
+        # In the order of user ids, so that concurrent imports for several users do not deadlock
+        for user_id in sorted(days):
+            self.bump_version(session, user_id, days[user_id])
+        next_numbers = {key: self.reserve_numbers(session, *key, count) for key, count in sorted(counts.items())}
+        now = datetime.now()
+        for task in tasks:
+            key = (task["user_id"], task["task_date"])
+            task["number"] = next_numbers[key]
+            task["timestamp"] = now
+            next_numbers[key] += 1
+        if not tasks:
+            return
+        if session.get_bind().dialect.name == "postgresql":
+            self._copy(session, tasks)
+        else:
+            session.execute(insert(Task), tasks)
+        for user_id, user_days in days.items():
+            self.refresh_summary(session, user_id, user_days)
+
+
+    def _copy(self, session, tasks):
+        columns = ("user_id", "task_date", "task_description", "done", "important", "number", "timestamp")
+        dbapi_connection = session.connection().connection
+        with dbapi_connection.cursor() as cursor:
+            with cursor.copy(f"COPY task ({', '.join(columns)}) FROM STDIN") as copy:
+                for task in tasks:
+                    copy.write_row([task[column] for column in columns])
 
 
     def update(self, session, date, fake_id, user_id, **kwargs):
-        try:
-            query = select(Task).filter_by(task_date=date, user_id=user_id).order_by(Task.timestamp).offset(fake_id - 1).limit(1)
-            task = session.execute(query).scalar_one()
-            for k, v in kwargs.items():
-                if k == "task_date":
-                    task.timestamp = datetime.now()
-                setattr(task, k, v)
-            # session.commit()
-        except NoResultFound:
-            raise TaskNotFoundException(fake_id, date)
+        task = self.get_by_number(session, date, fake_id, user_id)
+        days = {date, kwargs.get("task_date", date)}
+        self.bump_version(session, user_id, days)
+        for k, v in kwargs.items():
+            if k == "task_date" and v != task.task_date:
+                task.number = self.reserve_numbers(session, user_id, v)
+                task.timestamp = datetime.now()
+            setattr(task, k, v)
+        self.refresh_summary(session, user_id, days)
 
 
     def delete(self, session, date, fake_id, user_id):
+        task = self.get_by_number(session, date, fake_id, user_id)
+        self.bump_version(session, user_id, (date,))
+        session.delete(task)
+        self.refresh_summary(session, user_id, {date})
+
+
+    def update_many(self, session, date, user_id, ranges=None, filters=None, **kwargs):
+        condition = self._selection(date, user_id, ranges, filters)
+        new_date = kwargs.pop("task_date", date)
+        self.bump_version(session, user_id, {date, new_date})
+        if new_date != date:
+            # Moved tasks keep their order and get numbers after the last task of the new day
+            count = session.execute(select(func.count()).select_from(Task).where(condition)).scalar_one()
+            if count == 0:
+                return 0
+            base = self.reserve_numbers(session, user_id, new_date, count) - 1
+            renumbered = select(
+                Task.id,
+                (func.row_number().over(order_by=Task.number) + base).label("number")
+            ).where(condition).subquery()
+            query = update(Task).where(Task.id == renumbered.c.id).values(
+                number=renumbered.c.number, task_date=new_date, timestamp=datetime.now(), **kwargs
+            )
+        else:
+            # '--day DATE' alone changes nothing, but the selected tasks are still counted
+            query = update(Task).where(condition).values(**(kwargs or {"task_date": date}))
+        count = session.execute(query, execution_options={"synchronize_session": False}).rowcount
+        if count:
+            self.refresh_summary(session, user_id, {date, new_date})
+        return count
+
+
+    def delete_many(self, session, date, user_id, ranges=None, filters=None):
+        self.bump_version(session, user_id, (date,))
+        query = delete(Task).where(self._selection(date, user_id, ranges, filters))
+        count = session.execute(query, execution_options={"synchronize_session": False}).rowcount
+        if count:
+            self.refresh_summary(session, user_id, {date})
+        return count
+
+
+    def _selection(self, date, user_id, ranges, filters):
+        conditions = [Task.user_id == user_id, Task.task_date == date]
+        if ranges != None:
+            conditions.append(or_(*[Task.number.between(first, last) for first, last in ranges]))
+        for k, v in (filters or {}).items():
+            conditions.append(getattr(Task, k) == v)
+        return and_(*conditions)
+
+
+    def create_recurring(self, session, recurring):
+        self.bump_version(session, recurring.user_id)
+        session.add(recurring)
+        session.flush()
+
+
+    def get_recurring(self, session, user_id, date_from=None, date_to=None, important=None):
+        """Recurring tasks of a user, only those active between date_from and date_to if given"""
+        query = select(RecurringTask).where(RecurringTask.user_id == user_id).order_by(RecurringTask.id)
+        if date_to != None:
+            query = query.where(RecurringTask.start_date <= date_to)
+        if date_from != None:
+            query = query.where(or_(RecurringTask.end_date == None, RecurringTask.end_date >= date_from))
+        if important != None:
+            query = query.where(RecurringTask.important == important)
+        return session.execute(query).scalars().all()
+
+
+    def get_recurring_by_id(self, session, user_id, recurring_id):
+        query = select(RecurringTask).where(RecurringTask.id == recurring_id, RecurringTask.user_id == user_id)
+        return session.execute(query).scalar()
+
+
+    def delete_recurring(self, session, user_id, recurring_id):
+        """Delete a recurring task. Tasks made of its occurrences stay"""
+        self.bump_version(session, user_id)
+        session.execute(delete(RecurringSkip).where(RecurringSkip.recurring_id == recurring_id))
+        query = delete(RecurringTask).where(RecurringTask.id == recurring_id, RecurringTask.user_id == user_id)
+        return session.execute(query, execution_options={"synchronize_session": False}).rowcount
+
+
+    def get_skips(self, session, user_id, date_from, date_to):
+        """(recurring task id, day) of occurrences between date_from and date_to that are not expanded"""
+        query = select(RecurringSkip.recurring_id, RecurringSkip.task_date).join(RecurringTask).where(
+            RecurringTask.user_id == user_id, RecurringSkip.task_date.between(date_from, date_to)
+        )
+        return {tuple(row) for row in session.execute(query)}
+
+
+    def skip(self, session, user_id, recurring_id, date):
+        self.bump_version(session, user_id)
+        session.add(RecurringSkip(recurring_id=recurring_id, task_date=date))
+
+
+    def get_by_number(self, session, date, number, user_id):
         try:
-            query = select(Task).filter_by(task_date=date, user_id=user_id).order_by(Task.timestamp).offset(fake_id - 1).limit(1)
-            task = session.execute(query).scalar_one()
-            session.delete(task)
+            return session.execute(TASK_BY_NUMBER, {"uid": user_id, "day": date, "no": number}).scalar_one()
         except NoResultFound:
-            raise TaskNotFoundException(fake_id, date)
+            raise TaskNotFoundException(number, date)
+
+
+    def get_version(self, session, user_id):
+        return session.execute(TASKS_VERSION, {"uid": user_id}).scalar() or 0
+
+
+    def bump_version(self, session, user_id, days=()):
+        """Record a change of the user's tasks (on these days, on any day if none are given).
+        Writes call it before anything else: it locks the user's row, and taking that lock
+        first on every write path keeps concurrent writes of a user from deadlocking"""
+        session.execute(BUMP_VERSION, {"uid": user_id})
+        if session.get_bind().dialect.name == "postgresql":
+            session.execute(NOTIFY, {"channel": watch.channel(user_id), "payload": watch.format_days(days)})
+
+
+    def refresh_summary(self, session, user_id, days):
+        """Recompute the summaries of these days of the user from their tasks"""
+        session.flush()
+        session.execute(
+            delete(DailySummary).where(DailySummary.user_id == user_id, DailySummary.task_date.in_(days)),
+            execution_options={"synchronize_session": False}
+        )
+        counts = DAY_COUNTS.where(COUNTED_TASKS.c.user_id == user_id, COUNTED_TASKS.c.task_date.in_(days))
+        session.execute(insert(DailySummary).from_select(SUMMARY_COLUMNS, counts))
+
+
+    def rebuild_summary(self, session, user_id=None):
+        """Recompute the summaries of all days of a user (of all users by default) from their tasks"""
+        query = delete(DailySummary)
+        counts = DAY_COUNTS
+        if user_id != None:
+            query = query.where(DailySummary.user_id == user_id)
+            counts = counts.where(COUNTED_TASKS.c.user_id == user_id)
+        session.execute(query, execution_options={"synchronize_session": False})
+        return session.execute(insert(DailySummary).from_select(SUMMARY_COLUMNS, counts)).rowcount
+
+
+    def get_summary(self, session, user_id, date_from, date_to):
+        """Yield (task_date, total, done, important, important_done) of the days with tasks"""
+        query = select(
+            DailySummary.task_date,
+            DailySummary.total,
+            DailySummary.done,
+            DailySummary.important,
+            DailySummary.important_done
+        ).where(
+            DailySummary.user_id == user_id, DailySummary.task_date.between(date_from, date_to)
+        ).order_by(DailySummary.task_date)
+        yield from session.execute(query)
+
+
+    def archive(self, session, before):
+        """Move the tasks of all users dated before 'before' to task_archive. Return their number"""
+        connection = session.connection()
+        archived = 0
+        if is_partitioned(connection):
+            # Whole months are moved by detaching their partitions, without deleting rows one by one
+            archived += archive_partitions(connection, before)
+        columns = [getattr(Task, name) for name in ARCHIVE_COLUMNS]
+        old = Task.task_date < before
+        if connection.dialect.name == "postgresql":
+            moved = delete(Task).where(old).returning(*columns).cte("moved")
+            query = insert(TaskArchive).from_select(ARCHIVE_COLUMNS, select(moved)).add_cte(moved)
+            archived += session.execute(query).rowcount
+        else:
+            archived += session.execute(insert(TaskArchive).from_select(ARCHIVE_COLUMNS, select(*columns).where(old))).rowcount
+            session.execute(delete(Task).where(old), execution_options={"synchronize_session": False})
+        if archived:
+            session.execute(update(User).values(tasks_version=User.tasks_version + 1))
+        return archived
+
+
+    @contextmanager
+    def savepoint(self, session):
+        """Roll back only the writes of the block if it fails"""
+        with session.begin_nested():
+            yield
+
+
+    def is_transient(self, error):
+        """Whether 'error' may not happen on a retry, as opposed to a write the database rejects"""
+        return unreachable(error) or locked(error)
+
+
+    def get_applied_writes(self, session, keys):
+        """Return the keys of journal entries that were already replayed"""
+        if not keys:
+            return set()
+        return set(session.execute(select(AppliedWrite.key).where(AppliedWrite.key.in_(keys))).scalars())
+
+
+    def add_applied_writes(self, session, keys):
+        now = datetime.now()
+        session.execute(
+            delete(AppliedWrite).where(AppliedWrite.applied_at < now - APPLIED_WRITES_KEPT),
+            execution_options={"synchronize_session": False}
+        )
+        if keys:
+            session.execute(insert(AppliedWrite), [{"key": key, "applied_at": now} for key in keys])
+
+
+    def reserve_numbers(self, session, user_id, date, count=1):
+        """Reserve 'count' numbers for new tasks of the day and return the first. Numbers of
+        deleted tasks are not given again"""
+        statement = RESERVE_NUMBERS[session.get_bind().dialect.name]
+        return session.execute(statement, {"uid": user_id, "day": date, "count": count}).scalar_one() - count + 1
         
     def delete_all(self, session):
+        session.execute(RecurringSkip.__table__.delete())
+        session.execute(RecurringTask.__table__.delete())
+        session.execute(DailySummary.__table__.delete())
+        session.execute(TaskArchive.__table__.delete())
+        session.execute(AppliedWrite.__table__.delete())
+        session.execute(DayNumber.__table__.delete())
         session.execute(Task.__table__.delete())
 
 
@@ -63,8 +425,7 @@ class UserRepository:
 
 
     def get_by_username_and_password(self, session, username, password):
-        query = select(User).filter_by(user_name=username, user_password=password)
-        return session.execute(query).scalar()
+        return session.execute(USER_BY_CREDENTIALS, {"name": username, "password": password}).scalar()
         
     def update(self, session, **kwargs):
         query = select(User).filter_by(**kwargs)
@@ -77,19 +438,22 @@ class UserRepository:
         
 
 class SessionRepository:
-    def create(self, session, user_id):
-        user_session = UserSession(user_id=user_id, last_updated=datetime.now())
+    def create(self, session, user_id, token, expires_at):
+        user_session = UserSession(user_id=user_id, token=token, last_updated=datetime.now(), expires_at=expires_at)
         session.add(user_session)
 
-    def get_current_session(self, session):
-        return session.execute(select(UserSession)).scalar()
+    def get_by_token(self, session, token):
+        return session.execute(SESSION_BY_TOKEN, {"token": token}).scalar()
 
-    def delete(self, session):
-        user_session = self.get_current_session(session)
-        if user_session != None:
-            session.delete(user_session)
+    def delete(self, session, token):
+        session.execute(DELETE_SESSION, {"token": token})
+
+    def delete_expired(self, session):
+        return session.execute(DELETE_EXPIRED_SESSIONS, {"now": datetime.now()}).rowcount
+
+    def delete_all(self, session):
+        session.execute(UserSession.__table__.delete())
             
     def update(self, session, id):
         user_session = session.get(UserSession, id)
         user_session.last_updated = datetime.now()
-
@@ -1,11 +1,18 @@
+import secrets
+import time
 from datetime import datetime, timedelta
-from .exceptions import UserNotLoggedInException, SessionHasExpiredException
+from .exceptions import UserNotLoggedInException, SessionHasExpiredException, RecurringTaskNotFoundException
+from .tokens import TokenStore, InvalidTokenError, sign, verify
+from .custom_types import RecurringId, week_of, month_of, occurs_on
 
 class UserService:
 
-    def __init__(self, user_repository, session_repository):
+    def __init__(self, user_repository, session_repository, token_store=None, signing_key=None, session_ttl=timedelta(hours=1)):
         self.user_repository = user_repository
         self.session_repository = session_repository
+        self.token_store = token_store or TokenStore()
+        self.signing_key = signing_key or secrets.token_bytes(32)
+        self.session_ttl = session_ttl
  
     def create(self, session, user):
          self.user_repository.create(session, user)
@@ -19,25 +26,58 @@ class UserService:
     def login(self, session, username, password):
         user = self.get_user(session, username, password)
         if user != None:
-            self.session_repository.delete(session)
-            self.session_repository.create(session, user.id)
+            self.logout(session)
+            self.session_repository.delete_expired(session)
+            token = secrets.token_hex(32)
+            expires_at = datetime.now() + self.session_ttl
+            self.session_repository.create(session, user.id, token, expires_at)
+            claims = {"sid": token, "uid": user.id, "exp": expires_at.timestamp()}
+            self.token_store.save(sign(claims, self.signing_key))
         return user != None
     
     def logout(self, session):
-        self.session_repository.delete(session)
+        claims = self._claims()
+        if claims != None:
+            self.session_repository.delete(session, claims["sid"])
+        self.token_store.clear()
 
     def get_current_user(self, session):
-        user_session = self.session_repository.get_current_session(session)
-        if user_session == None:
+        """Verify the local session token. Needs no database query"""
+        claims = self._claims()
+        if claims == None:
             raise UserNotLoggedInException()
-        if (user_session.last_updated + timedelta(hours=+1) <= datetime.now()):
+        if (claims["exp"] <= time.time()):
             raise SessionHasExpiredException() 
-        return user_session.user_id
+        return claims["uid"]
+
+    def verify_session(self, session):
+        """Check the session token against the server, where a logout (or a sweep once it expired)
+        revokes it. get_current_user only checks the token locally"""
+        claims = self._claims()
+        if claims == None:
+            raise UserNotLoggedInException()
+        user_session = self.session_repository.get_by_token(session, claims["sid"])
+        # A token signed for another user than its session's is not trusted either
+        if user_session == None or user_session.user_id != claims["uid"]:
+            raise SessionHasExpiredException()
+
+    def sweep_sessions(self, session):
+        return self.session_repository.delete_expired(session)
+
+    def _claims(self):
+        token = self.token_store.load()
+        if token == None:
+            return None
+        try:
+            return verify(token, self.signing_key)
+        except InvalidTokenError:
+            return None
     
     def get_all(self, session):
         return self.user_repository.get_all(session)
     
     def delete_all(self, session):
+        self.session_repository.delete_all(session)
         self.user_repository.delete_all(session)
 
 
@@ -49,14 +89,153 @@ class TaskService:
     def create(self, session, task):
         self.repository.create(session, task)
 
+    def create_many(self, session, tasks):
+        self.repository.create_many(session, tasks)
+
     def delete(self, session, date, fake_id, user_id):
         self.repository.delete(session, date, fake_id, user_id)
 
     def update(self, session, date, fake_id, user_id, **kwargs):
         self.repository.update(session, date, fake_id, user_id, **kwargs)
 
+    def update_many(self, session, date, user_id, ranges=None, filters=None, **kwargs):
+        return self.repository.update_many(session, date, user_id, ranges, filters, **kwargs)
+
+    def delete_many(self, session, date, user_id, ranges=None, filters=None):
+        return self.repository.delete_many(session, date, user_id, ranges, filters)
+
     def get_tasks(self, session, **kwargs):
         return self.repository.get_tasks(session, **kwargs)
+
+    def iter_tasks(self, session, after=None, limit=None, **kwargs):
+        return self.repository.iter_tasks(session, after, limit, **kwargs)
+
+    def search(self, session, user_id, text, date_from=None, date_to=None, limit=20, offset=0, substring=False, **kwargs):
+        return self.repository.search(session, user_id, text, date_from, date_to, limit, offset, substring, **kwargs)
+
+    def get_version(self, session, user_id):
+        return self.repository.get_version(session, user_id)
+
+    def get_tasks_in_range(self, session, date_from, date_to, **kwargs):
+        return self.repository.get_tasks_in_range(session, date_from, date_to, **kwargs)
+
+    def export_rows(self, session, date_from=None, date_to=None, user_id=None):
+        return self.repository.export_rows(session, date_from, date_to, user_id)
+
+    def get_stats(self, session, user_id, date_from, date_to, by="day"):
+        """Task counts per day, week or month from the daily summaries.
+        Returns (first day of the period, total, done, important, important done) tuples"""
+        periods = {}
+        for task_date, *counts in self.repository.get_summary(session, user_id, date_from, date_to):
+            start = week_of(task_date)[0] if by == "week" else month_of(task_date)[0] if by == "month" else task_date
+            totals = periods.setdefault(start, [0, 0, 0, 0])
+            for i, count in enumerate(counts):
+                totals[i] += count
+        return [(start, *totals) for start, totals in periods.items()]
+
+    def rebuild_summary(self, session, user_id=None):
+        return self.repository.rebuild_summary(session, user_id)
+
+    def archive(self, session, before):
+        return self.repository.archive(session, before)
+
+    def replay(self, session, entries, rejected=None):
+        """Apply the journaled writes (see journal.py) not applied before, in their order.
+        Returns their number. Entries failing for another reason than an unreachable
+        database are skipped and appended to 'rejected' if given"""
+        applied = self.repository.get_applied_writes(session, [entry.get("key") for entry in entries])
+        entries = [entry for entry in entries if entry.get("key") not in applied]
+        # Consecutive additions are written together, but before any later update or delete
+        groups = []
+        for entry in entries:
+            if entry.get("op") == "create" and groups and groups[-1][0].get("op") == "create":
+                groups[-1].append(entry)
+            else:
+                groups.append([entry])
+        written = []
+        for group in groups:
+            written.extend(self._replay_group(session, group, rejected))
+        self.repository.add_applied_writes(session, [entry["key"] for entry in written])
+        return len(written)
+
+    def _replay_group(self, session, group, rejected):
+        try:
+            with self.repository.savepoint(session):
+                if group[0]["op"] == "create":
+                    self.create_many(session, [
+                        {k: entry[k] for k in ("user_id", "task_date", "task_description", "done", "important")} for entry in group
+                    ])
+                elif group[0]["op"] == "update":
+                    entry = group[0]
+                    self.update_many(session, entry["date"], entry["user_id"], entry["ranges"], entry["filters"], **entry["values"])
+                elif group[0]["op"] == "delete":
+                    entry = group[0]
+                    self.delete_many(session, entry["date"], entry["user_id"], entry["ranges"], entry["filters"])
+                else:
+                    raise ValueError(f"Unknown journaled operation {group[0]['op']!r}")
+            return group
+        except Exception as e:
+            if rejected == None or self.repository.is_transient(e):
+                raise
+            if len(group) > 1:
+                # Only the failing additions are set aside
+                return [entry for single in group for entry in self._replay_group(session, [single], rejected)]
+            rejected.extend(group)
+            return []
+
+    def create_recurring(self, session, recurring):
+        self.repository.create_recurring(session, recurring)
+
+    def get_recurring(self, session, user_id):
+        return self.repository.get_recurring(session, user_id)
+
+    def delete_recurring(self, session, user_id, recurring_id):
+        if not self.repository.delete_recurring(session, user_id, recurring_id):
+            raise RecurringTaskNotFoundException(recurring_id)
+
+    def get_occurrences(self, session, user_id, date_from, date_to, **filters):
+        """Yield occurrences of recurring tasks from date_from to date_to as task rows with ids like 'r3'.
+        They are expanded here and not stored, so they are never done"""
+        from .models import TaskRow
+        if filters.get("done"):
+            return
+        definitions = self.repository.get_recurring(session, user_id, date_from, date_to, filters.get("important"))
+        if not definitions:
+            return
+        skips = self.repository.get_skips(session, user_id, date_from, date_to)
+        day = date_from
+        while day <= date_to:
+            for recurring in definitions:
+                if occurs_on(recurring.rule, recurring.start_date, recurring.end_date, day) and (recurring.id, day) not in skips:
+                    yield TaskRow(recurring.task_description, day, False, recurring.important, user_id, RecurringId(f"r{recurring.id}"))
+            day += timedelta(days=1)
+
+    def materialize(self, session, date, user_id, recurring_ids, **kwargs):
+        """Turn occurrences on 'date' into tasks with the changes in kwargs. Returns the number of new tasks"""
+        tasks = []
+        for recurring in self._occurrences(session, date, user_id, recurring_ids):
+            self.repository.skip(session, user_id, recurring.id, date)
+            task = {"user_id": user_id, "task_date": date, "task_description": recurring.task_description, "done": False, "important": recurring.important}
+            task.update(kwargs)
+            tasks.append(task)
+        self.repository.create_many(session, tasks)
+        return len(tasks)
+
+    def skip_occurrences(self, session, date, user_id, recurring_ids):
+        """Delete occurrences on 'date'. Returns their number"""
+        count = 0
+        for recurring in self._occurrences(session, date, user_id, recurring_ids):
+            self.repository.skip(session, user_id, recurring.id, date)
+            count += 1
+        return count
+
+    def _occurrences(self, session, date, user_id, recurring_ids):
+        skips = self.repository.get_skips(session, user_id, date, date)
+        for recurring_id in dict.fromkeys(recurring_ids):
+            recurring = self.repository.get_recurring_by_id(session, user_id, recurring_id.recurring_id)
+            if recurring != None and (recurring.id, date) not in skips \
+                and occurs_on(recurring.rule, recurring.start_date, recurring.end_date, date):
+                yield recurring
     
     def delete_all(self, session):
         return self.repository.delete_all(session)
@@ -0,0 +1,87 @@
+"""Change feeds for 'todo watch'.
+
+On PostgreSQL every change of a user's tasks sends a notification on the
+user's channel (see TaskRepository.bump_version) with the changed days as
+payload, so a watcher runs no query until its days change. Other databases
+are asked for the user's tasks version every few seconds instead.
+"""
+import select
+import time
+from datetime import date
+
+
+def channel(user_id):
+    return f"todo_tasks_{user_id}"
+
+
+def format_days(days):
+    return ",".join(sorted({day.isoformat() for day in days}))
+
+
+def parse_days(payload):
+    """Changed days of a notification, None for a change that may concern any day"""
+    return {date.fromisoformat(day) for day in payload.split(",")} if payload else None
+
+
+class NotificationFeed:
+    """Yields the changed days (None for any day) whenever the user's tasks change"""
+
+    def __init__(self, connection, user_id, timeout=60.0):
+        # 'connection' is a SQLAlchemy connection of its own, in autocommit mode
+        self.connection = connection
+        self.driver_connection = connection.connection.driver_connection
+        self.timeout = timeout
+        self.received = []
+        self.driver_connection.add_notify_handler(self.received.append)
+        connection.exec_driver_sql(f"LISTEN {channel(user_id)}")
+
+    def close(self):
+        # The connection goes back to the pool
+        self.connection.exec_driver_sql("UNLISTEN *")
+        self.driver_connection.remove_notify_handler(self.received.append)
+
+    def __iter__(self):
+        while True:
+            select.select([self.driver_connection.fileno()], [], [], self.timeout)
+            # Reads pending notifications (they are passed to the handler) and keeps the connection alive
+            self.driver_connection.execute("SELECT 1")
+            if not self.received:
+                continue
+            changed = set()
+            for notification in self.received:
+                days = parse_days(notification.payload)
+                if days == None:
+                    changed = None
+                    break
+                changed |= days
+            self.received.clear()
+            yield changed
+
+
+class VersionFeed:
+    """Yields None (any day may have changed) whenever the user's tasks version changes"""
+
+    def __init__(self, read_version, interval, sleep=None):
+        self.read_version = read_version
+        self.interval = interval
+        self.sleep = sleep or time.sleep
+        # Read before the watched tasks, so that no change after them is missed
+        self.version = read_version()
+
+    def __iter__(self):
+        while True:
+            self.sleep(self.interval)
+            current = self.read_version()
+            if current != self.version:
+                self.version = current
+                yield None
+
+
+def diff_tasks(old, new):
+    """Compare two lists of tasks by (day, number). Returns (added, changed, removed)"""
+    old = {(task.task_date, task.id): task for task in old}
+    new = {(task.task_date, task.id): task for task in new}
+    added = [task for key, task in new.items() if key not in old]
+    changed = [task for key, task in new.items() if key in old and old[key] != task]
+    removed = [task for key, task in old.items() if key not in new]
+    return added, changed, removed
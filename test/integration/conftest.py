@@ -32,7 +32,7 @@ def users():
         User(user_name="Peter", user_password="zxcvb")
     ]
 
-@pytest.fixture(scope="session")
+@pytest.fixture
 def user():
     return User(user_name="Jack", user_password="12345")
 
@@ -62,7 +62,9 @@ def empty_users(user_service, session):
     user_service.logout(session)
     session.flush()
     user_service.delete_all(session)
+    session.expunge_all()
 
 @pytest.fixture
 def empty_tasks(task_service, session):
     task_service.delete_all(session)
+    session.expunge_all()
@@ -1,6 +1,10 @@
 import pytest
+from datetime import timedelta
+from sqlalchemy import event
 from to_do_list.exceptions import UserNotLoggedInException
 from to_do_list.database import Session
+from to_do_list.models import RecurringTask
+from to_do_list.custom_types import RecurringId
 
 @pytest.mark.usefixtures("empty_users")
 class TestUserService:
@@ -70,4 +74,180 @@ class TestTaskService:
         task_service.delete(session, task.task_date, 1, task.user_id)
         session.commit()
         assert len(task_service.get_tasks(session)) == len(tasks) - 1
-        assert len(task_service.get_tasks(session, task_description=task.task_description, user_id=task.user_id)) == 0
\ No newline at end of file
+        assert len(task_service.get_tasks(session, task_description=task.task_description, user_id=task.user_id)) == 0
+
+    def test_task_numbers_are_stable_after_delete(self, task_service, tasks, session):
+        for task in tasks:
+            task_service.create(session, task)
+        session.commit()
+        task = tasks[1]
+        task_service.delete(session, task.task_date, 1, task.user_id)
+        session.commit()
+        tasks_from_db = task_service.get_tasks(session, task_date=task.task_date, user_id=task.user_id)
+        assert [t.id for t in tasks_from_db] == [2]
+        assert tasks_from_db[0].task_description == task.task_description
+
+    def test_create_many_tasks(self, task_service, tasks, session):
+        task_service.create(session, tasks[0])
+        session.commit()
+        rows = [
+            {"user_id": 1, "task_date": tasks[0].task_date, "task_description": f"Task {i}", "done": False, "important": False}
+            for i in range(3)
+        ]
+        task_service.create_many(session, rows)
+        session.commit()
+        tasks_from_db = task_service.get_tasks(session, task_date=tasks[0].task_date, user_id=1)
+        assert [t.id for t in tasks_from_db] == [1, 2, 3, 4]
+
+    def test_export_rows(self, task_service, tasks, session):
+        for task in tasks:
+            task_service.create(session, task)
+        session.commit()
+        today = tasks[0].task_date
+        rows = list(task_service.export_rows(session, today, today, 1))
+        assert [(row.task_description, row.number) for row in rows] == [("Buy milk", 1), ("Buy bread", 2)]
+        assert len(list(task_service.export_rows(session))) == len(tasks)
+
+    def test_get_tasks_in_range(self, task_service, tasks, session):
+        for task in tasks:
+            task_service.create(session, task)
+        session.commit()
+        today = tasks[0].task_date
+        tasks_from_db = list(task_service.get_tasks_in_range(session, today, today + timedelta(days=+1), user_id=1))
+        assert [(t.task_date, t.id) for t in tasks_from_db] == [(today, 1), (today, 2), (today + timedelta(days=+1), 1)]
+
+    def test_changes_bump_user_tasks_version(self, task_service, tasks, session):
+        user_id = tasks[0].user_id
+        version = task_service.get_version(session, user_id)
+        task_service.create(session, tasks[0])
+        session.commit()
+        task_service.delete(session, tasks[0].task_date, 1, user_id)
+        session.commit()
+        assert task_service.get_version(session, user_id) == version + 2
+
+    def test_writes_lock_the_user_row_first(self, task_service, tasks, session):
+        statements = []
+        def record(conn, cursor, statement, *args):
+            if statement.split()[0] in ("INSERT", "UPDATE", "DELETE"):
+                statements.append(statement)
+        engine = session.get_bind()
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            today = tasks[0].task_date
+            tomorrow = today + timedelta(days=+1)
+            writes = [
+                lambda: task_service.create(session, tasks[0]),
+                lambda: task_service.update(session, today, 1, 1, task_date=tomorrow),
+                lambda: task_service.update_many(session, tomorrow, 1, [(1, 1)], {}, task_date=today),
+                lambda: task_service.delete_many(session, today, 1, [(1, 2)], {})
+            ]
+            for write in writes:
+                statements.clear()
+                write()
+                session.commit()
+                assert statements[0].startswith("UPDATE app_user")
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+    def test_update_many_moves_tasks_after_last_task_of_new_day(self, task_service, tasks, session):
+        for task in tasks:
+            task_service.create(session, task)
+        session.commit()
+        today = tasks[0].task_date
+        tomorrow = today + timedelta(days=+1)
+        count = task_service.update_many(session, today, 1, [(1, 2)], {}, task_date=tomorrow, important=True)
+        session.commit()
+        assert count == 2
+        tasks_from_db = task_service.get_tasks(session, task_date=tomorrow, user_id=1)
+        assert [(t.id, t.task_description, t.important) for t in tasks_from_db] == [
+            (1, "Finish report", True), (2, "Buy milk", True), (3, "Buy bread", True)
+        ]
+
+    def test_delete_many_by_filter(self, task_service, tasks, session):
+        for task in tasks:
+            task_service.create(session, task)
+        session.commit()
+        day = tasks[0].task_date
+        count = task_service.delete_many(session, day, 1, None, {"done": True})
+        session.commit()
+        assert count == 1
+        assert [t.task_description for t in task_service.get_tasks(session, user_id=1, task_date=day)] == ["Buy bread"]
+
+    def test_search_tasks(self, task_service, tasks, session):
+        for task in tasks:
+            task_service.create(session, task)
+        session.commit()
+        assert [t.task_description for t in task_service.search(session, 1, "buy")] == ["Buy milk", "Buy bread"]
+        assert [t.task_description for t in task_service.search(session, 1, "buy", done=False)] == ["Buy bread"]
+        assert [t.task_description for t in task_service.search(session, 1, "ilk", substring=True)] == ["Buy milk"]
+        assert task_service.search(session, 1, "gym") == []
+
+    def test_iter_tasks_pages_by_number(self, task_service, tasks, session):
+        task_service.create_many(session, [
+            {"user_id": 1, "task_date": tasks[0].task_date, "task_description": f"Task {i}", "done": False, "important": False}
+            for i in range(5)
+        ])
+        session.commit()
+        page = list(task_service.iter_tasks(session, 2, 2, user_id=1, task_date=tasks[0].task_date))
+        assert [t.id for t in page] == [3, 4]
+
+    def test_daily_summary_follows_changes(self, task_service, tasks, session):
+        for task in tasks:
+            task_service.create(session, task)
+        session.commit()
+        today, tomorrow = tasks[0].task_date, tasks[2].task_date
+        stats = lambda: task_service.get_stats(session, 1, today, tomorrow)
+        assert stats() == [(today, 2, 1, 0, 0), (tomorrow, 1, 0, 1, 0)]
+        task_service.update(session, today, 2, 1, done=True, important=True)
+        task_service.delete(session, tomorrow, 1, 1)
+        session.commit()
+        assert stats() == [(today, 2, 2, 1, 1)]
+        task_service.update_many(session, today, 1, None, None, task_date=tomorrow)
+        session.commit()
+        assert stats() == [(tomorrow, 2, 2, 1, 1)]
+        assert task_service.rebuild_summary(session, 1) == 1
+        assert stats() == [(tomorrow, 2, 2, 1, 1)]
+
+    def test_recurring_task_occurrences(self, task_service, tasks, session):
+        day = tasks[0].task_date
+        recurring = RecurringTask(task_description="Water plants", important=False, rule="daily", start_date=day, end_date=None, user_id=1)
+        task_service.create_recurring(session, recurring)
+        session.commit()
+        occurrences = lambda: [(t.task_date, t.id) for t in task_service.get_occurrences(session, 1, day, day + timedelta(days=1))]
+        assert occurrences() == [(day, f"r{recurring.id}"), (day + timedelta(days=1), f"r{recurring.id}")]
+        assert task_service.materialize(session, day, 1, [RecurringId(f"r{recurring.id}")], done=True) == 1
+        session.commit()
+        assert occurrences() == [(day + timedelta(days=1), f"r{recurring.id}")]
+        assert [(t.task_description, t.done) for t in task_service.get_tasks(session, user_id=1, task_date=day)] == [("Water plants", True)]
+        task_service.delete_recurring(session, 1, recurring.id)
+        session.commit()
+        assert occurrences() == []
+
+    def test_archive_moves_old_tasks(self, task_service, tasks, session):
+        for task in tasks:
+            task_service.create(session, task)
+        session.commit()
+        today, tomorrow = tasks[0].task_date, tasks[2].task_date
+        # Tasks of all users are archived
+        assert task_service.archive(session, tomorrow) == 4
+        session.commit()
+        assert task_service.get_tasks(session, user_id=1, task_date=today) == []
+        assert len(task_service.get_tasks(session, user_id=1, task_date=tomorrow)) == 1
+        # Archived tasks are still counted, also after a change of their day and a rebuild
+        task_service.create_many(session, [{"user_id": 1, "task_date": today, "task_description": "Late task", "done": False, "important": False}])
+        session.commit()
+        assert task_service.get_stats(session, 1, today, today) == [(today, 3, 1, 0, 0)]
+        task_service.rebuild_summary(session, 1)
+        assert task_service.get_stats(session, 1, today, today) == [(today, 3, 1, 0, 0)]
+
+    def test_replay_of_journal_is_idempotent(self, task_service, tasks, session):
+        day = tasks[0].task_date
+        entries = [
+            {"key": "k1", "op": "create", "user_id": 1, "task_date": day, "task_description": "Offline task", "done": False, "important": False},
+            {"key": "k2", "op": "update", "user_id": 1, "date": day, "ranges": [[1, 1]], "filters": {}, "values": {"done": True}}
+        ]
+        assert task_service.replay(session, entries) == 2
+        session.commit()
+        assert task_service.replay(session, entries) == 0
+        session.commit()
+        assert [(t.task_description, t.done) for t in task_service.get_tasks(session, user_id=1, task_date=day)] == [("Offline task", True)]
@@ -3,6 +3,19 @@ from click.testing import CliRunner
 from datetime import date
 from to_do_list.models import Task
 
+@pytest.fixture(autouse=True)
+def local_dirs(monkeypatch, tmp_path):
+    """Keeps tests away from the user's offline journal, cache and replica state"""
+    from to_do_list import cli, config, database
+    monkeypatch.setenv("STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("CACHE_DIR", str(tmp_path / "cache"))
+    cached = (config.get_settings, cli.offline_journal, cli.task_cache, database.get_replicas)
+    for function in cached:
+        function.cache_clear()
+    yield
+    for function in cached:
+        function.cache_clear()
+
 @pytest.fixture
 def cli_runner():
     return CliRunner()
@@ -13,4 +26,11 @@ def tasks():
             Task(id=1, task_description="Buy milk", task_date=date.fromisoformat("2024-02-01"), done=False, important=False),
             Task(id=2, task_description="Buy bread", task_date=date.fromisoformat("2024-02-01"), done=True, important=False),
             Task(id=3, task_description="Clean the house", task_date=date.fromisoformat("2024-02-01"), done=False, important=True)
-        ]
\ No newline at end of file
+        ]
+@pytest.fixture
+def no_recurring_tasks(mocker):
+    mocker.patch("to_do_list.service.TaskService.get_occurrences", side_effect=lambda *args, **kwargs: iter([]))
+
+@pytest.fixture
+def verified_session(mocker):
+    mocker.patch("to_do_list.service.UserService.verify_session")
@@ -0,0 +1,91 @@
+import pytest
+from datetime import date
+from unittest.mock import Mock
+from to_do_list.cache import TaskCache
+from to_do_list.cli import show
+from to_do_list.custom_types import RecurringId
+from to_do_list.models import TaskRow
+from to_do_list.service import TaskService
+
+pytestmark = pytest.mark.usefixtures("no_recurring_tasks")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TaskCache(str(tmp_path / "cache" / "tasks.sqlite"), max_entries=2)
+
+
+def test_cache_returns_stored_tasks(cache, tasks):
+    day = date(2024, 2, 1)
+    assert cache.get(1, day) == None
+    cache.put(1, day, 5, tasks)
+    version, is_fresh, cached = cache.get(1, day)
+    assert version == 5 and is_fresh == False
+    assert cached[2] == {"task_description": "Clean the house", "task_date": day, "done": False, "important": True, "user_id": None, "id": 3}
+
+
+def test_cache_entries_are_fresh_within_stale_window(tmp_path, tasks):
+    cache = TaskCache(str(tmp_path / "tasks.sqlite"), stale_seconds=60)
+    cache.put(1, date(2024, 2, 1), 1, tasks)
+    assert cache.get(1, date(2024, 2, 1))[1] == True
+
+
+def test_cache_evicts_least_recently_checked_days(cache, tasks):
+    for day in (1, 2, 3):
+        cache.put(1, date(2024, 2, day), 1, tasks)
+    assert cache.get(1, date(2024, 2, 1)) == None
+    assert cache.get(1, date(2024, 2, 3)) != None
+
+
+def test_cache_invalidate_removes_user_days(cache, tasks):
+    cache.put(1, date(2024, 2, 1), 1, tasks)
+    cache.put(2, date(2024, 2, 1), 1, tasks)
+    cache.invalidate(1)
+    assert cache.get(1, date(2024, 2, 1)) == None
+    assert cache.get(2, date(2024, 2, 1)) != None
+
+
+def test_show_command_reads_unchanged_day_from_cache(mocker, cli_runner, cache, tasks):
+    session = Mock()
+    mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+    mocker.patch("to_do_list.cli.task_cache", return_value=cache)
+    mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+    mocker.patch("to_do_list.service.TaskService.get_version", return_value=7)
+    mocker.patch("to_do_list.service.TaskService.get_tasks", return_value=tasks)
+    first = cli_runner.invoke(show, ["--day", "2024-02-01"])
+    second = cli_runner.invoke(show, ["--day", "2024-02-01", "--done"])
+    TaskService.get_tasks.assert_called_once_with(session, task_date=date(2024, 2, 1), user_id=1)
+    assert TaskService.get_version.call_count == 2
+    assert first.output.count("\n") == 3
+    assert second.output == "2024-02-01  2  ☑  Buy bread   \n"
+
+
+def test_show_command_reads_occurrences_from_cache(mocker, cli_runner, tmp_path, tasks):
+    cache = TaskCache(str(tmp_path / "tasks.sqlite"), stale_seconds=60)
+    occurrence = TaskRow("Water the plants", date(2024, 2, 1), False, False, 1, RecurringId("r4"))
+    mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=Mock())
+    mocker.patch("to_do_list.cli.task_cache", return_value=cache)
+    mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+    mocker.patch("to_do_list.service.TaskService.get_version", return_value=7)
+    mocker.patch("to_do_list.service.TaskService.get_tasks", return_value=tasks)
+    mocker.patch("to_do_list.service.TaskService.get_occurrences", return_value=[occurrence])
+    first = cli_runner.invoke(show, ["--day", "2024-02-01"])
+    second = cli_runner.invoke(show, ["--day", "2024-02-01"])
+    # Within the stale window the day is served without a query, occurrences included
+    TaskService.get_occurrences.assert_called_once()
+    TaskService.get_version.assert_called_once()
+    assert first.output == second.output
+    assert "r4" in second.output
+    assert cache.get(1, date(2024, 2, 1))[2][-1]["id"] == "r4"
+
+
+def test_each_database_has_a_cache_of_its_own(mocker, tmp_path):
+    from to_do_list import cli, config
+    paths = []
+    for name in ("a.db", "b.db"):
+        settings = config.Settings(_env_file=None, MODE="TEST", DB_BACKEND="sqlite", DB_PATH=str(tmp_path / name), CACHE_DIR=str(tmp_path / "cache"), CACHE_ENABLED=True)
+        mocker.patch("to_do_list.config.get_settings", return_value=settings)
+        cli.task_cache.cache_clear()
+        paths.append(cli.task_cache().path)
+    cli.task_cache.cache_clear()
+    assert paths[0] != paths[1]
@@ -1,20 +1,23 @@
+import json
 import pytest
 from pytest_mock import mocker
-from unittest.mock import Mock
+from unittest.mock import Mock, MagicMock
 from unittest.mock import patch
-from to_do_list.cli import show, add, update, delete
+from to_do_list.cli import show, search, add, update, delete, import_tasks, export_tasks, stats, batch
 from to_do_list.service import UserService, TaskService
 from to_do_list.models import Task
 from datetime import date, timedelta
 from to_do_list.exceptions import SessionHasExpiredException, UserAlreadyExistsExeption, UserNotLoggedInException
 
+pytestmark = pytest.mark.usefixtures("no_recurring_tasks", "verified_session")
+
 
 class TestShowCommand:
     def test_show_command_displays_tasks(self, mocker, cli_runner, tasks):
         session = Mock()
         mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
         mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
-        mocker.patch("to_do_list.service.TaskService.get_tasks", return_value=tasks)
+        mocker.patch("to_do_list.service.TaskService.iter_tasks", return_value=iter(tasks))
         result = cli_runner.invoke(show)
         assert result.exit_code == 0
         assert """2024-02-01  1  \u2610  Buy milk   \n2024-02-01  2  \u2611  Buy bread   \n2024-02-01  3  \u2610  Clean the house  \u22C6\n""" == result.output
@@ -23,10 +26,10 @@ class TestShowCommand:
         session = Mock()
         mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
         mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
-        mocker.patch("to_do_list.service.TaskService.get_tasks", return_value=[])
+        mocker.patch("to_do_list.service.TaskService.iter_tasks", return_value=iter([]))
         result = cli_runner.invoke(show, ['--day', '2024-02-01', '--done', '--not-important'])
         kwargs = {"task_date": date.fromisoformat('2024-02-01'), "user_id": 1, "done": True, "important": False}
-        TaskService.get_tasks.assert_called_once_with(session, **kwargs)
+        TaskService.iter_tasks.assert_called_once_with(session, None, None, **kwargs)
         assert result.exit_code == 0
         assert "No tasks found for 2024-02-01\n" == result.output
 
@@ -51,6 +54,98 @@ class TestShowCommand:
             assert result.exit_code == 0
 
 
+    def test_show_command_displays_page_of_tasks(self, mocker, cli_runner, tasks):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.iter_tasks", return_value=iter(tasks[1:]))
+        result = cli_runner.invoke(show, ["--day", "2024-02-01", "--limit", "2", "--after", "1"])
+        TaskService.iter_tasks.assert_called_once_with(session, 1, 2, task_date=date(2024, 2, 1), user_id=1)
+        assert result.exit_code == 0
+        assert result.output == "2024-02-01  2  \u2611  Buy bread   \n2024-02-01  3  \u2610  Clean the house  \u22C6\nMore tasks may follow. Use --after 3\n"
+
+    def test_show_command_pages_single_day_only(self, cli_runner):
+        result = cli_runner.invoke(show, ["--week", "--limit", "10"])
+        assert result.output == "--limit and --after can be used for a single day only\n"
+
+    def test_show_command_displays_week_grouped_by_day(self, mocker, cli_runner, tasks):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        tasks[2].task_date = date.fromisoformat("2024-02-03")
+        mocker.patch("to_do_list.service.TaskService.get_tasks_in_range", return_value=iter(tasks))
+        result = cli_runner.invoke(show, ["--week", "2024-02-01", "--not-done"])
+        TaskService.get_tasks_in_range.assert_called_once_with(session, date(2024, 1, 29), date(2024, 2, 4), user_id=1, done=False)
+        assert result.exit_code == 0
+        assert result.output == "Thursday\n2024-02-01  1  \u2610  Buy milk   \n2024-02-01  2  \u2611  Buy bread   \n\nSaturday\n2024-02-03  3  \u2610  Clean the house  \u22C6\n"
+
+    def test_show_command_displays_month(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.get_tasks_in_range", return_value=iter([]))
+        result = cli_runner.invoke(show, ["--month", "2024-02-10"])
+        TaskService.get_tasks_in_range.assert_called_once_with(session, date(2024, 2, 1), date(2024, 2, 29), user_id=1)
+        assert result.output == "No tasks found for 2024-02-01 - 2024-02-29\n"
+
+    def test_show_command_rejects_several_ranges(self, mocker, cli_runner):
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        result = cli_runner.invoke(show, ["--day", "today", "--week"])
+        UserService.get_current_user.assert_not_called()
+        assert result.output == "Use only one of --day, --from/--to, --week, --month\n"
+
+    @pytest.mark.parametrize("output, expected", [
+        ("csv", "task_date,id,task_description,done,important\n2024-02-01,1,Buy milk,False,False\n2024-02-01,2,Buy bread,True,False\n2024-02-01,3,Clean the house,False,True\n"),
+        ("tsv", "task_date\tid\ttask_description\tdone\timportant\n2024-02-01\t1\tBuy milk\tFalse\tFalse\n2024-02-01\t2\tBuy bread\tTrue\tFalse\n2024-02-01\t3\tClean the house\tFalse\tTrue\n")
+    ])
+    def test_show_command_writes_machine_readable_output(self, mocker, cli_runner, tasks, output, expected):
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=Mock())
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.iter_tasks", return_value=iter(tasks))
+        result = cli_runner.invoke(show, ["--output", output])
+        assert result.exit_code == 0
+        assert result.output == expected
+
+    def test_show_command_writes_json_array(self, mocker, cli_runner, tasks):
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=Mock())
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.get_tasks_in_range", return_value=iter(tasks[:2]))
+        result = cli_runner.invoke(show, ["--week", "2024-02-01", "--output", "json"])
+        assert result.exit_code == 0
+        assert json.loads(result.output) == [
+            {"task_date": "2024-02-01", "id": 1, "task_description": "Buy milk", "done": False, "important": False},
+            {"task_date": "2024-02-01", "id": 2, "task_description": "Buy bread", "done": True, "important": False}
+        ]
+
+    def test_show_command_writes_empty_json_array(self, mocker, cli_runner):
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=Mock())
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.iter_tasks", return_value=iter([]))
+        result = cli_runner.invoke(show, ["--output", "json"])
+        assert result.exit_code == 0
+        assert result.output == "[]\n"
+
+
+class TestSearchCommand:
+    def test_search_command_displays_page_of_matches(self, mocker, cli_runner, tasks):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.search", return_value=tasks[:2])
+        result = cli_runner.invoke(search, ["buy", "--not-done", "--limit", "2", "--page", "3", "--from", "2024-01-01"])
+        TaskService.search.assert_called_once_with(session, 1, "buy", date(2024, 1, 1), None, 2, 4, False, done=False)
+        assert result.exit_code == 0
+        assert result.output == "2024-02-01  1  \u2610  Buy milk   \n2024-02-01  2  \u2611  Buy bread   \nMore tasks may match. Use --page 4\n"
+
+    def test_search_command_without_matches(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.search", return_value=[])
+        result = cli_runner.invoke(search, ["ilk", "--substring"])
+        TaskService.search.assert_called_once_with(session, 1, "ilk", None, None, 20, 0, True)
+        assert result.output == "No tasks found for 'ilk'\n"
+
 class TestAddCommand:
     def test_add_command_creates_task(self, mocker, cli_runner):
         session = Mock()
@@ -93,16 +188,79 @@ class TestAddCommand:
             assert result.output == UserNotLoggedInException().message + "\n"
             assert result.exit_code == 0
 
+    def test_add_command_when_session_was_revoked(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.UserService.verify_session", side_effect=SessionHasExpiredException)
+        mocker.patch("to_do_list.service.UserService.logout")
+        mocker.patch("to_do_list.service.TaskService.create")
+        result = cli_runner.invoke(add, ["Buy milk"])
+        TaskService.create.assert_not_called()
+        UserService.logout.assert_called_once_with(session)
+        assert result.output == SessionHasExpiredException().message + "\n"
+
 class TestUpdateCommand:
     def test_update_command_updates_task(self, mocker, cli_runner):
         session = Mock()
         mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
         mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
-        mocker.patch("to_do_list.service.TaskService.update")
+        mocker.patch("to_do_list.service.TaskService.update_many", return_value=1)
         result = cli_runner.invoke(update, ["today", "1", "--desc", "Buy bread", "--important"])
         kwargs = {"important": True, "task_description": "Buy bread"}
-        TaskService.update.assert_called_once_with(session, date.today(), 1, 1, **kwargs)
+        TaskService.update_many.assert_called_once_with(session, date.today(), 1, [(1, 1)], {}, **kwargs)
+        session.commit.assert_called_once()
         assert result.exit_code == 0
+        assert result.output == "1 tasks updated\n"
+
+    def test_update_command_updates_id_lists_and_ranges(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.update_many", return_value=7)
+        result = cli_runner.invoke(update, ["today", "1,3", "5-9", "--done"])
+        TaskService.update_many.assert_called_once_with(session, date.today(), 1, [(1, 1), (3, 3), (5, 9)], {}, done=True)
+        assert result.output == "7 tasks updated\n"
+
+    def test_update_command_updates_selection(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.update_many", return_value=2)
+        result = cli_runner.invoke(update, ["yesterday", "--all-not-done", "--day", "today"])
+        TaskService.update_many.assert_called_once_with(session, date.today() + timedelta(days=-1), 1, None, {"done": False}, task_date=date.today())
+        assert result.output == "2 tasks updated\n"
+
+    def test_update_command_materializes_occurrences(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.update_many", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.materialize", return_value=2)
+        result = cli_runner.invoke(update, ["2024-02-01", "2,r1", "r4", "--done"])
+        TaskService.update_many.assert_called_once_with(session, date(2024, 2, 1), 1, [(2, 2)], {}, done=True)
+        TaskService.materialize.assert_called_once_with(session, date(2024, 2, 1), 1, ["r1", "r4"], done=True)
+        assert result.output == "3 tasks updated\n"
+
+    def test_update_command_reports_missing_tasks(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.update_many", return_value=0)
+        result = cli_runner.invoke(update, ["2024-02-01", "4", "--done"])
+        session.commit.assert_not_called()
+        assert result.output == "Task №4 for 2024-02-01 not found\n"
+
+    def test_update_command_requires_ids_or_selection(self, mocker, cli_runner):
+        mocker.patch("to_do_list.service.TaskService.update_many")
+        result = cli_runner.invoke(update, ["today", "--done"])
+        TaskService.update_many.assert_not_called()
+        assert result.output == "Define task ids or one of --all, --all-done, --all-not-done\n"
+
+    def test_update_command_rejects_bad_ids(self, cli_runner):
+        result = cli_runner.invoke(update, ["today", "5-2", "--done"])
+        assert result.exit_code == 2
+        assert "'5-2' is not a correct range of task ids." in result.output
 
     def test_update_command_does_not_update_task_due_to_lack_of_info(self, mocker, cli_runner):
         session = Mock()
@@ -131,7 +289,166 @@ class TestDeleteCommand:
         session = Mock()
         mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
         mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
-        mocker.patch("to_do_list.service.TaskService.delete")
+        mocker.patch("to_do_list.service.TaskService.delete_many", return_value=1)
         result = cli_runner.invoke(delete, ["tomorrow", "3"])
-        TaskService.delete.assert_called_once_with(session, date.today() + timedelta(days=+1), 3, 1)
+        TaskService.delete_many.assert_called_once_with(session, date.today() + timedelta(days=+1), 1, [(3, 3)], {})
+        assert result.exit_code == 0
+        assert result.output == "1 tasks deleted\n"
+
+    def test_delete_command_deletes_all_done_tasks(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.delete_many", return_value=0)
+        result = cli_runner.invoke(delete, ["2024-02-01", "--all-done"])
+        TaskService.delete_many.assert_called_once_with(session, date(2024, 2, 1), 1, None, {"done": True})
+        assert result.output == "No tasks found for 2024-02-01\n"
+
+    def test_delete_command_skips_occurrence(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.delete_many")
+        mocker.patch("to_do_list.service.TaskService.skip_occurrences", return_value=0)
+        result = cli_runner.invoke(delete, ["2024-02-01", "r3"])
+        TaskService.delete_many.assert_not_called()
+        TaskService.skip_occurrences.assert_called_once_with(session, date(2024, 2, 1), 1, ["r3"])
+        assert result.output == "Task №r3 for 2024-02-01 not found\n"
+
+
+class TestImportCommand:
+    def test_import_command_creates_valid_tasks_in_batches(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.create_many")
+        data = "task_date,task_description,done,important\n2024-02-01,Buy milk,true,\n2024-02-02,Buy bread,0,1\n2024-02-03,Clean the house,,\n"
+        result = cli_runner.invoke(import_tasks, ["--batch-size", "2"], input=data)
+        assert TaskService.create_many.call_count == 2
+        first_batch = TaskService.create_many.call_args_list[0].args[1]
+        assert first_batch == [
+            {"user_id": 1, "task_date": date(2024, 2, 1), "task_description": "Buy milk", "done": True, "important": False},
+            {"user_id": 1, "task_date": date(2024, 2, 2), "task_description": "Buy bread", "done": False, "important": True}
+        ]
+        assert session.commit.call_count == 2
+        assert result.exit_code == 0
+        assert result.output.endswith("3 tasks imported, 0 rejected\n")
+
+    def test_import_command_rejects_invalid_rows(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.create_many")
+        data = '{"task_description": "Buy milk"}\n{"task_description": "%s"}\n{"task_description": "Go", "task_date": "2024-13-01"}\nnot json\n' % ("A"*151)
+        with cli_runner.isolated_filesystem():
+            result = cli_runner.invoke(import_tasks, ["--format", "jsonl", "--rejects", "rejects.jsonl"], input=data)
+            with open("rejects.jsonl") as f:
+                rejects = f.read().splitlines()
+        TaskService.create_many.assert_called_once()
+        assert len(TaskService.create_many.call_args.args[1]) == 1
+        assert len(rejects) == 3
+        assert '"line": 2' in rejects[0]
+        assert result.exit_code == 0
+        assert result.output.endswith("1 tasks imported, 3 rejected\n")
+
+    def test_import_command_rejects_descriptions_that_are_not_text(self, mocker, cli_runner):
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=Mock())
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.create_many")
+        data = '{"description": 123}\n{"description": ["a"]}\n{"description": "Buy milk"}\n'
+        with cli_runner.isolated_filesystem():
+            result = cli_runner.invoke(import_tasks, ["--format", "jsonl", "--rejects", "rejects.jsonl"], input=data)
+            with open("rejects.jsonl") as f:
+                rejects = [json.loads(line) for line in f]
+        assert [reject["error"] for reject in rejects] == ["Task description should be a text."] * 2
+        assert [task["task_description"] for task in TaskService.create_many.call_args.args[1]] == ["Buy milk"]
+        assert result.output.endswith("1 tasks imported, 2 rejected\n")
+
+
+class TestExportCommand:
+    def test_export_command_writes_csv(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        rows = [(1, date(2024, 2, 1), 1, "Buy milk", False, False), (1, date(2024, 2, 1), 2, "Buy bread", True, False)]
+        mocker.patch("to_do_list.service.TaskService.export_rows", return_value=iter(rows))
+        result = cli_runner.invoke(export_tasks, ["--from", "2024-02-01", "--to", "2024-02-07"])
+        TaskService.export_rows.assert_called_once_with(session, date(2024, 2, 1), date(2024, 2, 7), 1)
+        assert result.exit_code == 0
+        assert result.output == "task_date,number,task_description,done,important\n2024-02-01,1,Buy milk,False,False\n2024-02-01,2,Buy bread,True,False\n2 tasks exported\n"
+
+    def test_export_command_writes_jsonl(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        rows = [(1, date(2024, 2, 1), 1, "Buy milk", False, True)]
+        mocker.patch("to_do_list.service.TaskService.export_rows", return_value=iter(rows))
+        result = cli_runner.invoke(export_tasks, ["--format", "jsonl"])
+        assert result.exit_code == 0
+        assert result.output.startswith('{"task_date": "2024-02-01", "number": 1, "task_description": "Buy milk", "done": false, "important": true}\n')
+
+
+class TestStatsCommand:
+    def test_stats_command_displays_periods_and_total(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.get_stats", return_value=[(date(2024, 1, 29), 4, 1, 2, 0), (date(2024, 2, 5), 2, 2, 0, 0)])
+        result = cli_runner.invoke(stats, ["--from", "2024-01-29", "--to", "2024-02-11", "--by", "week"])
+        TaskService.get_stats.assert_called_once_with(session, 1, date(2024, 1, 29), date(2024, 2, 11), "week")
+        assert result.exit_code == 0
+        assert result.output == (
+            "Period       Tasks    Done  Not done  Important  Done %\n"
+            "2024-W05         4       1         3          2     25%\n"
+            "2024-W06         2       2         0          0    100%\n"
+            "Total            6       3         3          2     50%\n"
+        )
+
+    def test_stats_command_rebuilds_summary(self, mocker, cli_runner):
+        session = Mock()
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.rebuild_summary", return_value=12)
+        mocker.patch("to_do_list.service.TaskService.get_stats", return_value=[])
+        result = cli_runner.invoke(stats, ["--rebuild", "--to", "2024-02-11"])
+        TaskService.rebuild_summary.assert_called_once_with(session, 1)
+        session.commit.assert_called_once()
         assert result.exit_code == 0
+        assert result.output == "Summary rebuilt for 12 days\nNo tasks found for 2024-01-13 - 2024-02-11\n"
+
+
+class TestBatchCommand:
+    def test_batch_shares_connection_and_user_lookup(self, mocker, cli_runner):
+        session = Mock()
+        engine = MagicMock()
+        mocker.patch("to_do_list.database.get_engine", return_value=engine)
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.create")
+        result = cli_runner.invoke(batch, input='add "Buy milk"\n# a comment\n\ntodo add "Buy bread" --important\n')
+        assert result.exit_code == 0
+        engine.connect.assert_called_once()
+        UserService.get_current_user.assert_called_once()
+        assert [call.args[1].task_description for call in TaskService.create.call_args_list] == ["Buy milk", "Buy bread"]
+
+    def test_atomic_batch_stops_and_rolls_back_on_failure(self, mocker, cli_runner):
+        session = Mock()
+        engine = MagicMock()
+        connection = engine.connect.return_value.__enter__.return_value
+        mocker.patch("to_do_list.database.get_engine", return_value=engine)
+        mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+        mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+        mocker.patch("to_do_list.service.TaskService.create")
+        mocker.patch("to_do_list.service.TaskService.update_many", return_value=0)
+        result = cli_runner.invoke(batch, ["--atomic"], input='add "Buy milk"\nupdate 2024-02-01 9 --done\nadd "Buy bread"\n')
+        assert result.exit_code == 1
+        TaskService.create.assert_called_once()
+        connection.begin.return_value.rollback.assert_called_once()
+        connection.begin.return_value.commit.assert_not_called()
+        assert "no changes were saved" in result.output
+
+    def test_batch_reports_failed_lines(self, mocker, cli_runner):
+        mocker.patch("to_do_list.database.get_engine", return_value=MagicMock())
+        result = cli_runner.invoke(batch, input='daemon\nadd "unclosed\n')
+        assert result.exit_code == 1
+        assert result.output == "Line 1: 'daemon' cannot be run in a batch\nLine 2: No closing quotation\n"
@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import event, text
+from to_do_list import config, database
+
+
+def test_sqlite_backend_needs_no_server_settings(monkeypatch, tmp_path):
+    for name in ("USER", "PASS", "DB_NAME"):
+        monkeypatch.delenv(name, raising=False)
+    settings = config.Settings(_env_file=None, MODE="TEST", DB_BACKEND="sqlite", DB_PATH=str(tmp_path / "todo.db"))
+    assert settings.database_url == f"sqlite+pysqlite:///{tmp_path / 'todo.db'}"
+
+
+def test_sqlite_engine_sets_pragmas(monkeypatch, tmp_path):
+    settings = config.Settings(_env_file=None, MODE="TEST", DB_BACKEND="sqlite", DB_PATH=str(tmp_path / "data" / "todo.db"))
+    monkeypatch.setattr(database, "get_settings", lambda: settings)
+    database.get_engine.cache_clear()
+    try:
+        with database.get_engine().connect() as connection:
+            assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert connection.execute(text("PRAGMA foreign_keys")).scalar() == 1
+    finally:
+        database.get_engine.cache_clear()
+
+
+@pytest.mark.parametrize("read_only, begin", [(False, "BEGIN IMMEDIATE"), (True, "BEGIN DEFERRED")])
+def test_sqlite_sessions_that_may_write_take_the_write_lock_first(monkeypatch, tmp_path, read_only, begin):
+    settings = config.Settings(_env_file=None, MODE="TEST", DB_BACKEND="sqlite", DB_PATH=str(tmp_path / "todo.db"))
+    monkeypatch.setattr(database, "get_settings", lambda: settings)
+    database.get_engine.cache_clear()
+    statements = []
+    try:
+        event.listen(database.get_engine(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+        with database.RoutingSession(bind=database.get_engine(), read_only=read_only) as session:
+            session.execute(text("SELECT 1"))
+    finally:
+        database.get_engine.cache_clear()
+    assert begin in statements
+
+
+@pytest.mark.parametrize("threshold, expected", [(5, 5), (0, 0), (-1, None)])
+def test_postgresql_engine_uses_prepare_threshold(monkeypatch, mocker, threshold, expected):
+    settings = config.Settings(_env_file=None, MODE="TEST", USER="u", PASS="p", DB_NAME="todo", DB_PREPARE_THRESHOLD=threshold)
+    monkeypatch.setattr(database, "get_settings", lambda: settings)
+    create_engine = mocker.patch("to_do_list.database.create_engine")
+    database.get_engine.cache_clear()
+    try:
+        database.get_engine()
+    finally:
+        database.get_engine.cache_clear()
+    create_engine.assert_called_once_with(url=settings.database_url, connect_args={"prepare_threshold": expected, "connect_timeout": 5})
+
+
+def test_replica_urls_use_psycopg(tmp_path):
+    urls = "postgresql://u:p@replica1/todo, postgres://u:p@replica2/todo,postgresql+psycopg://u:p@replica3/todo"
+    settings = config.Settings(_env_file=None, MODE="TEST", DB_BACKEND="sqlite", DB_PATH=str(tmp_path / "todo.db"), DB_REPLICA_URLS=urls)
+    assert settings.replica_urls == [
+        "postgresql+psycopg://u:p@replica1/todo", "postgresql+psycopg://u:p@replica2/todo", "postgresql+psycopg://u:p@replica3/todo"
+    ]
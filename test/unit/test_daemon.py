@@ -0,0 +1,82 @@
+import io
+import os
+import threading
+import pytest
+from unittest.mock import Mock
+from to_do_list.client import forward
+from to_do_list.daemon import Daemon
+from to_do_list.service import TaskService
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    server = Daemon(str(tmp_path / "todo.sock"))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_forward_returns_none_when_daemon_is_not_running(tmp_path):
+    assert forward(["show"], str(tmp_path / "missing.sock")) == None
+
+
+def test_forward_runs_command_in_daemon(mocker, daemon, tasks, capfdbinary, no_recurring_tasks):
+    session = Mock()
+    mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+    mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+    mocker.patch("to_do_list.service.TaskService.iter_tasks", return_value=iter(tasks[:1]))
+    code = forward(["show", "--day", "2024-02-01"], daemon.path)
+    assert code == 0
+    assert capfdbinary.readouterr().out.decode() == "2024-02-01  1  ☐  Buy milk   \n"
+    TaskService.iter_tasks.assert_called_once()
+
+
+def test_forward_returns_exit_code_of_bad_usage(daemon, capfdbinary):
+    code = forward(["show", "--day", "someday"], daemon.path)
+    assert code == 2
+    assert "'someday' is not a correct date." in capfdbinary.readouterr().err.decode()
+
+
+def test_daemon_removes_socket_on_close(tmp_path):
+    path = str(tmp_path / "todo.sock")
+    with Daemon(path):
+        assert os.path.exists(path)
+    assert not os.path.exists(path)
+
+
+def test_client_with_other_settings_runs_command_itself(monkeypatch, daemon):
+    monkeypatch.setenv("DB_NAME", "other")
+    assert forward(["show"], daemon.path) == None
+
+
+def test_settings_fingerprint_covers_all_settings():
+    from to_do_list.client import SETTINGS_ENV
+    from to_do_list.config import Settings
+    assert set(Settings.model_fields) <= set(SETTINGS_ENV)
+
+
+def test_client_stops_quietly_when_output_is_closed(mocker, monkeypatch, daemon, tasks, no_recurring_tasks):
+    session = Mock()
+    mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+    mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+    mocker.patch("to_do_list.service.TaskService.iter_tasks", return_value=iter(tasks))
+    handle_error = mocker.patch.object(daemon, "handle_error")
+    stdout = Mock()
+    stdout.buffer.write.side_effect = BrokenPipeError
+    stdout.fileno.side_effect = io.UnsupportedOperation
+    monkeypatch.setattr("sys.stdout", stdout)
+    assert forward(["show", "--day", "2024-02-01"], daemon.path) == 0
+    # Commands are served one at a time: once this one is, the first one has finished
+    monkeypatch.setenv("DB_NAME", "other")
+    forward(["show"], daemon.path)
+    handle_error.assert_not_called()
+
+
+def test_daemon_refuses_command_for_missing_working_directory(mocker, tmp_path, daemon):
+    mocker.patch("to_do_list.client.os.getcwd", return_value=str(tmp_path / "removed"))
+    run_command = mocker.patch("to_do_list.daemon.run_command")
+    assert forward(["show"], daemon.path) == None
+    run_command.assert_not_called()
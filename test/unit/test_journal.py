@@ -0,0 +1,109 @@
+import json
+import pytest
+from datetime import date
+from unittest.mock import Mock
+from sqlalchemy.exc import OperationalError
+from to_do_list import cli
+from to_do_list.journal import Journal
+from to_do_list.memory import MemoryStore, MemoryTaskRepository
+from to_do_list.service import TaskService
+
+pytestmark = pytest.mark.usefixtures("verified_session")
+
+DAY = date(2024, 2, 1)
+
+
+@pytest.fixture
+def journal(tmp_path, mocker):
+    journal = Journal(str(tmp_path / "state" / "journal.jsonl"))
+    mocker.patch("to_do_list.cli.offline_journal", return_value=journal)
+    return journal
+
+
+def create(description):
+    return {"op": "create", "user_id": 1, "task_date": DAY, "task_description": description, "done": False, "important": False}
+
+
+def test_journal_replays_entries_and_clears(journal):
+    key = journal.append(create("Buy milk"))
+    journal.append({"op": "update", "user_id": 1, "date": DAY, "ranges": [(1, 1)], "filters": {}, "values": {"task_date": date(2024, 2, 2)}})
+    assert journal.pending()
+    with journal.replay() as entries:
+        assert [entry["key"] for entry in entries][0] == key
+        assert entries[0]["task_date"] == DAY
+        assert entries[1]["values"] == {"task_date": date(2024, 2, 2)}
+    assert not journal.pending()
+
+
+def test_journal_is_kept_if_replay_fails(journal):
+    journal.append(create("Buy milk"))
+    with pytest.raises(OperationalError):
+        with journal.replay():
+            raise OperationalError("INSERT", {}, Exception("connection refused"))
+    assert journal.pending()
+
+
+def test_journal_skips_cut_short_line(journal):
+    journal.append(create("Buy milk"))
+    with open(journal.path, "a") as f:
+        f.write('{"key": "abc", "op": "cre')
+    with journal.replay() as entries:
+        assert [entry["task_description"] for entry in entries] == ["Buy milk"]
+
+
+def test_replay_applies_every_entry_once():
+    service = TaskService(MemoryTaskRepository(MemoryStore()))
+    entries = [
+        {"key": "a", **create("Buy milk")},
+        {"key": "b", **create("Buy bread")},
+        {"key": "c", "op": "update", "user_id": 1, "date": DAY, "ranges": [[2, 2]], "filters": {}, "values": {"done": True}},
+        {"key": "d", "op": "delete", "user_id": 1, "date": DAY, "ranges": [[1, 1]], "filters": {}}
+    ]
+    assert service.replay(None, entries) == 4
+    assert service.replay(None, entries + [{"key": "e", **create("Clean the house")}]) == 1
+    assert [(task.task_description, task.done) for task in service.get_tasks(None, user_id=1, task_date=DAY)] == [("Buy bread", True), ("Clean the house", False)]
+
+
+def test_replay_sets_aside_entries_that_fail():
+    service = TaskService(MemoryTaskRepository(MemoryStore()))
+    entries = [
+        {"key": "a", **create("Buy milk")},
+        {"key": "b", "op": "update", "user_id": 1, "date": DAY, "values": {"done": True}},
+        {"key": "c", **create("Buy bread")}
+    ]
+    rejected = []
+    assert service.replay(None, entries, rejected) == 2
+    assert rejected == [entries[1]]
+    assert [task.task_description for task in service.get_tasks(None, user_id=1, task_date=DAY)] == ["Buy milk", "Buy bread"]
+
+
+def test_failing_statements_are_not_journaled(mocker, cli_runner, journal):
+    mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=Mock())
+    mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+    mocker.patch("to_do_list.service.TaskService.create", side_effect=OperationalError("INSERT", {}, Exception("database is locked")))
+    result = cli_runner.invoke(cli.add, ["Buy milk", "-d", "2024-02-01"])
+    assert result.output == "Lost connection with database\n"
+    assert not journal.pending()
+
+
+def test_add_is_journaled_when_database_is_unreachable(mocker, cli_runner, journal):
+    mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=Mock())
+    mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+    # Errors raised while connecting have no statement
+    mocker.patch("to_do_list.service.TaskService.create", side_effect=OperationalError(None, None, Exception("connection refused")))
+    result = cli_runner.invoke(cli.add, ["Buy milk", "-d", "2024-02-01", "-i"])
+    assert result.exit_code == 0
+    assert result.output.startswith("Database is unreachable")
+    with open(journal.path) as f:
+        entry = json.loads(f.readline())
+    assert entry["op"] == "create"
+    assert (entry["task_date"], entry["task_description"], entry["important"]) == ("2024-02-01", "Buy milk", True)
+
+
+def test_changes_of_recurring_tasks_are_not_journaled(mocker, cli_runner, journal):
+    mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=Mock())
+    mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+    mocker.patch("to_do_list.service.TaskService.skip_occurrences", side_effect=OperationalError("INSERT", {}, Exception("connection refused")))
+    result = cli_runner.invoke(cli.delete, ["2024-02-01", "r1"])
+    assert result.output == "Lost connection with database\n"
+    assert not journal.pending()
@@ -0,0 +1,148 @@
+import pytest
+from datetime import date, datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from to_do_list.memory import MemoryStore, MemoryTaskRepository, MemoryUserRepository, MemorySessionRepository
+from to_do_list.models import Task, User, RecurringTask
+from to_do_list.service import TaskService, UserService
+from to_do_list.exceptions import TaskNotFoundException, RecurringTaskNotFoundException, SessionHasExpiredException
+from to_do_list.custom_types import IDS, RecurringId
+
+DAY = date(2024, 2, 1)
+
+
+@pytest.fixture
+def store():
+    return MemoryStore()
+
+
+@pytest.fixture
+def user_service(store):
+    return UserService(MemoryUserRepository(store), MemorySessionRepository(store))
+
+
+@pytest.fixture
+def task_service(store, user_service):
+    user_service.create(None, User(user_name="Jack", user_password="12345"))
+    service = TaskService(MemoryTaskRepository(store))
+    service.create_many(None, [
+        {"user_id": 1, "task_date": DAY, "task_description": description, "done": done, "important": False}
+        for description, done in (("Buy milk", True), ("Buy bread", False), ("Clean the house", False))
+    ])
+    return service
+
+
+def descriptions(tasks):
+    return [task.task_description for task in tasks]
+
+
+def test_tasks_are_numbered_per_day(task_service):
+    task_service.create(None, Task(task_description="Finish report", task_date=DAY + timedelta(days=1), done=False, important=True, user_id=1))
+    assert [task.id for task in task_service.get_tasks(None, user_id=1, task_date=DAY)] == [1, 2, 3]
+    assert [task.id for task in task_service.get_tasks(None, user_id=1, task_date=DAY + timedelta(days=1))] == [1]
+    assert task_service.get_version(None, 1) == 2
+
+
+def test_numbers_are_stable_after_delete(task_service):
+    task_service.delete(None, DAY, 2, 1)
+    task_service.create(None, Task(task_description="Go to gym", task_date=DAY, done=False, important=False, user_id=1))
+    assert [(task.id, task.task_description) for task in task_service.get_tasks(None, user_id=1, task_date=DAY)] == \
+        [(1, "Buy milk"), (3, "Clean the house"), (4, "Go to gym")]
+    with pytest.raises(TaskNotFoundException):
+        task_service.update(None, DAY, 2, 1, done=True)
+
+
+def test_iter_tasks_pages_by_number(task_service):
+    assert descriptions(task_service.iter_tasks(None, 1, 1, user_id=1, task_date=DAY)) == ["Buy bread"]
+    assert descriptions(task_service.iter_tasks(None, user_id=1, task_date=DAY, done=False)) == ["Buy bread", "Clean the house"]
+
+
+def test_update_many_moves_tasks_after_last_task_of_new_day(task_service):
+    next_day = DAY + timedelta(days=1)
+    task_service.create(None, Task(task_description="Finish report", task_date=next_day, done=False, important=True, user_id=1))
+    assert task_service.update_many(None, DAY, 1, [(2, 3)], None, task_date=next_day, important=True) == 2
+    assert [(task.id, task.task_description, task.important) for task in task_service.get_tasks(None, user_id=1, task_date=next_day)] == \
+        [(1, "Finish report", True), (2, "Buy bread", True), (3, "Clean the house", True)]
+    assert descriptions(task_service.get_tasks_in_range(None, DAY, next_day, user_id=1)) == \
+        ["Buy milk", "Finish report", "Buy bread", "Clean the house"]
+
+
+def test_delete_many_by_filter(task_service):
+    assert task_service.delete_many(None, DAY, 1, None, {"done": False}) == 2
+    assert task_service.delete_many(None, DAY, 1, None, {"done": False}) == 0
+    assert descriptions(task_service.get_tasks(None)) == ["Buy milk"]
+
+
+def test_search_and_export(task_service):
+    assert descriptions(task_service.search(None, 1, "buy")) == ["Buy milk", "Buy bread"]
+    assert descriptions(task_service.search(None, 1, "ouse", substring=True)) == ["Clean the house"]
+    assert task_service.search(None, 2, "buy") == []
+    assert list(task_service.export_rows(None, user_id=1))[0] == (1, DAY, 1, "Buy milk", True, False)
+
+
+def test_users_and_sessions(user_service):
+    user_service.create(None, User(user_name="Jack", user_password="12345"))
+    with pytest.raises(IntegrityError):
+        user_service.create(None, User(user_name="Jack", user_password="54321"))
+    assert user_service.login(None, "Jack", "12345") == True
+    assert user_service.get_current_user(None) == 1
+    user_service.session_repository.create(None, 1, "old", datetime.now() - timedelta(minutes=1))
+    assert user_service.sweep_sessions(None) == 1
+    user_service.logout(None)
+    assert user_service.session_repository.store.sessions == {}
+
+
+def test_sessions_revoked_on_the_server_are_refused(user_service):
+    user_service.create(None, User(user_name="Jack", user_password="12345"))
+    user_service.login(None, "Jack", "12345")
+    user_service.verify_session(None)
+    # A logout elsewhere (with a copy of the token) revokes the session
+    user_service.session_repository.store.sessions.clear()
+    assert user_service.get_current_user(None) == 1
+    with pytest.raises(SessionHasExpiredException):
+        user_service.verify_session(None)
+
+
+def test_sessions_of_another_user_are_refused(user_service):
+    user_service.create(None, User(user_name="Jack", user_password="12345"))
+    user_service.login(None, "Jack", "12345")
+    for user_session in user_service.session_repository.store.sessions.values():
+        user_session.user_id = 2
+    with pytest.raises(SessionHasExpiredException):
+        user_service.verify_session(None)
+
+
+def test_stats_by_period(task_service):
+    task_service.create(None, Task(task_description="Finish report", task_date=date(2024, 2, 5), done=True, important=True, user_id=1))
+    assert task_service.get_stats(None, 1, date(2024, 1, 1), date(2024, 2, 29)) == [(DAY, 3, 1, 0, 0), (date(2024, 2, 5), 1, 1, 1, 1)]
+    assert task_service.get_stats(None, 1, date(2024, 1, 1), date(2024, 2, 29), by="week") == [(date(2024, 1, 29), 3, 1, 0, 0), (date(2024, 2, 5), 1, 1, 1, 1)]
+    assert task_service.get_stats(None, 1, date(2024, 1, 1), date(2024, 2, 29), by="month") == [(date(2024, 2, 1), 4, 2, 1, 1)]
+
+
+def test_archived_tasks_are_only_counted(task_service):
+    task_service.create(None, Task(task_description="Finish report", task_date=DAY + timedelta(days=1), done=False, important=True, user_id=1))
+    assert task_service.archive(None, DAY + timedelta(days=1)) == 3
+    assert task_service.get_tasks(None, user_id=1, task_date=DAY) == []
+    assert [row[:3] for row in task_service.get_stats(None, 1, DAY, DAY + timedelta(days=1))] == [(DAY, 3, 1), (DAY + timedelta(days=1), 1, 0)]
+
+
+def test_recurring_tasks_are_expanded_until_changed(task_service):
+    task_service.create_recurring(None, RecurringTask(task_description="Water plants", important=False, rule="weekdays", start_date=DAY, end_date=None, user_id=1))
+    task_service.create_recurring(None, RecurringTask(task_description="Pay rent", important=True, rule="monthly", start_date=date(2024, 1, 31), end_date=None, user_id=1))
+    occurrences = lambda date_from, date_to, **filters: [(t.task_date, t.id) for t in task_service.get_occurrences(None, 1, date_from, date_to, **filters)]
+    # 2024-02-03 and 04 are a weekend, February has no 31st
+    assert occurrences(DAY, date(2024, 2, 5)) == [(DAY, "r1"), (date(2024, 2, 2), "r1"), (date(2024, 2, 5), "r1")]
+    assert occurrences(date(2024, 3, 29), date(2024, 3, 31), important=True) == [(date(2024, 3, 31), "r2")]
+    assert occurrences(DAY, DAY, done=True) == []
+    assert task_service.materialize(None, DAY, 1, [RecurringId("r1"), RecurringId("r2")], done=True) == 1
+    assert task_service.skip_occurrences(None, date(2024, 2, 2), 1, [RecurringId("r1"), RecurringId("r1")]) == 1
+    assert occurrences(DAY, date(2024, 2, 5)) == [(date(2024, 2, 5), "r1")]
+    assert [(t.id, t.task_description, t.done) for t in task_service.get_tasks(None, user_id=1, task_date=DAY)][-1] == (4, "Water plants", True)
+    task_service.delete_recurring(None, 1, 1)
+    with pytest.raises(RecurringTaskNotFoundException):
+        task_service.delete_recurring(None, 1, 1)
+    assert occurrences(DAY, date(2024, 2, 5)) == []
+
+
+def test_ids_keep_occurrences_of_recurring_tasks():
+    assert IDS.convert("1-3,r2", None, None) == [(1, 3), "r2"]
+    assert IDS.convert("r12", None, None)[0].recurring_id == 12
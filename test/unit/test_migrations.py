@@ -0,0 +1,35 @@
+import pytest
+from sqlalchemy import text
+from to_do_list import config, database
+
+BASELINE_SCHEMA = [
+    "CREATE TABLE app_user (id INTEGER PRIMARY KEY, user_name VARCHAR(20) NOT NULL UNIQUE, user_password VARCHAR(20) NOT NULL)",
+    "CREATE TABLE task (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES app_user (id), task_date DATE NOT NULL, "
+    "task_description VARCHAR(150) NOT NULL, done BOOLEAN NOT NULL, important BOOLEAN NOT NULL, timestamp TIMESTAMP NOT NULL)",
+    "CREATE TABLE user_session (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES app_user (id), last_updated DATETIME NOT NULL)",
+    "INSERT INTO app_user VALUES (1, 'Jack', '12345')",
+    "INSERT INTO task VALUES (1, 1, '2024-02-01', 'Buy milk', 0, 0, '2024-02-01 10:00:00'), (2, 1, '2024-02-01', 'Buy bread', 1, 0, '2024-02-01 11:00:00')"
+]
+
+
+@pytest.fixture
+def baseline_database(monkeypatch, tmp_path):
+    """A database created by 'todo init' before migrations were added"""
+    settings = config.Settings(_env_file=None, MODE="TEST", DB_BACKEND="sqlite", DB_PATH=str(tmp_path / "todo.db"))
+    monkeypatch.setattr(database, "get_settings", lambda: settings)
+    database.get_engine.cache_clear()
+    with database.get_engine().begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.exec_driver_sql(statement)
+    yield database.get_engine()
+    database.get_engine.cache_clear()
+
+
+@pytest.mark.parametrize("command", [database.db_migrate, database.db_init])
+def test_database_of_baseline_is_migrated(baseline_database, command):
+    command()
+    with baseline_database.connect() as connection:
+        assert connection.execute(text("SELECT version_num FROM alembic_version")).scalar() == "0011"
+        rows = connection.execute(text("SELECT number, task_description FROM task ORDER BY number")).all()
+        assert connection.execute(text("SELECT last_number FROM day_number")).scalar() == 2
+    assert [tuple(row) for row in rows] == [(1, "Buy milk"), (2, "Buy bread")]
@@ -0,0 +1,20 @@
+from datetime import date
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import CreateTable
+from to_do_list.models import Task
+from to_do_list.partitions import add_months, partition_name
+
+
+def test_months_and_partition_names():
+    assert add_months(date(2024, 11, 15), 0) == date(2024, 11, 1)
+    assert add_months(date(2024, 11, 15), 3) == date(2025, 2, 1)
+    assert partition_name(date(2025, 2, 1)) == "task_2025_02"
+
+
+def test_task_table_is_partitioned_on_postgresql_only():
+    ddl = str(CreateTable(Task.__table__).compile(dialect=postgresql.dialect()))
+    assert "PRIMARY KEY (id, task_date)" in ddl
+    assert "PARTITION BY RANGE (task_date)" in ddl
+    ddl = str(CreateTable(Task.__table__).compile(dialect=sqlite.dialect()))
+    assert "PRIMARY KEY (id)" in ddl
+    assert "PARTITION" not in ddl
@@ -0,0 +1,39 @@
+import json
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from to_do_list.cli import cli
+from to_do_list.profiling import Profiler, format_profile
+
+
+def test_profiler_counts_statements_and_commits():
+    engine = create_engine("sqlite://")
+    profiler = Profiler("show", [])
+    with Session(engine) as session:
+        session.execute(text("CREATE TABLE t (x INTEGER)"))
+        session.execute(text("INSERT INTO t VALUES (1), (2)"))
+        session.commit()
+    profile = profiler.stop()
+    assert profile["connections"] == 1
+    assert profile["statement_count"] == 2
+    assert profile["statements"][1]["rows"] == 2
+    assert profile["phases_ms"]["commit"] > 0
+    assert "2 statements" in format_profile(profile)
+    # Listeners are removed after the command
+    with Session(engine) as session:
+        session.execute(text("SELECT 1"))
+    assert len(profiler.statements) == 2
+
+
+def test_profile_log_is_appended_as_json_lines(cli_runner, tmp_path):
+    log = tmp_path / "profile.jsonl"
+    for _ in range(2):
+        result = cli_runner.invoke(cli, ["--profile-log", str(log), "migrate", "--help"])
+        assert result.exit_code == 0
+    profiles = [json.loads(line) for line in log.read_text().splitlines()]
+    assert [profile["command"] for profile in profiles] == ["migrate", "migrate"]
+    assert set(profiles[0]["phases_ms"]) == {"startup", "imports", "connect", "sql", "commit", "other", "total"}
+
+
+def test_profiling_is_enabled_from_environment(cli_runner):
+    result = cli_runner.invoke(cli, ["migrate", "--help"], env={"TODO_PROFILE": "1"})
+    assert "Profile of 'migrate'" in result.output
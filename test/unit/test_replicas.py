@@ -0,0 +1,56 @@
+import os
+from unittest.mock import MagicMock
+from sqlalchemy import column, create_engine, table, text, update
+from sqlalchemy.exc import OperationalError
+from to_do_list import database
+from to_do_list.database import ReplicaSet, RoutingSession
+
+
+def engine_with_name(path, name):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE server (name TEXT)"))
+        connection.execute(text("INSERT INTO server VALUES (:name)"), {"name": name})
+    return engine
+
+
+def server_name(session):
+    return session.execute(text("SELECT name FROM server")).scalar_one()
+
+
+def test_replicas_are_used_in_turn_and_skipped_when_down(tmp_path):
+    first, second = MagicMock(), MagicMock()
+    second.connect.side_effect = OperationalError("SELECT 1", {}, Exception("refused"))
+    replicas = ReplicaSet([first, second])
+    replicas.next = 0
+    assert replicas.pick() is first
+    # The second is down: it is skipped without a new connection attempt until retry_after passes
+    assert replicas.pick() is first
+    assert replicas.pick() is first
+    assert second.connect.call_count == 1
+
+
+def test_reads_go_to_the_primary_after_a_write(tmp_path):
+    replicas = ReplicaSet([MagicMock()], str(tmp_path / "state" / "last_write"), sticky_seconds=5)
+    assert replicas.pick() != None
+    replicas.note_write()
+    assert replicas.pick() == None
+    os.utime(replicas.state_path, (0, 0))
+    assert replicas.pick() != None
+
+
+def test_routing_session(tmp_path, mocker):
+    primary = engine_with_name(tmp_path / "primary.db", "primary")
+    replicas = ReplicaSet([engine_with_name(tmp_path / "replica.db", "replica")], str(tmp_path / "last_write"), 5)
+    mocker.patch.object(database, "get_replicas", return_value=replicas)
+    with RoutingSession(bind=primary) as session:
+        assert server_name(session) == "primary"
+    with RoutingSession(bind=primary, read_only=True) as session:
+        assert server_name(session) == "replica"
+        server = table("server", column("name"))
+        session.execute(update(server).values(name=server.c.name))
+        # Once the session wrote, it reads what it wrote
+        assert server_name(session) == "primary"
+        session.commit()
+    with RoutingSession(bind=primary, read_only=True) as session:
+        assert server_name(session) == "primary"
@@ -0,0 +1,41 @@
+from datetime import date
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from to_do_list.database import Base
+from to_do_list.models import Task, User
+from to_do_list.repository import TaskRepository
+
+DAY = date(2024, 2, 1)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(user_name="Jack", user_password="12345"))
+        session.flush()
+        yield session
+
+
+def add_task(session, description, day=DAY):
+    TaskRepository().create(session, Task(task_description=description, task_date=day, done=False, important=False, user_id=1))
+    session.flush()
+
+
+def test_update_many_to_the_same_day_changes_nothing(session):
+    add_task(session, "Buy milk")
+    assert TaskRepository().update_many(session, DAY, 1, [(1, 1)], {}, task_date=DAY) == 1
+    assert [(task.id, task.task_description) for task in TaskRepository().get_tasks(session, user_id=1, task_date=DAY)] == [(1, "Buy milk")]
+
+
+def test_numbers_of_deleted_tasks_are_not_given_again(session):
+    add_task(session, "Buy milk")
+    add_task(session, "Buy bread")
+    TaskRepository().delete(session, DAY, 2, 1)
+    add_task(session, "Clean the house")
+    TaskRepository().create_many(session, [
+        {"user_id": 1, "task_date": DAY, "task_description": "Go to gym", "done": False, "important": False}
+    ])
+    assert [task.id for task in TaskRepository().get_tasks(session, user_id=1, task_date=DAY)] == [1, 3, 4]
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ("sqlalchemy", "pydantic", "pydantic_settings", "psycopg", "alembic")
+# Cumulative import time of to_do_list.cli in microseconds
+IMPORT_BUDGET = 200_000
+
+
+def run_python(code, *args, **kwargs):
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", code, *args], capture_output=True, text=True, **kwargs)
+
+
+def cumulative_import_time(stderr, module):
+    for line in stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise AssertionError(f"{module} was not imported")
+
+
+def test_cli_import_does_not_load_database_modules():
+    result = run_python("import sys, to_do_list.cli; print(sorted({m.split('.')[0] for m in sys.modules}))")
+    loaded = eval(result.stdout)
+    assert [module for module in HEAVY_MODULES if module in loaded] == []
+
+
+def test_cli_import_fits_startup_budget():
+    result = run_python("import to_do_list.cli")
+    assert cumulative_import_time(result.stderr, "to_do_list.cli") < IMPORT_BUDGET
+
+
+def test_help_works_without_database_settings(tmp_path):
+    env = {k: v for k, v in os.environ.items() if k not in ("DB_HOST", "DB_PORT", "USER", "PASS", "DB_NAME", "MODE")}
+    result = run_python("from to_do_list.client import main; main()", "--help", cwd=tmp_path, env=env)
+    assert result.returncode == 0
+    assert "To-do list CLI app" in result.stdout
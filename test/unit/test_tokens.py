@@ -0,0 +1,80 @@
+import os
+import stat
+import time
+import pytest
+from datetime import timedelta
+from unittest.mock import Mock
+from to_do_list.tokens import TokenStore, InvalidTokenError, sign, verify
+from to_do_list.service import UserService
+from to_do_list.models import User
+from to_do_list.exceptions import SessionHasExpiredException, UserNotLoggedInException
+
+
+def test_signed_token_is_verified():
+    token = sign({"uid": 1, "exp": 10}, b"key")
+    assert verify(token, b"key") == {"uid": 1, "exp": 10}
+
+
+@pytest.mark.parametrize("token", ["", "abc", "abc.def.ghi"])
+def test_malformed_token_is_rejected(token):
+    with pytest.raises(InvalidTokenError):
+        verify(token, b"key")
+
+
+def test_token_signed_with_another_key_is_rejected():
+    with pytest.raises(InvalidTokenError):
+        verify(sign({"uid": 1}, b"key"), b"other key")
+
+
+def test_token_store_keeps_token_in_private_file(tmp_path):
+    store = TokenStore(str(tmp_path / "state" / "session"))
+    assert store.load() == None
+    store.save("token")
+    assert TokenStore(store.path).load() == "token"
+    assert stat.S_IMODE(os.stat(store.path).st_mode) == 0o600
+    store.clear()
+    assert store.load() == None
+
+
+@pytest.fixture
+def user_service():
+    user_repository = Mock()
+    user_repository.get_by_username_and_password.return_value = User(id=5, user_name="Jack", user_password="12345")
+    return UserService(user_repository, Mock(), TokenStore(), b"key")
+
+
+def test_get_current_user_does_not_query_database(user_service):
+    session = Mock()
+    assert user_service.login(session, "Jack", "12345") == True
+    session.reset_mock()
+    assert user_service.get_current_user(session) == 5
+    assert session.mock_calls == []
+
+
+def test_login_sweeps_expired_sessions(user_service):
+    user_service.login(Mock(), "Jack", "12345")
+    user_service.session_repository.delete_expired.assert_called_once()
+    user_service.session_repository.create.assert_called_once()
+
+
+def test_get_current_user_raises_when_token_expired(user_service):
+    user_service.session_ttl = timedelta(seconds=-1)
+    user_service.login(Mock(), "Jack", "12345")
+    with pytest.raises(SessionHasExpiredException):
+        user_service.get_current_user(Mock())
+
+
+def test_logout_deletes_session_and_token(user_service):
+    session = Mock()
+    user_service.login(session, "Jack", "12345")
+    token = user_service.session_repository.create.call_args.args[2]
+    user_service.logout(session)
+    user_service.session_repository.delete.assert_called_once_with(session, token)
+    with pytest.raises(UserNotLoggedInException):
+        user_service.get_current_user(session)
+
+
+def test_forged_token_is_not_accepted(user_service):
+    user_service.token_store.save(sign({"sid": "x", "uid": 1, "exp": time.time() + 60}, b"guess"))
+    with pytest.raises(UserNotLoggedInException):
+        user_service.get_current_user(Mock())
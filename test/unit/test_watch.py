@@ -0,0 +1,47 @@
+import json
+from datetime import date
+from unittest.mock import Mock
+from to_do_list.cli import watch_tasks
+from to_do_list.models import TaskRow
+from to_do_list.service import TaskService
+from to_do_list.watch import VersionFeed, diff_tasks, format_days, parse_days
+
+DAY = date(2024, 2, 1)
+
+
+def test_days_of_notifications():
+    assert format_days([date(2024, 2, 2), DAY, DAY]) == "2024-02-01,2024-02-02"
+    assert parse_days("2024-02-01,2024-02-02") == {DAY, date(2024, 2, 2)}
+    assert parse_days("") == None
+
+
+def test_diff_tasks_by_day_and_number():
+    old = [TaskRow("Buy milk", DAY, False, False, 1, 1), TaskRow("Buy bread", DAY, False, False, 1, 2)]
+    new = [TaskRow("Buy milk", DAY, True, False, 1, 1), TaskRow("Clean the house", DAY, False, False, 1, 3)]
+    assert diff_tasks(old, new) == ([new[1]], [new[0]], [old[1]])
+
+
+def test_version_feed_yields_on_version_changes():
+    versions = iter([1, 1, 2, 2, 3])
+    feed = iter(VersionFeed(lambda: next(versions), 1, sleep=lambda seconds: None))
+    assert next(feed) == None
+    assert next(feed) == None
+
+
+def test_watch_writes_changes_as_json(mocker, cli_runner, no_recurring_tasks):
+    session = Mock()
+    mocker.patch("sqlalchemy.orm.session.Session.__enter__", return_value=session)
+    mocker.patch("to_do_list.service.UserService.get_current_user", return_value=1)
+    mocker.patch("to_do_list.watch.time.sleep")
+    mocker.patch("to_do_list.service.TaskService.get_version", side_effect=[1, 2, 2, KeyboardInterrupt])
+    mocker.patch("to_do_list.service.TaskService.get_tasks_in_range", side_effect=[
+        iter([TaskRow("Buy milk", DAY, False, False, 1, 1)]),
+        iter([TaskRow("Buy milk", DAY, True, False, 1, 1)])
+    ])
+    result = cli_runner.invoke(watch_tasks, ["--day", "2024-02-01", "--output", "json"])
+    assert result.exit_code == 0
+    lines = [json.loads(line) for line in result.output.splitlines()]
+    assert lines[0] == {"tasks": [{"task_date": "2024-02-01", "id": 1, "task_description": "Buy milk", "done": False, "important": False}]}
+    assert lines[1]["changed"] == [{"task_date": "2024-02-01", "id": 1, "task_description": "Buy milk", "done": True, "important": False}]
+    assert len(lines) == 2
+    TaskService.get_tasks_in_range.assert_called_with(session, DAY, DAY, user_id=1)